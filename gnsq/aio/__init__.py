@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""gnsq.aio
+
+Native asyncio consumer and producer. Requires python 3.5+.
+"""
+import sys
+
+if sys.version_info < (3, 5):
+    raise ImportError('gnsq.aio requires python 3.5 or later')
+
+from .consumer import AsyncConsumer
+from .nsqd import AsyncNsqdTCPClient
+from .producer import AsyncProducer
+
+
+__all__ = [
+    'AsyncConsumer',
+    'AsyncNsqdTCPClient',
+    'AsyncProducer',
+]
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import random
+import time
+
+from collections import defaultdict
+from itertools import cycle
+
+import blinker
+
+from ..decorators import cached_property
+from ..errors import NSQException, NSQRequeueMessage
+from ..readystate import ReadyStateMixin
+from ..states import INIT, RUNNING, THROTTLED, CLOSED
+from ..util import parse_nsqds, parse_lookupds
+from .nsqd import AsyncNsqdTCPClient
+
+
+class AsyncConsumer(ReadyStateMixin):
+    """High level asyncio NSQ consumer.
+
+    The asyncio counterpart of :class:`~gnsq.Consumer`. It accepts the same
+    arguments and distributes RDY counts and backs off failed messages the same
+    way, but ``message_handler`` must be a coroutine function. Each message is
+    handled in its own task, so up to ``max_in_flight`` handlers run
+    concurrently.
+
+    Example usage::
+
+        from gnsq.aio import AsyncConsumer
+
+        async def handler(consumer, message):
+            print('got message:', message.body)
+
+        consumer = AsyncConsumer('topic', 'channel', 'localhost:4150',
+                                 message_handler=handler, max_in_flight=32)
+        await consumer.start()
+
+    :param **kwargs: passed to :class:`~gnsq.aio.AsyncNsqdTCPClient`
+        initialization
+    """
+    def __init__(self, topic, channel, nsqd_tcp_addresses=[],
+                 lookupd_http_addresses=[], name=None, message_handler=None,
+                 max_tries=5, max_in_flight=1, requeue_delay=0,
+                 lookupd_poll_interval=60, lookupd_poll_jitter=0.3,
+                 low_ready_idle_timeout=10, max_backoff_duration=128,
+                 backoff_on_requeue=True, **kwargs):
+        if not nsqd_tcp_addresses and not lookupd_http_addresses:
+            raise ValueError('must specify at least one nsqd or lookupd')
+
+        self.nsqd_tcp_addresses = parse_nsqds(nsqd_tcp_addresses)
+        self.lookupds = parse_lookupds(lookupd_http_addresses)
+        self.iterlookupds = cycle(self.lookupds)
+
+        self.topic = topic
+        self.channel = channel
+        self.message_handler = message_handler
+        self.max_tries = max_tries
+        self.max_in_flight = max_in_flight
+        self.requeue_delay = requeue_delay
+        self.lookupd_poll_interval = lookupd_poll_interval
+        self.lookupd_poll_jitter = lookupd_poll_jitter
+        self.low_ready_idle_timeout = low_ready_idle_timeout
+        self.backoff_on_requeue = backoff_on_requeue
+        self.max_backoff_duration = max_backoff_duration
+        self.conn_kwargs = kwargs
+
+        if name:
+            self.name = name
+        else:
+            self.name = '%s.%s.%s' % (__name__, self.topic, self.channel)
+
+        self.logger = logging.getLogger(self.name)
+
+        self._state = INIT
+        self._redistributed_ready_event = None
+        self._connection_backoffs = defaultdict(self._create_backoff)
+        self._message_backoffs = defaultdict(self._create_backoff)
+
+        self._connections = {}
+        self._workers = set()
+        self._killables = set()
+        self._handlers = set()
+
+    @cached_property
+    def on_response(self):
+        """Emitted when a response is received.
+
+        The signal sender is the consumer and the ``response`` is sent as an
+        argument.
+        """
+        return blinker.Signal(doc='Emitted when a response is received.')
+
+    @cached_property
+    def on_error(self):
+        """Emitted when an error is received.
+
+        The signal sender is the consumer and the ``error`` is sent as an
+        argument.
+        """
+        return blinker.Signal(doc='Emitted when a error is received.')
+
+    @cached_property
+    def on_finish(self):
+        """Emitted after a message is successfully finished.
+
+        The signal sender is the consumer and the ``message_id`` is sent as an
+        argument.
+        """
+        return blinker.Signal(doc='Emitted after the a message is finished.')
+
+    @cached_property
+    def on_requeue(self):
+        """Emitted after a message is requeued.
+
+        The signal sender is the consumer and the ``message_id`` and ``timeout``
+        are sent as arguments.
+        """
+        return blinker.Signal(doc='Emitted after the a message is requeued.')
+
+    @cached_property
+    def on_giving_up(self):
+        """Emitted after a giving up on a message.
+
+        The signal sender is the consumer and the ``message`` is sent as an
+        argument.
+        """
+        return blinker.Signal(doc='Sent after a giving up on a message.')
+
+    @cached_property
+    def on_exception(self):
+        """Emitted when an exception is caught while handling a message.
+
+        The signal sender is the consumer and the ``message`` and ``error`` are
+        sent as arguments.
+        """
+        return blinker.Signal(doc='Emitted when an exception is caught.')
+
+    @cached_property
+    def on_close(self):
+        """Emitted after :meth:`close`.
+
+        The signal sender is the consumer.
+        """
+        return blinker.Signal(doc='Emitted after the consumer is closed.')
+
+    async def start(self, block=True):
+        """Start discovering and listing to connections."""
+        if self._state == INIT:
+            if self.message_handler is None:
+                raise RuntimeError('no message_handler provided')
+
+            self.logger.debug('starting %s...', self.name)
+            self._state = RUNNING
+            self._redistributed_ready_event = asyncio.Event()
+            await self.query_nsqd()
+
+            if self.lookupds:
+                await self.query_lookupd()
+                self._killables.add(self._spawn(self._poll_lookupd()))
+
+            self._killables.add(self._spawn(self._poll_ready()))
+
+        else:
+            self.logger.warning('%s already started', self.name)
+
+        if block:
+            await self.join()
+
+    def close(self):
+        """Immediately close all connections and stop workers."""
+        if not self.is_running:
+            return
+
+        self._state = CLOSED
+
+        self.logger.debug('killing %d worker(s)', len(self._killables))
+        for task in self._killables:
+            task.cancel()
+
+        self.logger.debug('closing %d connection(s)', len(self._connections))
+        for conn in list(self._connections):
+            conn.close_stream()
+
+        self.on_close.send(self)
+
+    async def join(self, timeout=None):
+        """Wait until all connections have closed and workers stopped."""
+        while self._workers:
+            done, pending = await asyncio.wait(self._workers, timeout=timeout)
+            if pending:
+                return
+
+    @property
+    def is_running(self):
+        """Check if consumer is currently running."""
+        return self._state == RUNNING
+
+    @property
+    def is_starved(self):
+        """Evaluate whether any of the connections are starved."""
+        return any(conn.is_starved for conn in self._connections)
+
+    @property
+    def total_ready_count(self):
+        return sum(c.ready_count for c in self._connections)
+
+    @property
+    def total_in_flight(self):
+        return sum(c.in_flight for c in self._connections)
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._workers.add(task)
+        task.add_done_callback(self._workers.discard)
+        return task
+
+    def _call_later(self, seconds, func, *args):
+        asyncio.get_event_loop().call_later(seconds, func, *args)
+
+    def redistribute_ready_state(self):
+        self._redistributed_ready_event.set()
+
+    async def query_nsqd(self):
+        self.logger.debug('querying nsqd...')
+        for address in self.nsqd_tcp_addresses:
+            address, port = address.split(':')
+            await self.connect_to_nsqd(address, int(port))
+
+    async def query_lookupd(self):
+        self.logger.debug('querying lookupd...')
+        lookupd = next(self.iterlookupds)
+        loop = asyncio.get_event_loop()
+
+        try:
+            response = await loop.run_in_executor(
+                None, lookupd.lookup, self.topic)
+            producers = response['producers']
+            self.logger.debug('found %d producers', len(producers))
+
+        except Exception as error:
+            self.logger.warning(
+                'Failed to lookup %s on %s (%s)',
+                self.topic, lookupd.address, error)
+            return
+
+        for producer in producers:
+            await self.connect_to_nsqd(
+                producer['broadcast_address'], producer['tcp_port'])
+
+    async def _poll_lookupd(self):
+        delay = self.lookupd_poll_interval * self.lookupd_poll_jitter
+        await asyncio.sleep(random.random() * delay)
+
+        while True:
+            await asyncio.sleep(self.lookupd_poll_interval)
+            await self.query_lookupd()
+
+    async def _poll_ready(self):
+        event = self._redistributed_ready_event
+        loop = asyncio.get_event_loop()
+
+        while True:
+            timer = loop.call_later(5, event.set)
+            try:
+                await event.wait()
+            finally:
+                timer.cancel()
+
+            event.clear()
+            self._close_timed_out_connections()
+            self._redistribute_ready_state()
+
+    def _close_timed_out_connections(self):
+        now = time.time()
+        for conn in list(self._connections):
+            if now - conn.last_response > conn.timeout:
+                self.logger.warning('[%s] connection timed out', conn)
+                conn.close_stream()
+
+    async def connect_to_nsqd(self, address, port):
+        if not self.is_running:
+            return
+
+        conn = AsyncNsqdTCPClient(address, port, **self.conn_kwargs)
+        if conn in self._connections:
+            self.logger.debug('[%s] already connected', conn)
+            return
+
+        self._connections[conn] = INIT
+        self.logger.debug('[%s] connecting...', conn)
+
+        conn.on_message.connect(self.handle_message)
+        conn.on_response.connect(self.handle_response)
+        conn.on_error.connect(self.handle_error)
+        conn.on_finish.connect(self.handle_finish)
+        conn.on_requeue.connect(self.handle_requeue)
+
+        try:
+            await conn.connect()
+            await conn.identify()
+            conn.subscribe(self.topic, self.channel)
+
+        except NSQException as error:
+            self.logger.warning('[%s] connection failed (%r)', conn, error)
+            self.handle_connection_failure(conn)
+            return
+
+        # Check if we've closed since we started
+        if not self.is_running:
+            self.handle_connection_failure(conn)
+            return
+
+        self.logger.info('[%s] connection successful', conn)
+        self.handle_connection_success(conn)
+
+    async def _listen(self, conn):
+        try:
+            await conn.listen()
+        except NSQException as error:
+            self.logger.warning('[%s] connection lost (%r)', conn, error)
+
+        self.handle_connection_failure(conn)
+
+    def handle_connection_success(self, conn):
+        self._connections[conn] = THROTTLED
+        self._spawn(self._listen(conn))
+        self.redistribute_ready_state()
+
+        if str(conn) not in self.nsqd_tcp_addresses:
+            return
+
+        self._connection_backoffs[conn].success()
+
+    def handle_connection_failure(self, conn):
+        self._connections.pop(conn, None)
+        conn.close_stream()
+
+        if not self.is_running:
+            return
+
+        self.redistribute_ready_state()
+
+        if str(conn) not in self.nsqd_tcp_addresses:
+            return
+
+        seconds = self._connection_backoffs[conn].failure().get_interval()
+        self.logger.debug('[%s] retrying in %ss', conn, seconds)
+
+        self._call_later(seconds, self._reconnect, conn.address, conn.port)
+
+    def _reconnect(self, address, port):
+        self._spawn(self.connect_to_nsqd(address, port))
+
+    def handle_response(self, conn, response):
+        self.logger.debug('[%s] response: %s', conn, response)
+        self.on_response.send(self, response=response)
+
+    def handle_error(self, conn, error):
+        self.logger.debug('[%s] error: %s', conn, error)
+        self.on_error.send(self, error=error)
+
+    def handle_message(self, conn, message):
+        self.logger.debug('[%s] got message: %s', conn, message.id)
+        task = asyncio.ensure_future(self._run_handler(conn, message))
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+
+    async def _handle_message(self, message):
+        if self.max_tries and message.attempts > self.max_tries:
+            self.logger.warning(
+                "giving up on message '%s' after max tries %d",
+                message.id, self.max_tries)
+            self.on_giving_up.send(self, message=message)
+            return message.finish()
+
+        await self.message_handler(self, message)
+
+        if not self.is_running:
+            return
+
+        if message.is_async():
+            return
+
+        if message.has_responded():
+            return
+
+        message.finish()
+
+    async def _run_handler(self, conn, message):
+        try:
+            return await self._handle_message(message)
+
+        except NSQRequeueMessage as error:
+            if error.backoff is None:
+                backoff = self.backoff_on_requeue
+            else:
+                backoff = error.backoff
+
+        except Exception as error:
+            backoff = True
+            self.logger.exception(
+                '[%s] caught exception while handling message', conn)
+            self.on_exception.send(self, message=message, error=error)
+
+        if not self.is_running:
+            return
+
+        if message.has_responded():
+            return
+
+        try:
+            message.requeue(self.requeue_delay, backoff)
+        except NSQException as error:
+            self.logger.warning(
+                '[%s] error requeueing message (%r)', conn, error)
+
+    def handle_finish(self, conn, message_id):
+        self.logger.debug('[%s] finished message: %s', conn, message_id)
+        self._finish_message(conn, backoff=False)
+        self.on_finish.send(self, message_id=message_id)
+
+    def handle_requeue(self, conn, message_id, timeout, backoff):
+        self.logger.debug(
+            '[%s] requeued message: %s (%s)', conn, message_id, timeout)
+        self._finish_message(conn, backoff=backoff)
+        self.on_requeue.send(self, message_id=message_id, timeout=timeout)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from errno import ENOTCONN
+
+from .. import protocol as nsq
+from .. import errors
+
+from ..nsqd import NsqdTCPClient
+from ..states import CONNECTED, DISCONNECTED
+
+
+class AsyncNsqdTCPClient(NsqdTCPClient):
+    """Low level asyncio TCP connection to nsqd.
+
+    Accepts the same arguments as :class:`~gnsq.NsqdTCPClient`. Commands are
+    written to the transport without blocking so :meth:`finish`,
+    :meth:`requeue`, :meth:`ready`, :meth:`publish` etc. are plain methods;
+    anything that reads from nsqd is a coroutine.
+
+    TLS and stream compression are not supported by the asyncio client. Only
+    the backend's state lock is used, so it defaults to the ``'threading'``
+    backend and does not need gevent.
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('backend', 'threading')
+        super(AsyncNsqdTCPClient, self).__init__(*args, **kwargs)
+
+        if self.tls_v1 or self.snappy or self.deflate:
+            raise ValueError(
+                'tls and compression are not supported by the asyncio client')
+
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        """Initialize connection to the nsqd."""
+        if self.state == DISCONNECTED:
+            raise errors.NSQException('connection already closed')
+
+        if self.is_connected:
+            return
+
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.address, self.port),
+                self.timeout)
+
+        except (OSError, asyncio.TimeoutError) as error:
+            raise errors.NSQSocketError(*error.args) from error
+
+        self.state = CONNECTED
+        self.send(nsq.MAGIC_V2)
+
+    def close_stream(self):
+        """Close the underlying transport."""
+        if not self.is_connected:
+            return
+
+        self._writer.close()
+        self.state = DISCONNECTED
+        self.on_close.send(self)
+
+    def send(self, data):
+        if not self.is_connected:
+            raise errors.NSQSocketError(ENOTCONN, 'Socket is not connected')
+        self._writer.write(data)
+
+    async def drain(self):
+        """Wait until the transport's write buffer has been flushed."""
+        try:
+            await self._writer.drain()
+        except OSError as error:
+            self.close_stream()
+            raise errors.NSQSocketError(*error.args) from error
+
+    async def _read_response(self):
+        if not self.is_connected:
+            raise errors.NSQSocketError(ENOTCONN, 'Socket is not connected')
+
+        try:
+            size = nsq.unpack_size(await self._reader.readexactly(4))
+            return await self._reader.readexactly(size)
+
+        except asyncio.IncompleteReadError as error:
+            self.close_stream()
+            raise errors.NSQSocketError(
+                ENOTCONN, 'Socket is not connected') from error
+
+        except OSError as error:
+            self.close_stream()
+            raise errors.NSQSocketError(*error.args) from error
+
+    async def read_response(self):
+        """Read an individual response from nsqd.
+
+        :returns: tuple of the frame type and the processed data.
+        """
+        return self._process_response(await self._read_response())
+
+    async def listen(self):
+        """Listen to incoming responses until the connection closes."""
+        while self.is_connected:
+            await self.read_response()
+
+    async def check_ok(self, expected=nsq.OK):
+        frame, data = await self.read_response()
+        if frame == nsq.FRAME_TYPE_ERROR:
+            raise data
+
+        if frame != nsq.FRAME_TYPE_RESPONSE:
+            raise errors.NSQException('expected response frame')
+
+        if data != expected:
+            raise errors.NSQException('unexpected response {!r}'.format(data))
+
+    async def identify(self):
+        """Update client metadata on the server and negotiate features.
+
+        :returns: nsqd response data if there was feature negotiation,
+            otherwise ``None``
+        """
+        self.send(nsq.identify(self._identify_options()))
+        frame, data = await self.read_response()
+
+        data = self._parse_identify_response(frame, data)
+        if data is None:
+            return
+
+        if self.auth_secret and data.get('auth_required'):
+            await self.auth()
+
+        return data
+
+    async def auth(self):
+        """Send authorization secret to nsqd."""
+        self.send(nsq.auth(self.auth_secret))
+        frame, data = await self.read_response()
+        return self._handle_auth_response(frame, data)
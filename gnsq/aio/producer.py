@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+
+from collections import defaultdict, deque
+
+import blinker
+
+from .. import protocol as nsq
+
+from ..backofftimer import BackoffTimer
+from ..decorators import cached_property
+from ..errors import NSQException, NSQNoConnections
+from ..states import INIT, RUNNING, CLOSED
+from ..util import parse_nsqds
+from .nsqd import AsyncNsqdTCPClient
+
+
+class AsyncProducer(object):
+    """High level asyncio NSQ producer.
+
+    The asyncio counterpart of :class:`~gnsq.Producer`. Publishes are
+    pipelined: each command is written immediately and its response is matched
+    to a future in the order nsqd replies, so many publishes can be
+    outstanding on a single connection.
+
+    Example publishing a message::
+
+        from gnsq.aio import AsyncProducer
+
+        producer = AsyncProducer('localhost:4150')
+        await producer.start()
+        await producer.publish('topic', b'hello world')
+
+    :param nsqd_tcp_addresses: a sequence of string addresses of the nsqd
+        instances this producer should connect to
+
+    :param max_backoff_duration: the maximum time we will allow a backoff state
+        to last in seconds. If zero, backoff wil not occur
+
+    :param **kwargs: passed to :class:`~gnsq.aio.AsyncNsqdTCPClient`
+        initialization
+    """
+    def __init__(self, nsqd_tcp_addresses=[], max_backoff_duration=128,
+                 **kwargs):
+        if not nsqd_tcp_addresses:
+            raise ValueError('must specify at least one nsqd or lookupd')
+
+        self.nsqd_tcp_addresses = parse_nsqds(nsqd_tcp_addresses)
+        self.max_backoff_duration = max_backoff_duration
+        self.conn_kwargs = kwargs
+        self.logger = logging.getLogger(__name__)
+
+        self._state = INIT
+        self._connections = deque()
+        self._connected = None
+        self._connection_backoffs = defaultdict(self._create_backoff)
+        self._response_queues = {}
+        self._workers = set()
+
+    @cached_property
+    def on_response(self):
+        """Emitted when a response is received.
+
+        The signal sender is the producer and the ``response`` is sent as an
+        argument.
+        """
+        return blinker.Signal(doc='Emitted when a response is received.')
+
+    @cached_property
+    def on_error(self):
+        """Emitted when an error is received.
+
+        The signal sender is the producer and the ``error`` is sent as an
+        argument.
+        """
+        return blinker.Signal(doc='Emitted when a error is received.')
+
+    @cached_property
+    def on_close(self):
+        """Emitted after :meth:`close`.
+
+        The signal sender is the producer.
+        """
+        return blinker.Signal(doc='Emitted after the producer is closed.')
+
+    async def start(self):
+        """Connect to the configured nsqd instances."""
+        if self._state == CLOSED:
+            raise NSQException('producer already closed')
+
+        if self.is_running:
+            self.logger.warning('producer already started')
+            return
+
+        self.logger.debug('starting producer...')
+        self._state = RUNNING
+        self._connected = asyncio.Event()
+
+        for address in self.nsqd_tcp_addresses:
+            address, port = address.split(':')
+            await self.connect_to_nsqd(address, int(port))
+
+    def close(self):
+        """Immediately close all connections."""
+        if not self.is_running:
+            return
+
+        self._state = CLOSED
+        self.logger.debug('closing connection(s)')
+
+        while self._connections:
+            self._connections.popleft().close_stream()
+
+        self.on_close.send(self)
+
+    async def join(self, timeout=None):
+        """Wait until all connections have closed."""
+        if self._workers:
+            await asyncio.wait(self._workers, timeout=timeout)
+
+    @property
+    def is_running(self):
+        """Check if the producer is currently running."""
+        return self._state == RUNNING
+
+    async def connect_to_nsqd(self, address, port):
+        if not self.is_running:
+            return
+
+        conn = AsyncNsqdTCPClient(address, port, **self.conn_kwargs)
+        self.logger.debug('[%s] connecting...', conn)
+
+        conn.on_response.connect(self.handle_response)
+        conn.on_error.connect(self.handle_error)
+
+        try:
+            await conn.connect()
+            await conn.identify()
+
+        except NSQException as error:
+            self.logger.warning('[%s] connection failed (%r)', conn, error)
+            self.handle_connection_failure(conn)
+            return
+
+        # Check if we've closed since we started
+        if not self.is_running:
+            self.handle_connection_failure(conn)
+            return
+
+        self.logger.info('[%s] connection successful', conn)
+        self.handle_connection_success(conn)
+
+    async def _listen(self, conn):
+        try:
+            await conn.listen()
+        except NSQException as error:
+            self.logger.warning('[%s] connection lost (%r)', conn, error)
+
+        self.handle_connection_failure(conn)
+
+    def handle_connection_success(self, conn):
+        self._response_queues[conn] = deque()
+        self._connections.append(conn)
+        self._connected.set()
+
+        task = asyncio.ensure_future(self._listen(conn))
+        self._workers.add(task)
+        task.add_done_callback(self._workers.discard)
+
+        self._connection_backoffs[conn].success()
+
+    def handle_connection_failure(self, conn):
+        conn.close_stream()
+        self._clear_responses(conn, NSQException('connection closed'))
+
+        if conn in self._connections:
+            self._connections.remove(conn)
+
+        if not self._connections:
+            self._connected.clear()
+
+        if not self.is_running:
+            return
+
+        seconds = self._connection_backoffs[conn].failure().get_interval()
+        self.logger.debug('[%s] retrying in %ss', conn, seconds)
+
+        asyncio.get_event_loop().call_later(
+            seconds, self._reconnect, conn.address, conn.port)
+
+    def _reconnect(self, address, port):
+        task = asyncio.ensure_future(self.connect_to_nsqd(address, port))
+        self._workers.add(task)
+        task.add_done_callback(self._workers.discard)
+
+    def handle_response(self, conn, response):
+        self.logger.debug('[%s] response: %s', conn, response)
+
+        if response == nsq.OK:
+            result = self._response_queues[conn].popleft()
+            if not result.done():
+                result.set_result(response)
+
+        self.on_response.send(self, response=response)
+
+    def handle_error(self, conn, error):
+        self.logger.debug('[%s] error: %s', conn, error)
+        self._clear_responses(conn, error)
+        self.on_error.send(self, error=error)
+
+    def _create_backoff(self):
+        return BackoffTimer(max_interval=self.max_backoff_duration)
+
+    def _clear_responses(self, conn, error):
+        # All relevent errors are fatal
+        for result in self._response_queues.pop(conn, []):
+            if not result.done():
+                result.set_exception(error)
+
+    async def _get_connection(self, block=True, timeout=None):
+        if not self.is_running:
+            raise NSQException('producer not running')
+
+        while not self._connections:
+            if not block:
+                raise NSQNoConnections
+
+            try:
+                await asyncio.wait_for(self._connected.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise NSQNoConnections
+
+        # Round robin between the connected nsqds
+        self._connections.rotate(-1)
+        return self._connections[-1]
+
+    async def _send(self, command, block, timeout, raise_error):
+        conn = await self._get_connection(block=block, timeout=timeout)
+        result = asyncio.get_event_loop().create_future()
+
+        self._response_queues[conn].append(result)
+        conn.send(command)
+        await conn.drain()
+
+        if raise_error:
+            return await result
+
+        return result
+
+    async def publish(self, topic, data, defer=None, block=True, timeout=None,
+                      raise_error=True):
+        """Publish a message to the given topic.
+
+        :param topic: the topic to publish to
+
+        :param data: bytestring data to publish
+
+        :param defer: duration in milliseconds to defer before publishing
+            (requires nsq 0.3.6)
+
+        :param block: wait for a connection to become available before
+            publishing the message. If block is `False` and no connections
+            are available, :class:`~gnsq.errors.NSQNoConnections` is raised
+
+        :param timeout: if timeout is a positive number, it waits at most
+            ``timeout`` seconds before raising
+            :class:`~gnsq.errors.NSQNoConnections`
+
+        :param raise_error: if ``True``, it waits until a response is received
+            from the nsqd server, and any error response is raised. Otherwise
+            an :class:`asyncio.Future` is returned
+        """
+        if defer is None:
+            command = nsq.publish(topic, data)
+        else:
+            command = nsq.deferpublish(topic, data, defer)
+
+        return await self._send(command, block, timeout, raise_error)
+
+    async def multipublish(self, topic, messages, block=True, timeout=None,
+                           raise_error=True):
+        """Publish an iterable of messages to the given topic.
+
+        :param topic: the topic to publish to
+
+        :param messages: iterable of bytestrings to publish
+
+        Other arguments behave as in :meth:`publish`.
+        """
+        command = nsq.multipublish(topic, messages)
+        return await self._send(command, block, timeout, raise_error)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""gnsq.backends
+
+I/O and concurrency backends. A backend provides the sockets, locks, events,
+queues and task groups used by :class:`~gnsq.stream.Stream`,
+:class:`~gnsq.NsqdTCPClient`, :class:`~gnsq.Consumer` and
+:class:`~gnsq.Producer`, so the same protocol and RDY logic runs on gevent
+greenlets or on plain threads.
+"""
+from __future__ import absolute_import
+
+import six
+
+__all__ = [
+    'get_backend',
+]
+
+BACKENDS = {
+    'gevent': 'gnsq.backends.gevent:GeventBackend',
+    'threading': 'gnsq.backends.threaded:ThreadedBackend',
+}
+
+
+def get_backend(backend=None):
+    """Resolve a backend name (``'gevent'`` or ``'threading'``) or instance.
+
+    ``None`` selects the default gevent backend.
+    """
+    if backend is None:
+        backend = 'gevent'
+
+    if not isinstance(backend, six.string_types):
+        return backend
+
+    try:
+        path = BACKENDS[backend]
+    except KeyError:
+        raise ValueError('unknown backend {!r}'.format(backend))
+
+    module_name, _, class_name = path.partition(':')
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)()
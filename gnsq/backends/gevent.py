@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import gevent
+import gevent.event
+import gevent.lock
+import gevent.pool
+import gevent.queue
+
+from gevent import socket
+from gevent.ssl import SSLSocket
+
+from gnsq.errors import NSQException
+
+
+class NullLock(object):
+    """Lock for state that is only shared between greenlets.
+
+    Greenlets only switch while waiting on I/O, so plain attribute updates
+    never interleave and no real lock is needed.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class GeventBackend(object):
+    """Cooperative backend built on gevent greenlets (the default)."""
+    name = 'gevent'
+
+    Lock = gevent.lock.Semaphore
+    StateLock = NullLock
+    Event = gevent.event.Event
+    AsyncResult = gevent.event.AsyncResult
+    Queue = gevent.queue.Queue
+    Empty = gevent.queue.Empty
+    Group = gevent.pool.Group
+    TaskExit = gevent.GreenletExit
+
+    def create_connection(self, address, timeout):
+        return socket.create_connection(address=address, timeout=timeout)
+
+    def wrap_ssl(self, sock, keyfile=None, certfile=None, cert_reqs=None,
+                 ca_certs=None, ssl_version=None):
+        return SSLSocket(
+            sock,
+            keyfile=keyfile,
+            certfile=certfile,
+            cert_reqs=cert_reqs,
+            ca_certs=ca_certs,
+            ssl_version=ssl_version,
+        )
+
+    def spawn(self, func, *args, **kwargs):
+        return gevent.spawn(func, *args, **kwargs)
+
+    def spawn_later(self, seconds, func, *args, **kwargs):
+        return gevent.spawn_later(seconds, func, *args, **kwargs)
+
+    def sleep(self, seconds=0):
+        gevent.sleep(seconds)
+
+    def dispatch(self, func, *args):
+        """Run a message handler. Handlers run inline in the reader."""
+        return func(*args)
+
+    def listen(self, conn, callback):
+        """Read from ``conn`` in the background until it closes.
+
+        ``callback`` is called with the connection and the
+        :class:`~gnsq.errors.NSQException` that ended it (if any).
+        """
+        return gevent.spawn(self._listen, conn, callback)
+
+    def _listen(self, conn, callback):
+        try:
+            conn.listen()
+        except NSQException as error:
+            return callback(conn, error)
+        return callback(conn, None)
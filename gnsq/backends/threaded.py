@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+import selectors
+import socket
+import ssl
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+
+from gnsq.errors import NSQException
+
+
+class TaskExit(BaseException):
+    """Never raised; threads cannot be killed and exit cooperatively."""
+
+
+class Task(object):
+    """A unit of background work in a :class:`Group`."""
+
+    def __init__(self):
+        self.killed = False
+        self.value = None
+        self.exception = None
+        self._done = threading.Event()
+
+    def ready(self):
+        return self._done.is_set()
+
+    def join(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def kill(self, block=False):
+        self.killed = True
+        self._done.set()
+
+    def _finish(self, value=None, exception=None):
+        self.value = value
+        self.exception = exception
+        self._done.set()
+
+
+class ThreadTask(Task):
+    def __init__(self, func, args, kwargs):
+        super(ThreadTask, self).__init__()
+        self._thread = threading.Thread(
+            target=self._run, args=(func, args, kwargs))
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self, func, args, kwargs):
+        try:
+            value = func(*args, **kwargs)
+        except BaseException as error:
+            self._finish(exception=error)
+            raise
+        self._finish(value)
+
+
+class Group(object):
+    """Collection of tasks that can be joined together.
+
+    Killing a task only stops the group from waiting on it; the task itself is
+    expected to notice that its owner has closed and return.
+    """
+
+    def __init__(self):
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tasks)
+
+    def add(self, task):
+        with self._lock:
+            self._tasks.add(task)
+
+    def discard(self, task):
+        with self._lock:
+            self._tasks.discard(task)
+
+    def spawn(self, func, *args, **kwargs):
+        task = ThreadTask(func, args, kwargs)
+        self.add(task)
+        return task.start()
+
+    def _pending(self):
+        with self._lock:
+            self._tasks = set(
+                t for t in self._tasks if not (t.ready() or t.killed))
+            return list(self._tasks)
+
+    def join(self, timeout=None, raise_error=False):
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        while True:
+            pending = self._pending()
+            if not pending:
+                return True
+
+            if timeout is not None:
+                timeout = max(deadline - time.time(), 0)
+
+            task = pending[0]
+            if not task.join(timeout):
+                return False
+
+            if raise_error and task.exception is not None:
+                raise task.exception
+
+    def kill(self, block=True):
+        with self._lock:
+            tasks, self._tasks = self._tasks, set()
+
+        for task in tasks:
+            task.kill()
+
+
+class AsyncResult(object):
+    """A thread safe placeholder for a value or exception set later."""
+
+    def __init__(self):
+        self.value = None
+        self.exception = None
+        self._done = threading.Event()
+
+    def ready(self):
+        return self._done.is_set()
+
+    def successful(self):
+        return self.ready() and self.exception is None
+
+    def set(self, value=None):
+        self.value = value
+        self._done.set()
+
+    def set_exception(self, exception):
+        self.exception = exception
+        self._done.set()
+
+    def get(self, block=True, timeout=None):
+        if not self._done.wait(timeout if block else 0):
+            raise Empty
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.value
+
+
+class SelectorReader(object):
+    """Single thread reading every registered connection via selectors.
+
+    Sockets stay in blocking mode; the selector only reports when a read will
+    return immediately. Each readable connection reads one chunk and handles
+    every complete frame buffered so far, so one slow connection never blocks
+    the others.
+    """
+    poll_interval = 1.0
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._waker, self._wakee = socket.socketpair()
+        self._wakee.setblocking(False)
+        self._selector.register(self._wakee, selectors.EVENT_READ)
+
+    def add(self, conn, callback):
+        task = Task()
+
+        with self._lock:
+            self._selector.register(
+                conn.stream.socket, selectors.EVENT_READ,
+                (conn, callback, task))
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+        conn.on_close.connect(self._wakeup, weak=False)
+        return task
+
+    def _wakeup(self, conn):
+        try:
+            self._waker.send(b'\0')
+        except socket.error:
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakee.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def _run(self):
+        while True:
+            for key, _ in self._selector.select(self.poll_interval):
+                if key.data is None:
+                    self._drain_wakeup()
+                else:
+                    self._read(key)
+
+            self._remove_closed()
+
+    def _read(self, key):
+        conn, callback, task = key.data
+
+        try:
+            conn.read_available()
+        except NSQException as error:
+            self._remove(key, error)
+        except Exception as error:
+            self.logger.exception('[%s] error while reading', conn)
+            conn.close_stream()
+            self._remove(key, error)
+
+    def _remove_closed(self):
+        with self._lock:
+            keys = list(self._selector.get_map().values())
+
+        now = time.time()
+        for key in keys:
+            if key.data is None:
+                continue
+
+            conn = key.data[0]
+            if conn.is_connected and now - conn.last_response > conn.timeout:
+                self.logger.warning('[%s] connection timed out', conn)
+                conn.close_stream()
+
+            if not conn.is_connected:
+                self._remove(key, None)
+
+    def _remove(self, key, error):
+        conn, callback, task = key.data
+
+        with self._lock:
+            try:
+                self._selector.unregister(key.fileobj)
+            except (KeyError, ValueError):
+                return
+
+        try:
+            callback(conn, error)
+        finally:
+            task._finish(exception=error)
+
+
+class ThreadedBackend(object):
+    """Backend built on plain threads, for when gevent cannot be used.
+
+    Sockets are blocking and one selectors based thread reads every connection.
+    Message handlers run on a :class:`~concurrent.futures.ThreadPoolExecutor`
+    so several messages are processed concurrently without monkey patching.
+
+    :param max_workers: the number of handler threads (defaults to the
+        executor's default)
+    """
+    name = 'threading'
+
+    Lock = threading.Lock
+    StateLock = threading.RLock
+    Event = threading.Event
+    AsyncResult = AsyncResult
+    Queue = Queue
+    Empty = Empty
+    Group = Group
+    TaskExit = TaskExit
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._executor = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def create_connection(self, address, timeout):
+        return socket.create_connection(address=address, timeout=timeout)
+
+    def wrap_ssl(self, sock, keyfile=None, certfile=None,
+                 cert_reqs=ssl.CERT_NONE, ca_certs=None,
+                 ssl_version=ssl.PROTOCOL_TLSv1_2):
+        context = ssl.SSLContext(ssl_version)
+        context.verify_mode = cert_reqs
+
+        if certfile:
+            context.load_cert_chain(certfile, keyfile)
+
+        if ca_certs:
+            context.load_verify_locations(ca_certs)
+
+        return context.wrap_socket(sock)
+
+    def spawn(self, func, *args, **kwargs):
+        return ThreadTask(func, args, kwargs).start()
+
+    def spawn_later(self, seconds, func, *args, **kwargs):
+        timer = threading.Timer(seconds, func, args, kwargs)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def sleep(self, seconds=0):
+        threading.Event().wait(seconds)
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers)
+            return self._executor
+
+    @property
+    def reader(self):
+        with self._lock:
+            if self._reader is None:
+                self._reader = SelectorReader()
+            return self._reader
+
+    def dispatch(self, func, *args):
+        """Run a message handler on the handler thread pool."""
+        return self.executor.submit(func, *args)
+
+    def listen(self, conn, callback):
+        """Read from ``conn`` on the reader thread until it closes.
+
+        ``callback`` is called with the connection and the
+        :class:`~gnsq.errors.NSQException` that ended it (if any).
+        """
+        return self.reader.add(conn, callback)
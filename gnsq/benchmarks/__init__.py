@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+"""gnsq.benchmarks
+
+End-to-end throughput and latency benchmarks. Run ``python -m
+gnsq.benchmarks --help`` for usage. Results are written as json and can be
+compared against a previous run to spot regressions between commits.
+"""
+from __future__ import absolute_import
+
+from .results import Results, compare
+from .runner import run
+from .suite import Target
+
+__all__ = [
+    'Results',
+    'Target',
+    'compare',
+    'run',
+]
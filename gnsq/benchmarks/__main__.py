@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Run the benchmark suite and optionally compare with a previous run.
+
+Examples::
+
+    # against an in-process fake nsqd
+    python -m gnsq.benchmarks --output before.json
+
+    # against a local nsqd, comparing with the previous results
+    python -m gnsq.benchmarks --nsqd-tcp-address 127.0.0.1:4150 \\
+        --nsqd-http-address 127.0.0.1:4151 --compare before.json
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import logging
+import sys
+
+from .results import Results, compare, format_comparison
+from .runner import run
+from .suite import Target
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m gnsq.benchmarks')
+    parser.add_argument(
+        '--nsqd-tcp-address',
+        help='benchmark a running nsqd instead of an in-process fake')
+    parser.add_argument(
+        '--nsqd-http-address',
+        help='nsqd http address, used to delete benchmark topics')
+    parser.add_argument(
+        '--messages', type=int, default=10000,
+        help='messages per benchmark (default: %(default)s)')
+    parser.add_argument(
+        '--quick', action='store_true',
+        help='run with 1000 messages per benchmark')
+    parser.add_argument(
+        '--only', action='append',
+        help='only run benchmarks whose name contains this (repeatable)')
+    parser.add_argument(
+        '--timeout', type=float, default=60,
+        help='seconds to wait for a single benchmark (default: %(default)s)')
+    parser.add_argument(
+        '--verbose', '-v', action='store_true',
+        help='show gnsq log messages, such as connections closing')
+    parser.add_argument(
+        '--output', '-o',
+        help='write json results to this file ("-" for stdout)')
+    parser.add_argument(
+        '--compare', metavar='BASELINE',
+        help='compare with the json results of a previous run')
+    parser.add_argument(
+        '--threshold', type=float, default=0.05,
+        help='relative change reported as a regression (default: 0.05)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    num_messages = 1000 if args.quick else args.messages
+
+    logging.basicConfig()
+    if not args.verbose:
+        logging.getLogger('gnsq').setLevel(logging.CRITICAL)
+
+    target = Target(
+        args.nsqd_tcp_address, args.nsqd_http_address, args.timeout)
+
+    with target:
+        results = run(target, num_messages, args.only)
+
+    if args.output:
+        results.save(args.output)
+
+    if not args.compare:
+        return 0
+
+    rows = compare(Results.load(args.compare), results, args.threshold)
+    print(format_comparison(rows))
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
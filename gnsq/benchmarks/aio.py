@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for :mod:`gnsq.aio`, kept apart for python 2 compatibility."""
+import asyncio
+import time
+
+from ..aio import AsyncConsumer, AsyncProducer
+from .suite import CHANNEL, BenchmarkError, preload
+
+
+def _run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+async def _consume(target, topic, num_messages, max_in_flight):
+    done = asyncio.Event()
+    received = 0
+
+    async def handler(consumer, message):
+        nonlocal received
+        received += 1
+        if received == num_messages:
+            done.set()
+
+    consumer = AsyncConsumer(
+        topic, CHANNEL, target.tcp_address, message_handler=handler,
+        max_in_flight=max_in_flight)
+
+    start = time.time()
+    await consumer.start(block=False)
+
+    try:
+        await asyncio.wait_for(done.wait(), target.timeout)
+    except asyncio.TimeoutError:
+        raise BenchmarkError('timed out consuming {}'.format(topic))
+    finally:
+        consumer.close()
+        await consumer.join(1)
+
+    return time.time() - start
+
+
+def consumer_throughput(target, num_messages, size, max_in_flight):
+    """Messages per second handled by a :class:`~gnsq.aio.AsyncConsumer`."""
+    topic = target.topic()
+    preload(target, topic, num_messages, size)
+
+    try:
+        elapsed = _run(_consume(
+            target, topic, num_messages, max_in_flight))
+    finally:
+        target.cleanup(topic)
+
+    return {
+        'msgs_per_sec': num_messages / elapsed,
+        'mb_per_sec': num_messages * size / elapsed / 1e6,
+    }
+
+
+async def _publish(target, topic, num_messages, size, batch_size):
+    producer = AsyncProducer(target.tcp_address)
+    await producer.start()
+
+    body = b'x' * size
+    start = time.time()
+
+    try:
+        if batch_size == 1:
+            futures = [
+                await producer.publish(topic, body, raise_error=False)
+                for _ in range(num_messages)
+            ]
+        else:
+            futures = [
+                await producer.multipublish(
+                    topic, [body] * batch_size, raise_error=False)
+                for _ in range(num_messages // batch_size)
+            ]
+
+        await asyncio.wait_for(asyncio.gather(*futures), target.timeout)
+        return time.time() - start
+
+    finally:
+        producer.close()
+        await producer.join(1)
+
+
+def producer_throughput(target, num_messages, size, batch_size=1):
+    """Messages per second published by a :class:`~gnsq.aio.AsyncProducer`."""
+    topic = target.topic()
+
+    try:
+        elapsed = _run(_publish(
+            target, topic, num_messages, size, batch_size))
+    finally:
+        target.cleanup(topic)
+
+    return {
+        'msgs_per_sec': num_messages / elapsed,
+        'mb_per_sec': num_messages * size / elapsed / 1e6,
+    }
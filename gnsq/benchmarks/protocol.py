@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmarks for the encode and decode functions of
+:mod:`gnsq.protocol`.
+
+These do not touch the network, so they are stable enough to catch small
+regressions in the code run for every message.
+"""
+from __future__ import absolute_import, division
+
+import timeit
+
+from .. import protocol as nsq
+
+MESSAGE_ID = b'0123456789abcdef'
+BODY = b'x' * 100
+MESSAGES = [BODY] * 10
+MESSAGE_FRAME = (
+    nsq.MESSAGE_HEADER.pack(1500000000000000000, 1) + MESSAGE_ID + BODY)
+RESPONSE_FRAME = nsq.SIZE.pack(nsq.FRAME_TYPE_RESPONSE) + nsq.OK
+TOPIC = nsq.TopicEncoder('topic')
+
+#: ``(name, func, args)`` for every benchmarked protocol function.
+FUNCTIONS = (
+    ('unpack_size', nsq.unpack_size, (RESPONSE_FRAME[:4],)),
+    ('unpack_response', nsq.unpack_response, (RESPONSE_FRAME,)),
+    ('unpack_message', nsq.unpack_message, (MESSAGE_FRAME,)),
+    ('identify', nsq.identify, ({'client_id': 'bench', 'feature_negotiation':
+                                 True},)),
+    ('auth', nsq.auth, (b'secret',)),
+    ('subscribe', nsq.subscribe, ('topic', 'channel')),
+    ('publish', nsq.publish, ('topic', BODY)),
+    ('multipublish', nsq.multipublish, ('topic', MESSAGES)),
+    ('deferpublish', nsq.deferpublish, ('topic', BODY, 1000)),
+    ('topic_publish', TOPIC.publish, (BODY,)),
+    ('topic_multipublish', TOPIC.multipublish, (MESSAGES,)),
+    ('topic_deferpublish', TOPIC.deferpublish, (BODY, 1000)),
+    ('ready', nsq.ready, (100,)),
+    ('ready_uncached', nsq.ready, (nsq.READY_CACHE_SIZE + 1,)),
+    ('finish', nsq.finish, (MESSAGE_ID,)),
+    ('requeue', nsq.requeue, (MESSAGE_ID,)),
+    ('requeue_timeout', nsq.requeue, (MESSAGE_ID, 60000)),
+    ('touch', nsq.touch, (MESSAGE_ID,)),
+    ('close', nsq.close, ()),
+    ('nop', nsq.nop, ()),
+)
+
+
+def time_call(func, args, number, repeat=3):
+    """Best mean time of ``func(*args)`` in nanoseconds."""
+    timer = timeit.Timer(lambda: func(*args))
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def protocol_function(name, func, args, number):
+    """Time a single protocol function."""
+    mean_ns = time_call(func, args, number)
+    return {'mean_ns': mean_ns, 'ops_per_sec': 1e9 / mean_ns}
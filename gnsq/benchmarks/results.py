@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division
+
+import json
+import platform
+import sys
+import time
+
+from ..version import __version__
+
+#: Metrics where a smaller value is an improvement.
+LOWER_IS_BETTER = ('_ns', '_ms', '_seconds')
+
+
+def percentile(samples, percent):
+    """Nearest rank percentile of ``samples`` (``percent`` from 0 to 100)."""
+    if not samples:
+        return None
+
+    ordered = sorted(samples)
+    rank = int(round(percent / 100 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def result_key(name, params):
+    """Identify a result across runs by its name and parameters."""
+    return ' '.join(
+        [name] + ['{}={}'.format(k, params[k]) for k in sorted(params)])
+
+
+class Results(object):
+    """Benchmark results and the environment they were measured in."""
+
+    def __init__(self, target, meta=None, results=None):
+        self.meta = meta or {
+            'gnsq_version': __version__,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'target': target,
+            'timestamp': int(time.time()),
+        }
+        self.results = results or []
+
+    def add(self, name, params, **metrics):
+        result = {'name': name, 'params': params, 'metrics': metrics}
+        self.results.append(result)
+        return result
+
+    def by_key(self):
+        return {result_key(r['name'], r['params']): r for r in self.results}
+
+    def to_dict(self):
+        return {'meta': self.meta, 'results': self.results}
+
+    def dump(self, fp):
+        json.dump(self.to_dict(), fp, indent=2, sort_keys=True)
+        fp.write('\n')
+
+    def save(self, path):
+        if path == '-':
+            return self.dump(sys.stdout)
+
+        with open(path, 'w') as fp:
+            self.dump(fp)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fp:
+            data = json.load(fp)
+        return cls(data['meta']['target'], data['meta'], data['results'])
+
+
+def is_regression(metric, change, threshold):
+    if metric.endswith(LOWER_IS_BETTER):
+        return change > threshold
+    return change < -threshold
+
+
+def compare(baseline, current, threshold=0.05):
+    """Compare two :class:`Results`.
+
+    Returns a list of ``(key, metric, before, after, change, regressed)``
+    tuples for every metric present in both, where ``change`` is the relative
+    difference and ``regressed`` flags changes worse than ``threshold``.
+    """
+    before = baseline.by_key()
+    rows = []
+
+    for key, result in sorted(current.by_key().items()):
+        if key not in before:
+            continue
+
+        old_metrics = before[key]['metrics']
+        for metric, value in sorted(result['metrics'].items()):
+            old = old_metrics.get(metric)
+            if not old or value is None:
+                continue
+
+            change = (value - old) / old
+            rows.append((
+                key, metric, old, value, change,
+                is_regression(metric, change, threshold)))
+
+    return rows
+
+
+def format_comparison(rows):
+    lines = []
+    for key, metric, old, new, change, regressed in rows:
+        lines.append('{:<60} {:<16} {:>12.2f} {:>12.2f} {:>+8.1%}{}'.format(
+            key, metric, old, new, change, '  REGRESSION' if regressed else ''))
+    return '\n'.join(lines)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import sys
+
+from itertools import chain
+
+from . import protocol, suite
+from .results import Results
+
+SIZES = (100, 1024, 16384)
+MAX_IN_FLIGHT = (1, 32, 256)
+BACKENDS = ('gevent', 'threading')
+MPUB_BATCH_SIZE = 100
+
+try:
+    from . import aio
+except (ImportError, SyntaxError):
+    aio = None  # pyflakes.ignore
+
+
+def benchmarks(target, num_messages):
+    """Yield ``(name, params, func, args, kwargs)`` for each benchmark."""
+    return chain(
+        _protocol_benchmarks(num_messages),
+        _consumer_benchmarks(target, num_messages),
+        _producer_benchmarks(target, num_messages),
+        _latency_benchmarks(target, max(num_messages // 10, 100)),
+    )
+
+
+def _protocol_benchmarks(num_messages):
+    # Calls are far cheaper than messages, so time enough of them for the
+    # timer resolution not to matter.
+    number = num_messages * 10
+    for name, func, args in protocol.FUNCTIONS:
+        yield 'protocol', {'function': name}, protocol.protocol_function, (
+            name, func, args, number), {}
+
+
+def _consumer_benchmarks(target, num_messages):
+    for size in SIZES:
+        for max_in_flight in MAX_IN_FLIGHT:
+            params = {'size': size, 'max_in_flight': max_in_flight}
+            yield 'consumer', params, suite.consumer_throughput, (
+                target, num_messages, size, max_in_flight), {}
+
+    for backend in BACKENDS:
+        params = {'backend': backend, 'size': 1024, 'max_in_flight': 256}
+        yield 'consumer_backend', params, suite.consumer_throughput, (
+            target, num_messages, 1024, 256, backend), {}
+
+    if aio is not None:
+        params = {'backend': 'asyncio', 'size': 1024, 'max_in_flight': 256}
+        yield 'consumer_backend', params, aio.consumer_throughput, (
+            target, num_messages, 1024, 256), {}
+
+    options = suite.compression_options(target)
+    options.append(('metrics', {'metrics': True}))
+
+    for option, conn_kwargs in options:
+        params = {'option': option, 'size': 1024, 'max_in_flight': 256}
+        yield 'consumer_options', params, suite.consumer_throughput, (
+            target, num_messages, 1024, 256), conn_kwargs
+
+
+def _producer_benchmarks(target, num_messages):
+    for backend in BACKENDS:
+        for command, batch_size in (('PUB', 1), ('MPUB', MPUB_BATCH_SIZE)):
+            params = {'backend': backend, 'command': command, 'size': 1024}
+            yield 'producer', params, suite.producer_throughput, (
+                target, num_messages, 1024, batch_size, backend), {}
+
+    if aio is not None:
+        for command, batch_size in (('PUB', 1), ('MPUB', MPUB_BATCH_SIZE)):
+            params = {'backend': 'asyncio', 'command': command, 'size': 1024}
+            yield 'producer', params, aio.producer_throughput, (
+                target, num_messages, 1024, batch_size), {}
+
+
+def _latency_benchmarks(target, num_messages):
+    for backend in BACKENDS:
+        params = {'backend': backend, 'size': 100}
+        yield 'latency', params, suite.end_to_end_latency, (
+            target, num_messages, 100, backend), {}
+
+
+def run(target, num_messages, only=None, log=sys.stderr):
+    """Run the suite against an entered :class:`~gnsq.benchmarks.Target`."""
+    results = Results(target.name)
+
+    for name, params, func, args, kwargs in benchmarks(target, num_messages):
+        if only and not any(pattern in name for pattern in only):
+            continue
+
+        metrics = func(*args, **kwargs)
+        result = results.add(name, params, **metrics)
+
+        log.write('{:<18} {:<50} {}\n'.format(
+            name, _format(result['params']), _format(result['metrics'])))
+        log.flush()
+
+    return results
+
+
+def _format(values):
+    return ' '.join(
+        '{}={}'.format(k, _round(values[k])) for k in sorted(values))
+
+
+def _round(value):
+    if isinstance(value, float):
+        return '{:.2f}'.format(value)
+    return value
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division
+
+import os
+import time
+
+from itertools import count
+
+from ..backends import get_backend
+from ..consumer import Consumer
+from ..errors import NSQException
+from ..nsqd import NsqdHTTPClient
+from ..producer import Producer
+from .results import percentile
+
+try:
+    from ..stream.snappy import SnappySocket
+except ImportError:
+    SnappySocket = None  # pyflakes.ignore
+
+CHANNEL = 'bench'
+MPUB_BATCH_SIZE = 100
+
+_topic_ids = count(1)
+
+
+class BenchmarkError(NSQException):
+    pass
+
+
+class Target(object):
+    """The nsqd the benchmarks run against.
+
+    Without ``nsqd_tcp_address`` an in-process
+    :class:`~gnsq.testing.FakeNsqd` is started, created with ``fake_kwargs``.
+    ``nsqd_http_address`` is only used to delete the topics created by a run.
+    """
+
+    def __init__(self, nsqd_tcp_address=None, nsqd_http_address=None,
+                 timeout=60, **fake_kwargs):
+        self.tcp_address = nsqd_tcp_address
+        self.http_address = nsqd_http_address
+        self.timeout = timeout
+        self.fake_kwargs = fake_kwargs
+        self.fake = None
+
+    @property
+    def name(self):
+        return 'fake' if self.fake else 'nsqd'
+
+    @property
+    def supports_tls(self):
+        return self.fake is None
+
+    def __enter__(self):
+        if self.tcp_address is None:
+            from ..testing import FakeNsqd
+            self.fake = FakeNsqd(**self.fake_kwargs).start()
+            self.tcp_address = self.fake.tcp_address
+            self.http_address = self.fake.http_address
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.fake is not None:
+            self.fake.stop()
+
+    def topic(self):
+        return 'gnsq_bench_%d_%d' % (os.getpid(), next(_topic_ids))
+
+    def cleanup(self, topic):
+        if self.http_address is None:
+            return
+
+        url = self.http_address
+        if '://' not in url:
+            url = 'http://' + url
+
+        try:
+            NsqdHTTPClient.from_url(url).delete_topic(topic)
+        except NSQException:
+            pass
+
+
+def preload(target, topic, num_messages, size):
+    """Fill ``topic`` with ``num_messages`` messages using MPUB."""
+    producer = Producer(target.tcp_address)
+    producer.start()
+
+    body = b'x' * size
+    try:
+        for offset in range(0, num_messages, MPUB_BATCH_SIZE):
+            batch = min(MPUB_BATCH_SIZE, num_messages - offset)
+            producer.multipublish(topic, [body] * batch)
+    finally:
+        producer.close()
+
+
+def _consume(target, topic, num_messages, max_in_flight, backend=None,
+             on_message=None, **conn_kwargs):
+    backend = get_backend(backend)
+    done = backend.Event()
+    received = count(1)
+
+    def handler(consumer, message):
+        if on_message is not None:
+            on_message(message)
+        if next(received) == num_messages:
+            done.set()
+
+    consumer = Consumer(
+        topic, CHANNEL, target.tcp_address, message_handler=handler,
+        max_in_flight=max_in_flight, backend=backend, **conn_kwargs)
+
+    start = time.time()
+    consumer.start(block=False)
+
+    try:
+        if not done.wait(target.timeout):
+            raise BenchmarkError('timed out consuming {}'.format(topic))
+        return time.time() - start
+    finally:
+        consumer.close()
+        consumer.join(1)
+
+
+def consumer_throughput(target, num_messages, size, max_in_flight,
+                        backend=None, **conn_kwargs):
+    """Messages per second handled by a :class:`~gnsq.Consumer`."""
+    topic = target.topic()
+    preload(target, topic, num_messages, size)
+
+    try:
+        elapsed = _consume(
+            target, topic, num_messages, max_in_flight, backend,
+            **conn_kwargs)
+    finally:
+        target.cleanup(topic)
+
+    return {
+        'msgs_per_sec': num_messages / elapsed,
+        'mb_per_sec': num_messages * size / elapsed / 1e6,
+    }
+
+
+def producer_throughput(target, num_messages, size, batch_size=1,
+                        backend=None):
+    """Messages per second published with pipelined PUB or MPUB."""
+    topic = target.topic()
+    producer = Producer(target.tcp_address, backend=backend)
+    producer.start()
+
+    body = b'x' * size
+    start = time.time()
+
+    try:
+        if batch_size == 1:
+            results = [
+                producer.publish(topic, body, raise_error=False)
+                for _ in range(num_messages)
+            ]
+        else:
+            results = [
+                producer.multipublish(
+                    topic, [body] * batch_size, raise_error=False)
+                for _ in range(num_messages // batch_size)
+            ]
+
+        for result in results:
+            result.get(timeout=target.timeout)
+
+        elapsed = time.time() - start
+
+    finally:
+        producer.close()
+        target.cleanup(topic)
+
+    return {
+        'msgs_per_sec': num_messages / elapsed,
+        'mb_per_sec': num_messages * size / elapsed / 1e6,
+    }
+
+
+def end_to_end_latency(target, num_messages, size, backend=None):
+    """Publish-to-handle latency of messages published one at a time.
+
+    Each message is published once the previous one was handled, so no
+    queueing is included. Latency is measured against the nsqd message
+    timestamp, so client and server clocks must agree (true for a local nsqd
+    or the fake).
+    """
+    topic = target.topic()
+    backend = get_backend(backend)
+    handled = backend.Event()
+    samples = []
+
+    def on_message(message):
+        samples.append(time.time() - message.timestamp / 1e9)
+        handled.set()
+
+    producer = Producer(target.tcp_address, backend=backend)
+    producer.start()
+
+    consumer = backend.spawn(
+        _consume, target, topic, num_messages + 1, 1, backend, on_message)
+
+    body = b'x' * size
+    try:
+        # The first message also waits for the consumer to connect
+        for _ in range(num_messages + 1):
+            producer.publish(topic, body)
+            if not handled.wait(target.timeout):
+                raise BenchmarkError('timed out waiting for message')
+            handled.clear()
+
+        consumer.join(target.timeout)
+
+    finally:
+        producer.close()
+        target.cleanup(topic)
+
+    samples = [1000 * s for s in samples[1:]]
+    return {
+        'p50_ms': percentile(samples, 50),
+        'p90_ms': percentile(samples, 90),
+        'p99_ms': percentile(samples, 99),
+        'max_ms': max(samples),
+    }
+
+
+def compression_options(target):
+    """The connection options compared by the compression benchmarks."""
+    options = [('none', {}), ('deflate', {'deflate': True})]
+
+    if SnappySocket is not None:
+        options.append(('snappy', {'snappy': True}))
+
+    if target.supports_tls:
+        options.append(('tls', {'tls_v1': True, 'tls_options': {}}))
+
+    return options
@@ -9,20 +9,33 @@ from collections import defaultdict
 from itertools import cycle
 
 import blinker
-import gevent
 
-from gevent.event import Event
-from gevent.pool import Group
-
-from .backofftimer import BackoffTimer
+from . import protocol as nsq
+from .backends import get_backend
 from .decorators import cached_property
-from .errors import NSQException, NSQRequeueMessage, NSQSocketError
+from .dedup import Deduplicator
+from .errors import NSQException, NSQRequeueMessage
+from .lag import FINISH, RECEIVE, LagTracker
+from .message import finish_all, requeue_all
+from .metrics import ConsumerMetrics, MetricsRegistry
 from .nsqd import NsqdTCPClient
-from .states import INIT, RUNNING, BACKOFF, THROTTLED, CLOSED
+from .readystate import ReadyStateMixin
+from .states import INIT, RUNNING, THROTTLED, CLOSED, DRAINING
+from .timerwheel import TimerWheel
 from .util import parse_nsqds, parse_lookupds
 
+#: Resolution in seconds of the timer wheel used for ``auto_touch``.
+AUTO_TOUCH_TICK = 0.25
+
+#: Seconds between drain progress checks in :meth:`Consumer.close`.
+DRAIN_POLL_INTERVAL = 0.05
+
+#: Weight of each new message in the running mean message size used to
+#: estimate how many messages fit in ``max_in_flight_bytes``.
+MESSAGE_SIZE_DECAY = 0.05
+
 
-class Consumer(object):
+class Consumer(ReadyStateMixin):
     """High level NSQ consumer.
 
     A Consumer will connect to the nsqd tcp addresses or poll the provided
@@ -68,6 +81,10 @@ class Consumer(object):
     :param message_handler: the callable that will be executed for each message
         received
 
+    :param batch_handler: a callable connected to :attr:`on_messages`, called
+        with lists of the messages decoded from one socket read. Pass
+        ``max_batch_size`` to cap the list size
+
     :param max_tries: the maximum number of attempts the consumer will make to
         process a message after which messages will be automatically discarded
 
@@ -97,14 +114,72 @@ class Consumer(object):
     :param backoff_on_requeue: if ``False``, backoff will only occur on
         exception
 
+    :param backend: the I/O backend, ``'gevent'`` (default), ``'threading'``
+        or a backend instance. With ``'threading'`` message handlers run
+        concurrently on a thread pool and must be thread safe
+
+    :param metrics: ``True`` to collect metrics in a new
+        :class:`~gnsq.metrics.MetricsRegistry`, or a registry to share with
+        other consumers. Available as :attr:`metrics`; disabled by default
+
+    :param track_lag: keep publish to receive and publish to finish lag
+        histograms, available as :attr:`lag` (a :class:`~gnsq.lag.LagTracker`)
+
+    :param lag_slo: emit :attr:`on_lag` when the ``lag_percentile`` lag of
+        either kind exceeds this many seconds. Implies ``track_lag``
+
+    :param lag_percentile: the lag percentile checked against ``lag_slo``
+
+    :param lag_interval: the window in seconds over which lag percentiles are
+        computed and checked
+
+    :param auto_touch: touch messages that have not been responded to before
+        nsqd's ``msg_timeout`` expires, so long running handlers are not
+        redelivered. One timer wheel serves every message in flight
+
+    :param auto_touch_fraction: the fraction of the connection's negotiated
+        ``msg_timeout`` after which a message is touched
+
+    :param max_auto_touches: the maximum number of times a message is touched
+        automatically
+
+    :param kill_expired: run each message handler in its own greenlet and kill
+        it when the message's lease expires (see
+        :meth:`Message.is_expired() <gnsq.Message.is_expired>`), either
+        because its connection closed or ``msg_timeout`` passed without a
+        touch. Requires the gevent backend
+
+    :param dedup: finish recently finished messages again without calling
+        the handler when they are redelivered. ``True`` remembers the last
+        100000 message ids, or pass a cache such as
+        :class:`~gnsq.dedup.RotatingBloomFilter` for a fixed memory budget.
+        Hits and misses are counted on :attr:`dedup` (a
+        :class:`~gnsq.dedup.Deduplicator`) and in :attr:`metrics`
+
+    :param dedup_digest: identify duplicates by a digest of the message body
+        instead of the message id
+
+    :param max_in_flight_bytes: limit the total size of message bodies that
+        have not been responded to. RDY counts start at 1 per connection
+        until a message size is known, then are reduced to the number of
+        average sized messages that fit in the remaining budget, and to RDY 1
+        on a single connection once it is used up, until enough messages are
+        finished or requeued. Usage is available as
+        :attr:`total_in_flight_bytes` and in :attr:`metrics`
+
     :param **kwargs: passed to :class:`~gnsq.NsqdTCPClient` initialization
     """
     def __init__(self, topic, channel, nsqd_tcp_addresses=[],
                  lookupd_http_addresses=[], name=None, message_handler=None,
+                 batch_handler=None,
                  max_tries=5, max_in_flight=1, requeue_delay=0,
                  lookupd_poll_interval=60, lookupd_poll_jitter=0.3,
                  low_ready_idle_timeout=10, max_backoff_duration=128,
-                 backoff_on_requeue=True, **kwargs):
+                 backoff_on_requeue=True, backend=None, metrics=None,
+                 track_lag=False, lag_slo=None, lag_percentile=99,
+                 lag_interval=10, auto_touch=False, auto_touch_fraction=0.5,
+                 max_auto_touches=10, kill_expired=False, dedup=None,
+                 dedup_digest=False, max_in_flight_bytes=None, **kwargs):
         if not nsqd_tcp_addresses and not lookupd_http_addresses:
             raise ValueError('must specify at least one nsqd or lookupd')
 
@@ -122,8 +197,22 @@ class Consumer(object):
         self.low_ready_idle_timeout = low_ready_idle_timeout
         self.backoff_on_requeue = backoff_on_requeue
         self.max_backoff_duration = max_backoff_duration
+        self.lag_slo = lag_slo
+        self.lag_percentile = lag_percentile
+        self.lag_interval = lag_interval
+        self.auto_touch = auto_touch
+        self.auto_touch_fraction = auto_touch_fraction
+        self.max_auto_touches = max_auto_touches
+        self.kill_expired = kill_expired
+        self.max_in_flight_bytes = max_in_flight_bytes
         self.conn_kwargs = kwargs
 
+        self._backend = get_backend(backend)
+        self.conn_kwargs['backend'] = self._backend
+
+        if kill_expired and getattr(self._backend, 'name', None) != 'gevent':
+            raise ValueError('kill_expired requires the gevent backend')
+
         if name:
             self.name = name
         else:
@@ -132,16 +221,63 @@ class Consumer(object):
         if message_handler is not None:
             self.on_message.connect(message_handler, weak=False)
 
+        if batch_handler is not None:
+            self.on_messages.connect(batch_handler, weak=False)
+
         self.logger = logging.getLogger(self.name)
 
         self._state = INIT
-        self._redistributed_ready_event = Event()
+        self._state_lock = self._backend.StateLock()
+        self._redistributed_ready_event = self._backend.Event()
         self._connection_backoffs = defaultdict(self._create_backoff)
         self._message_backoffs = defaultdict(self._create_backoff)
 
         self._connections = {}
-        self._workers = Group()
-        self._killables = Group()
+        self._close_waits = set()
+        self._mean_message_size = None
+        self._bytes_limit = None
+        self.add_ready_limit(self._bytes_ready_limit)
+
+        self._pause_reasons = set()
+        self._pressure_sources = []
+        self.add_ready_limit(self._pause_ready_limit)
+        self._workers = self._backend.Group()
+        self._killables = self._backend.Group()
+
+        if metrics is True:
+            metrics = MetricsRegistry()
+
+        self.metrics = metrics or None
+        if self.metrics is None:
+            self._metrics = None
+        else:
+            self._metrics = ConsumerMetrics(self, self.metrics)
+
+        if track_lag or lag_slo is not None:
+            self.lag = LagTracker(
+                self.metrics, {'topic': topic, 'channel': channel})
+        else:
+            self.lag = None
+
+        self.dedup = self._create_dedup(dedup, dedup_digest)
+
+        self._handler_tasks = defaultdict(dict)
+        if auto_touch or kill_expired:
+            self._timer_wheel = TimerWheel(
+                tick=AUTO_TOUCH_TICK, lock=self._backend.StateLock())
+        else:
+            self._timer_wheel = None
+
+    def _create_dedup(self, dedup, digest):
+        if dedup is None and digest:
+            dedup = True
+
+        if dedup is None or dedup is False:
+            return None
+
+        return Deduplicator(
+            None if dedup is True else dedup, digest, self.metrics,
+            {'topic': self.topic, 'channel': self.channel})
 
     @cached_property
     def on_message(self):
@@ -152,6 +288,21 @@ class Consumer(object):
         """
         return blinker.Signal(doc='Emitted when a message is received.')
 
+    @cached_property
+    def on_messages(self):
+        """Emitted with the messages decoded from one socket read.
+
+        The signal sender is the consumer and the list of ``messages`` is sent
+        as an argument. The ``batch_handler`` param is connected to this
+        signal. While it has receivers, :attr:`on_message` is not emitted.
+
+        Messages that are not responded to or made async are finished when
+        the receivers return. If a receiver raises, the remaining messages
+        are requeued and only the first backs off (see
+        :func:`~gnsq.message.requeue_all`).
+        """
+        return blinker.Signal(doc='Emitted with a batch of messages.')
+
     @cached_property
     def on_response(self):
         """Emitted when a response is received.
@@ -214,10 +365,33 @@ class Consumer(object):
         """Emitted when an exception is caught while handling a message.
 
         The signal sender is the consumer and the ``message`` and ``error`` are
-        sent as arguments.
+        sent as arguments. ``message`` is ``None`` for :attr:`on_messages`
+        batches.
         """
         return blinker.Signal(doc='Emitted when an exception is caught.')
 
+    @cached_property
+    def on_lag(self):
+        """Emitted when delivery lag exceeds ``lag_slo``.
+
+        Checked every ``lag_interval`` seconds. The signal sender is the
+        consumer and the ``kind`` of lag (``'receive'`` or ``'finish'``), the
+        ``percentile`` and the ``lag`` in seconds are sent as arguments.
+        """
+        return blinker.Signal(doc='Emitted when delivery lag exceeds the SLO.')
+
+    @cached_property
+    def on_drain(self):
+        """Emitted as :meth:`close` drains with ``drain=True``.
+
+        The signal sender is the consumer and the ``stage`` and the number of
+        messages still ``in_flight`` are sent as arguments. The stages are
+        ``'started'`` once RDY 0 and CLS are sent, ``'close_wait'`` each time
+        a connection acknowledges CLS, ``'in_flight'`` whenever the in flight
+        count changes and finally ``'drained'`` or ``'timeout'``.
+        """
+        return blinker.Signal(doc='Emitted as the consumer drains.')
+
     @cached_property
     def on_close(self):
         """Emitted after :meth:`close`.
@@ -229,8 +403,7 @@ class Consumer(object):
     def start(self, block=True):
         """Start discovering and listing to connections."""
         if self._state == INIT:
-            if not any(self.on_message.receivers_for(blinker.ANY)):
-                raise RuntimeError('no receivers connected to on_message')
+            self._check_receivers()
 
             self.logger.debug('starting %s...', self.name)
             self._state = RUNNING
@@ -242,27 +415,115 @@ class Consumer(object):
 
             self._killables.add(self._workers.spawn(self._poll_ready))
 
+            if self.lag is not None:
+                self._killables.add(self._workers.spawn(self._poll_lag))
+
+            for source in self._pressure_sources:
+                self._spawn_pressure_poll(*source)
+
+            # Not killable, auto touch keeps running while draining
+            if self._timer_wheel is not None:
+                self._workers.spawn(self._run_timer_wheel)
+
         else:
             self.logger.warning('%s already started', self.name)
 
         if block:
             self.join()
 
-    def close(self):
-        """Immediately close all connections and stop workers."""
-        if not self.is_running:
+    @property
+    def _is_batching(self):
+        return any(self.on_messages.receivers_for(blinker.ANY))
+
+    def _check_receivers(self):
+        has_receivers = any(self.on_message.receivers_for(blinker.ANY))
+
+        if not self._is_batching:
+            if not has_receivers:
+                raise RuntimeError('no receivers connected to on_message')
             return
 
-        self._state = CLOSED
+        if has_receivers:
+            raise RuntimeError(
+                'receivers connected to both on_message and on_messages')
+
+        if self.kill_expired:
+            raise RuntimeError('kill_expired does not support on_messages')
+
+    def close(self, drain=False, timeout=None):
+        """Close all connections and stop workers.
+
+        By default connections are closed immediately, and nsqd redelivers
+        the messages in flight once they time out. With ``drain=True`` the
+        consumer first stops nsqd from sending more messages (RDY 0 and CLS),
+        waits for each connection's ``CLOSE_WAIT`` and for the in flight
+        messages to be finished or requeued, for at most ``timeout`` seconds.
+        Progress is reported through :attr:`on_drain`.
+
+        Draining blocks, so it must not be called from a message handler.
+
+        :returns: ``False`` if draining timed out, otherwise ``True``
+        """
+        if not self.is_running:
+            return True
+
+        self._state = DRAINING if drain else CLOSED
 
         self.logger.debug('killing %d worker(s)', len(self._killables))
         self._killables.kill(block=False)
+        self._redistributed_ready_event.set()
+
+        drained = self._drain(timeout) if drain else True
+        self._state = CLOSED
 
         self.logger.debug('closing %d connection(s)', len(self._connections))
-        for conn in self._connections:
+        for conn in list(self._connections):
             conn.close_stream()
 
         self.on_close.send(self)
+        return drained
+
+    def _drain(self, timeout):
+        self.logger.info(
+            'draining %d connection(s)', len(self._connections))
+        self._close_waits = set()
+
+        for conn in list(self._connections):
+            try:
+                conn.ready(0)
+                conn.close()
+            except NSQException as error:
+                self.logger.warning('[%s] CLS failed (%r)', conn, error)
+
+        in_flight = self.total_in_flight
+        self.on_drain.send(self, stage='started', in_flight=in_flight)
+
+        deadline = None if timeout is None else time.time() + timeout
+        while not self._is_drained():
+            if deadline is not None and time.time() >= deadline:
+                self.logger.warning(
+                    'drain timed out with %d message(s) in flight',
+                    self.total_in_flight)
+                self.on_drain.send(
+                    self, stage='timeout', in_flight=self.total_in_flight)
+                return False
+
+            self._backend.sleep(DRAIN_POLL_INTERVAL)
+
+            if self.total_in_flight != in_flight:
+                in_flight = self.total_in_flight
+                self.on_drain.send(self, stage='in_flight', in_flight=in_flight)
+
+        self.logger.info('drained')
+        self.on_drain.send(self, stage='drained', in_flight=0)
+        return True
+
+    def _is_drained(self):
+        connections = [c for c in self._connections if c.is_connected]
+        return (
+            all(conn in self._close_waits for conn in connections) and
+            not any(conn.in_flight for conn in connections)
+        )
 
     def join(self, timeout=None, raise_error=False):
         """Block until all connections have closed and workers stopped."""
@@ -273,6 +534,106 @@ class Consumer(object):
         """Check if consumer is currently running."""
         return self._state == RUNNING
 
+    @property
+    def is_paused(self):
+        """Check if the consumer is paused, manually or by a pressure source.
+        """
+        return bool(self._pause_reasons)
+
+    def pause(self):
+        """Stop receiving messages until :meth:`resume` is called.
+
+        Sets RDY 0 on every connection. Connections stay open and keep
+        answering heartbeats, and messages already in flight may still be
+        handled. Pressure sources pause and resume independently of this.
+        """
+        self._pause(self)
+
+    def resume(self):
+        """Resume receiving messages after :meth:`pause`."""
+        self._resume(self)
+
+    def add_pressure_source(self, source, threshold=1, resume_threshold=None,
+                            interval=1.0):
+        """Pause the consumer while a downstream reports pressure.
+
+        ``source`` is polled every ``interval`` seconds. It is a callable
+        returning the current pressure (``None`` to leave the state
+        unchanged), or an event such as :class:`gevent.event.Event`, which
+        pauses the consumer while set. The consumer pauses once the pressure
+        reaches ``threshold`` and resumes once it drops below
+        ``resume_threshold`` (defaults to ``threshold``).
+
+        Example usage::
+
+            >>> consumer.add_pressure_source(
+            ...     lambda: sink.queue_depth(), threshold=10000,
+            ...     resume_threshold=1000)
+        """
+        if hasattr(source, 'is_set'):
+            source = source.is_set
+
+        if resume_threshold is None:
+            resume_threshold = threshold
+
+        args = (source, threshold, resume_threshold, interval)
+        self._pressure_sources.append(args)
+
+        if self.is_running:
+            self._spawn_pressure_poll(*args)
+
+    def _spawn_pressure_poll(self, *args):
+        self._killables.add(self._workers.spawn(self._poll_pressure, *args))
+
+    def _poll_pressure(self, source, threshold, resume_threshold, interval):
+        try:
+            while self.is_running:
+                self._check_pressure(source, threshold, resume_threshold)
+                self._backend.sleep(interval)
+
+        except self._backend.TaskExit:
+            pass
+
+    def _check_pressure(self, source, threshold, resume_threshold):
+        try:
+            pressure = source()
+        except Exception:
+            self.logger.exception('caught exception polling pressure source')
+            return
+
+        if pressure is None:
+            return
+
+        if source in self._pause_reasons:
+            if pressure < resume_threshold:
+                self._resume(source)
+
+        elif pressure >= threshold:
+            self._pause(source)
+
+    def _pause_ready_limit(self):
+        return 0 if self._pause_reasons else None
+
+    def _pause(self, reason):
+        if reason in self._pause_reasons:
+            return
+
+        if not self._pause_reasons:
+            self.logger.info('pausing')
+
+        self._pause_reasons.add(reason)
+        self._redistribute_ready_state()
+
+    def _resume(self, reason):
+        if reason not in self._pause_reasons:
+            return
+
+        self._pause_reasons.discard(reason)
+
+        if not self._pause_reasons:
+            self.logger.info('resuming')
+            self._redistribute_ready_state()
+
     @property
     def is_starved(self):
         """Evaluate whether any of the connections are starved.
@@ -290,6 +651,49 @@ class Consumer(object):
     def total_in_flight(self):
         return sum(c.in_flight for c in self._connections)
 
+    @property
+    def total_in_flight_bytes(self):
+        return sum(c.in_flight_bytes for c in self._connections)
+
+    def _bytes_ready_limit(self):
+        if not self.max_in_flight_bytes:
+            return None
+
+        # Until a message size is known, RDY 1 per connection.
+        if self._mean_message_size is None:
+            return max(len(self._connections), 1)
+
+        available = self.max_in_flight_bytes - self.total_in_flight_bytes
+        if available <= 0:
+            return 1
+
+        fits = int(available / max(self._mean_message_size, 1))
+        return max(self.total_in_flight + fits, 1)
+
+    def _track_bytes(self, message):
+        size = len(message.body)
+        if self._mean_message_size is None:
+            self._mean_message_size = size
+        else:
+            self._mean_message_size += (
+                (size - self._mean_message_size) * MESSAGE_SIZE_DECAY)
+
+        self._update_bytes_limit()
+
+    def _release_bytes(self):
+        if self.max_in_flight_bytes:
+            self._update_bytes_limit()
+
+    def _update_bytes_limit(self):
+        limit = self._bytes_ready_limit()
+        if limit == self._bytes_limit:
+            return
+
+        self.logger.debug('in flight bytes allow %d messages, updating RDY',
+                          limit)
+        self._bytes_limit = limit
+        self.redistribute_ready_state()
+
     def query_nsqd(self):
         self.logger.debug('querying nsqd...')
         for address in self.nsqd_tcp_addresses:
@@ -317,123 +721,134 @@ class Consumer(object):
     def _poll_lookupd(self):
         try:
             delay = self.lookupd_poll_interval * self.lookupd_poll_jitter
-            gevent.sleep(random.random() * delay)
+            self._backend.sleep(random.random() * delay)
 
-            while True:
-                gevent.sleep(self.lookupd_poll_interval)
-                self.query_lookupd()
+            while self.is_running:
+                self._backend.sleep(self.lookupd_poll_interval)
+                if self.is_running:
+                    self.query_lookupd()
 
-        except gevent.GreenletExit:
+        except self._backend.TaskExit:
             pass
 
     def _poll_ready(self):
         try:
-            while True:
+            while self.is_running:
                 if self._redistributed_ready_event.wait(5):
                     self._redistributed_ready_event.clear()
                 self._redistribute_ready_state()
 
-        except gevent.GreenletExit:
+        except self._backend.TaskExit:
             pass
 
-    def _redistribute_ready_state(self):
-        if not self.is_running:
-            return
-
-        if len(self._connections) > self.max_in_flight:
-            ready_state = self._get_unsaturated_ready_state()
-        else:
-            ready_state = self._get_saturated_ready_state()
-
-        for conn, count in ready_state.items():
-            if conn.ready_count == count:
-                self.logger.debug('[%s] RDY count already %d', conn, count)
-                continue
-
-            self.logger.debug('[%s] sending RDY %d', conn, count)
+    def _poll_lag(self):
+        try:
+            while self.is_running:
+                self._backend.sleep(self.lag_interval)
+                if self.is_running:
+                    self._check_lag()
 
-            try:
-                conn.ready(count)
-            except NSQSocketError as error:
-                self.logger.warning(
-                    '[%s] RDY %d failed (%r)', conn, count, error)
+        except self._backend.TaskExit:
+            pass
 
-    def _get_unsaturated_ready_state(self):
-        ready_state = {}
-        active = []
+    def _check_lag(self):
+        self.lag.roll()
 
-        for conn, state in self._connections.items():
-            if state == BACKOFF:
-                ready_state[conn] = 0
+        if self.lag_slo is None:
+            return
 
-            elif state in (RUNNING, THROTTLED):
-                active.append(conn)
+        for kind in (RECEIVE, FINISH):
+            lag = self.lag.percentile(self.lag_percentile, kind)
+            if lag is None or lag <= self.lag_slo:
+                continue
 
-        random.shuffle(active)
+            self.logger.warning(
+                'p%s %s lag %ss exceeds %ss', self.lag_percentile, kind, lag,
+                self.lag_slo)
+            self.on_lag.send(
+                self, kind=kind, percentile=self.lag_percentile, lag=lag)
 
-        for conn in active[self.max_in_flight:]:
-            ready_state[conn] = 0
+    def _run_timer_wheel(self):
+        try:
+            while self.is_running or self._state == DRAINING:
+                self._backend.sleep(self._timer_wheel.tick)
+                self._timer_wheel.advance()
 
-        for conn in active[:self.max_in_flight]:
-            ready_state[conn] = 1
+        except self._backend.TaskExit:
+            pass
 
-        return ready_state
+    def _schedule_touch(self, conn, message, touches):
+        delay = conn.msg_timeout / 1000 * self.auto_touch_fraction
+        self._timer_wheel.schedule(
+            delay, self._auto_touch, conn, message, touches)
 
-    def _get_saturated_ready_state(self):
-        ready_state = {}
-        active = []
-        now = time.time()
+    def _auto_touch(self, conn, message, touches):
+        if message.has_responded() or message.is_expired():
+            return
 
-        for conn, state in self._connections.items():
-            if state == BACKOFF:
-                ready_state[conn] = 0
+        if touches >= self.max_auto_touches:
+            self.logger.warning(
+                '[%s] message %s still in flight after %d touches',
+                conn, message.id, touches)
+            return
 
-            elif state == THROTTLED:
-                ready_state[conn] = 1
+        try:
+            message.touch()
+        except NSQException as error:
+            self.logger.debug(
+                '[%s] error touching message %s (%r)', conn, message.id,
+                error)
+            return
 
-            elif state == RUNNING:
-                if (now - conn.last_message) > self.low_ready_idle_timeout:
-                    self.logger.info(
-                        '[%s] idle connection, giving up RDY count', conn)
-                    ready_state[conn] = 1
+        self._schedule_touch(conn, message, touches + 1)
 
-                else:
-                    active.append(conn)
+    def redistribute_ready_state(self):
+        self._redistributed_ready_event.set()
 
-        if not active:
-            return ready_state
+    def _redistribute_ready_state(self):
+        with self._state_lock:
+            super(Consumer, self)._redistribute_ready_state()
 
-        ready_available = self.max_in_flight - sum(ready_state.values())
-        connection_max_in_flight = ready_available // len(active)
+    def _start_throttled(self, conn):
+        with self._state_lock:
+            super(Consumer, self)._start_throttled(conn)
 
-        for conn in active:
-            ready_state[conn] = connection_max_in_flight
+    def _finish_message(self, conn, backoff):
+        with self._state_lock:
+            super(Consumer, self)._finish_message(conn, backoff)
 
-        for conn in random.sample(active, ready_available % len(active)):
-            ready_state[conn] += 1
+    def _start_backoff(self, conn):
+        super(Consumer, self)._start_backoff(conn)
 
-        return ready_state
+        if self._metrics is not None:
+            interval = self._message_backoffs[conn].get_interval()
+            self._metrics.backing_off(conn, interval)
 
-    def redistribute_ready_state(self):
-        self._redistributed_ready_event.set()
+    def _call_later(self, seconds, func, *args):
+        self._backend.spawn_later(seconds, func, *args)
 
     def connect_to_nsqd(self, address, port):
         if not self.is_running:
             return
 
         conn = NsqdTCPClient(address, port, **self.conn_kwargs)
-        if conn in self._connections:
-            self.logger.debug('[%s] already connected', conn)
-            return
+        with self._state_lock:
+            if conn in self._connections:
+                self.logger.debug('[%s] already connected', conn)
+                return
 
-        self._connections[conn] = INIT
+            self._connections[conn] = INIT
         self.logger.debug('[%s] connecting...', conn)
 
-        conn.on_message.connect(self.handle_message)
+        if self._is_batching:
+            conn.on_messages.connect(self._dispatch_messages)
+        else:
+            conn.on_message.connect(self._dispatch_message)
         conn.on_response.connect(self.handle_response)
         conn.on_error.connect(self.handle_error)
         conn.on_finish.connect(self.handle_finish)
         conn.on_requeue.connect(self.handle_requeue)
+        conn.on_abandon.connect(self.handle_abandon)
         conn.on_auth.connect(self.handle_auth)
 
         try:
@@ -463,17 +878,21 @@ class Consumer(object):
         self.logger.info('[%s] connection successful', conn)
         self.handle_connection_success(conn)
 
-    def _listen(self, conn):
-        try:
-            conn.listen()
-        except NSQException as error:
+    def _handle_listen_exit(self, conn, error):
+        if error is not None:
             self.logger.warning('[%s] connection lost (%r)', conn, error)
 
         self.handle_connection_failure(conn)
 
     def handle_connection_success(self, conn):
-        self._connections[conn] = THROTTLED
-        self._workers.spawn(self._listen, conn)
+        with self._state_lock:
+            self._connections[conn] = THROTTLED
+
+        if self._metrics is not None:
+            self._metrics.connected(conn)
+
+        self._workers.add(
+            self._backend.listen(conn, self._handle_listen_exit))
         self.redistribute_ready_state()
 
         if str(conn) not in self.nsqd_tcp_addresses:
@@ -482,9 +901,19 @@ class Consumer(object):
         self._connection_backoffs[conn].success()
 
     def handle_connection_failure(self, conn):
-        del self._connections[conn]
+        with self._state_lock:
+            self._connections.pop(conn, None)
         conn.close_stream()
 
+        for message_id, task in list(self._handler_tasks.pop(conn, {}).items()):
+            self.logger.warning(
+                '[%s] connection lost, killing handler for message %s',
+                conn, message_id)
+            task.kill(block=False)
+
+        if self._metrics is not None:
+            self._metrics.connection_failed(conn)
+
         if not self.is_running:
             return
 
@@ -496,7 +925,7 @@ class Consumer(object):
         seconds = self._connection_backoffs[conn].failure().get_interval()
         self.logger.debug('[%s] retrying in %ss', conn, seconds)
 
-        gevent.spawn_later(
+        self._backend.spawn_later(
             seconds, self.connect_to_nsqd, conn.address, conn.port)
 
     def handle_auth(self, conn, response):
@@ -515,23 +944,36 @@ class Consumer(object):
 
     def handle_response(self, conn, response):
         self.logger.debug('[%s] response: %s', conn, response)
+
+        if response == nsq.CLOSE_WAIT and self._state == DRAINING:
+            self._close_waits.add(conn)
+            self.on_drain.send(
+                self, stage='close_wait', in_flight=self.total_in_flight)
+
         self.on_response.send(self, response=response)
 
     def handle_error(self, conn, error):
         self.logger.debug('[%s] error: %s', conn, error)
         self.on_error.send(self, error=error)
 
+    def _give_up(self, message):
+        if not self.max_tries or message.attempts <= self.max_tries:
+            return False
+
+        self.logger.warning(
+            "giving up on message '%s' after max tries %d",
+            message.id, self.max_tries)
+        self.on_giving_up.send(self, message=message)
+        message.finish()
+        return True
+
     def _handle_message(self, message):
-        if self.max_tries and message.attempts > self.max_tries:
-            self.logger.warning(
-                "giving up on message '%s' after max tries %d",
-                message.id, self.max_tries)
-            self.on_giving_up.send(self, message=message)
-            return message.finish()
+        if self._give_up(message):
+            return
 
         self.on_message.send(self, message=message)
 
-        if not self.is_running:
+        if self._state == CLOSED:
             return
 
         if message.is_async():
@@ -542,11 +984,102 @@ class Consumer(object):
 
         message.finish()
 
+    def _dispatch_message(self, conn, message):
+        if not self.kill_expired:
+            return self._backend.dispatch(self.handle_message, conn, message)
+
+        task = self._backend.spawn(self._handle_leased_message, conn, message)
+        self._handler_tasks[conn][message.id] = task
+        self._timer_wheel.schedule(
+            message.lease.remaining(), self._check_lease, conn, message, task)
+
+    def _handle_leased_message(self, conn, message):
+        try:
+            self.handle_message(conn, message)
+        finally:
+            self._handler_tasks.get(conn, {}).pop(message.id, None)
+
+    def _check_lease(self, conn, message, task):
+        if task.ready():
+            return
+
+        if not message.is_expired():
+            self._timer_wheel.schedule(
+                message.lease.remaining(), self._check_lease, conn, message,
+                task)
+            return
+
+        self.logger.warning(
+            '[%s] lease expired, killing handler for message %s',
+            conn, message.id)
+        task.kill(block=False)
+        conn.abandon(message)
+
+    def _receive_message(self, conn, message):
+        if self.dedup is not None and self.dedup.is_duplicate(message):
+            self.logger.debug(
+                '[%s] finishing duplicate message: %s', conn, message.id)
+            message.finish()
+            return False
+
+        if self.max_in_flight_bytes:
+            self._track_bytes(message)
+
+        if self.lag is not None:
+            self.lag.received(message)
+
+        # Local deliveries, such as a backfill, have no timeout to touch.
+        if self.auto_touch and conn.msg_timeout:
+            self._schedule_touch(conn, message, 0)
+
+        if self._metrics is not None:
+            metrics = self._metrics.connection(conn)
+            metrics.received.inc()
+            if self.max_tries and message.attempts > self.max_tries:
+                metrics.given_up.inc()
+
+        return True
+
     def handle_message(self, conn, message):
-        self.logger.debug('[%s] got message: %s', conn, message.id)
+        if not self._receive_message(conn, message):
+            return
+
+        if self._metrics is None:
+            return self._process_message(conn, message)
 
+        start = time.time()
         try:
-            return self._handle_message(message)
+            return self._process_message(conn, message)
+        finally:
+            self._metrics.handler_seconds.observe(time.time() - start)
+
+    def _dispatch_messages(self, conn, messages):
+        return self._backend.dispatch(self.handle_messages, conn, messages)
+
+    def handle_messages(self, conn, messages):
+        messages = [
+            message for message in messages
+            if self._receive_message(conn, message) and
+            not self._give_up(message)
+        ]
+
+        if not messages:
+            return
+
+        if self._metrics is None:
+            return self._process_messages(conn, messages)
+
+        start = time.time()
+        try:
+            return self._process_messages(conn, messages)
+        finally:
+            self._metrics.handler_seconds.observe(time.time() - start)
+
+    def _process_messages(self, conn, messages):
+        self.logger.debug('[%s] got %d messages', conn, len(messages))
+
+        try:
+            self.on_messages.send(self, messages=messages)
 
         except NSQRequeueMessage as error:
             if error.backoff is None:
@@ -557,76 +1090,78 @@ class Consumer(object):
         except Exception as error:
             backoff = True
             self.logger.exception(
-                '[%s] caught exception while handling message', conn)
-            self.on_exception.send(self, message=message, error=error)
+                '[%s] caught exception while handling messages', conn)
+            self.on_exception.send(self, message=None, error=error)
 
-        if not self.is_running:
-            return
+        else:
+            backoff = None
 
-        if message.has_responded():
+        if self._state == CLOSED:
             return
 
         try:
-            message.requeue(self.requeue_delay, backoff)
+            if backoff is None:
+                finish_all(m for m in messages if not m.is_async())
+            else:
+                requeue_all(messages, self.requeue_delay, backoff)
         except NSQException as error:
             self.logger.warning(
-                '[%s] error requeueing message (%r)', conn, error)
+                '[%s] error responding to messages (%r)', conn, error)
 
-    def _create_backoff(self):
-        return BackoffTimer(max_interval=self.max_backoff_duration)
+    def _process_message(self, conn, message):
+        self.logger.debug('[%s] got message: %s', conn, message.id)
 
-    def _start_backoff(self, conn):
-        self._connections[conn] = BACKOFF
+        try:
+            return self._handle_message(message)
 
-        interval = self._message_backoffs[conn].get_interval()
-        gevent.spawn_later(interval, self._start_throttled, conn)
+        except NSQRequeueMessage as error:
+            if error.backoff is None:
+                backoff = self.backoff_on_requeue
+            else:
+                backoff = error.backoff
 
-        self.logger.info('[%s] backing off for %s seconds', conn, interval)
-        self.redistribute_ready_state()
+        except Exception as error:
+            backoff = True
+            self.logger.exception(
+                '[%s] caught exception while handling message', conn)
+            self.on_exception.send(self, message=message, error=error)
 
-    def _start_throttled(self, conn):
-        if self._connections.get(conn) != BACKOFF:
+        if self._state == CLOSED:
             return
 
-        self._connections[conn] = THROTTLED
-        self.logger.info('[%s] testing backoff state with RDY 1', conn)
-        self.redistribute_ready_state()
-
-    def _complete_backoff(self, conn):
-        if self._message_backoffs[conn].is_reset():
-            self._connections[conn] = RUNNING
-            self.logger.info('throttle complete, resuming normal operation')
-            self.redistribute_ready_state()
-        else:
-            self._start_backoff(conn)
-
-    def _finish_message(self, conn, backoff):
-        if not self.max_backoff_duration:
+        if message.has_responded():
             return
 
         try:
-            state = self._connections[conn]
-        except KeyError:
-            return
-
-        if state == BACKOFF:
-            return
-
-        if backoff:
-            self._message_backoffs[conn].failure()
-            self._start_backoff(conn)
-
-        elif state == THROTTLED:
-            self._message_backoffs[conn].success()
-            self._complete_backoff(conn)
+            message.requeue(self.requeue_delay, backoff)
+        except NSQException as error:
+            self.logger.warning(
+                '[%s] error requeueing message (%r)', conn, error)
 
     def handle_finish(self, conn, message_id):
         self.logger.debug('[%s] finished message: %s', conn, message_id)
         self._finish_message(conn, backoff=False)
+        self._release_bytes()
+
+        if self._metrics is not None:
+            self._metrics.connection(conn).finished.inc()
+
         self.on_finish.send(self, message_id=message_id)
 
     def handle_requeue(self, conn, message_id, timeout, backoff):
         self.logger.debug(
             '[%s] requeued message: %s (%s)', conn, message_id, timeout)
         self._finish_message(conn, backoff=backoff)
+        self._release_bytes()
+
+        if self._metrics is not None:
+            self._metrics.connection(conn).requeued.inc()
+
         self.on_requeue.send(self, message_id=message_id, timeout=timeout)
+
+    def handle_abandon(self, conn, message):
+        self.logger.debug('[%s] abandoned message: %s', conn, message.id)
+        self._release_bytes()
+
+        if self._metrics is not None:
+            self._metrics.connection(conn).abandoned.inc()
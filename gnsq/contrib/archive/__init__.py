@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""Archive topics to compressed files, like nsq_to_file.
+
+Run an archiver with::
+
+    python -m gnsq.contrib.archive TOPIC CHANNEL PATH \\
+        --nsqd-tcp-address HOST:PORT
+"""
+from __future__ import absolute_import, division
+
+import logging
+import os
+import struct
+import time
+import zlib
+
+from collections import namedtuple
+
+import gevent
+import gevent.event
+import gevent.lock
+
+from gnsq.message import finish_all, requeue_all
+
+#: Record header: timestamp, id and body length.
+_RECORD = struct.Struct('>q16sI')
+
+#: Index entry: file offset, record count, min and max timestamp.
+_BLOCK = struct.Struct('>QIqq')
+
+INDEX_SUFFIX = '.idx'
+READ_SIZE = 64 * 1024
+
+#: Zlib window bits and file suffix for each compression.
+COMPRESSION = {
+    None: (None, ''),
+    'gzip': (16 + zlib.MAX_WBITS, '.gz'),
+    'zlib': (zlib.MAX_WBITS, '.zz'),
+}
+
+ArchiveRecord = namedtuple('ArchiveRecord', ['id', 'timestamp', 'body'])
+ArchiveBlock = namedtuple(
+    'ArchiveBlock', ['offset', 'count', 'min_timestamp', 'max_timestamp'])
+
+
+class ArchiveFile(object):
+    """An archive file open for writing, with its index.
+
+    Each flush is written as a block that starts on a full compressor flush,
+    so a reader can start decompressing at any block offset in the index.
+    """
+
+    def __init__(self, path, compression=None, level=6):
+        self.path = path
+        self.opened = time.time()
+        self.size = 0
+
+        wbits = COMPRESSION[compression][0]
+        if wbits is None:
+            self.compressor = None
+        else:
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+
+        self.file = open(path, 'wb')
+        self.index = open(path + INDEX_SUFFIX, 'wb')
+
+    def write_block(self, data, count, min_timestamp, max_timestamp):
+        """Write and fsync a block of records."""
+        if self.compressor is not None:
+            data = (self.compressor.compress(data) +
+                    self.compressor.flush(zlib.Z_FULL_FLUSH))
+
+        entry = _BLOCK.pack(self.size, count, min_timestamp, max_timestamp)
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        self.index.write(entry)
+        self.index.flush()
+        os.fsync(self.index.fileno())
+
+        self.size += len(data)
+
+    def close(self):
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush(zlib.Z_FINISH))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.index.close()
+
+
+class Archiver(object):
+    """Write the messages of a consumer to rotating, compressed files.
+
+    Connect it as the consumer's ``batch_handler``. Records are buffered and
+    written in blocks by a background greenlet every ``flush_interval``
+    seconds, or once ``max_buffered`` messages, or every message in flight,
+    are buffered. Messages are finished only after their block is written and
+    fsynced, so a crash loses nothing that was finished. The disk writes run
+    in the gevent threadpool and do not block the connections.
+
+    Files are named ``<prefix>.<UTC time>.<sequence><suffix>`` in ``path``
+    and rotated once ``max_file_bytes`` are written or the file is
+    ``max_file_seconds`` old. Each file has an index of its blocks with their
+    timestamps, see :func:`read_archive`.
+
+    Example usage::
+
+        >>> archiver = Archiver('/var/lib/archive', prefix='events')
+        >>> consumer = Consumer('events', 'archive', 'localhost:4150',
+        ...                     max_in_flight=5000, batch_handler=archiver)
+        >>> consumer.start()
+
+    :param path: the directory to write files to
+
+    :param prefix: the file name prefix
+
+    :param compression: ``'gzip'``, ``'zlib'`` or ``None``
+
+    :param level: the compression level
+
+    :param flush_interval: the maximum time in seconds a message is buffered.
+        Keep it well below the channel's message timeout
+
+    :param max_buffered: flush once this many messages are buffered
+
+    :param max_file_bytes: rotate once a file has this many bytes
+
+    :param max_file_seconds: rotate once a file is this many seconds old
+    """
+
+    def __init__(self, path, prefix='archive', compression='gzip', level=6,
+                 flush_interval=1.0, max_buffered=10000,
+                 max_file_bytes=256 * 1024 * 1024, max_file_seconds=3600):
+        if compression not in COMPRESSION:
+            raise ValueError('invalid compression %r' % (compression,))
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.prefix = prefix
+        self.compression = compression
+        self.level = level
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds
+
+        self.file = None
+        self.consumers = set()
+        self._sequence = 0
+        self._records = []
+        self._messages = []
+        self._full = gevent.event.Event()
+        self._lock = gevent.lock.RLock()
+        self.worker = gevent.spawn(self._run)
+
+    def __call__(self, consumer, messages):
+        if consumer not in self.consumers:
+            self.consumers.add(consumer)
+            consumer.on_close.connect(self._on_close, weak=False)
+
+        pack = _RECORD.pack
+        records = self._records
+
+        for message in messages:
+            message.enable_async()
+            body = message.body
+            records.append(pack(message.timestamp, message.id, len(body)))
+            records.append(body)
+
+        self._messages.extend(messages)
+
+        buffered = len(self._messages)
+        if buffered >= min(self.max_buffered, consumer.max_in_flight):
+            self._full.set()
+
+    def _run(self):
+        while True:
+            self._full.wait(self.flush_interval)
+            self._full.clear()
+
+            try:
+                with self._lock:
+                    self.flush()
+                    self._check_rotate()
+            except Exception:
+                self.logger.exception('error writing archive')
+
+    def flush(self):
+        """Write the buffered messages and finish them."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        messages, self._messages = self._messages, []
+        records, self._records = self._records, []
+
+        if not messages:
+            return
+
+        timestamps = [message.timestamp for message in messages]
+        try:
+            self._write_block(
+                b''.join(records), len(messages),
+                min(timestamps), max(timestamps))
+        except Exception:
+            requeue_all(messages)
+            raise
+
+        finish_all(m for m in messages if not m.has_responded())
+
+    def _write_block(self, data, count, min_timestamp, max_timestamp):
+        if self.file is None:
+            self.file = ArchiveFile(
+                self._next_path(), self.compression, self.level)
+
+        gevent.get_hub().threadpool.apply(
+            self.file.write_block,
+            (data, count, min_timestamp, max_timestamp))
+
+    def _next_path(self):
+        started = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        suffix = COMPRESSION[self.compression][1]
+
+        while True:
+            self._sequence += 1
+            path = os.path.join(self.path, '%s.%s.%06d%s' % (
+                self.prefix, started, self._sequence, suffix))
+            if not os.path.exists(path):
+                return path
+
+    def _check_rotate(self):
+        if self.file is None:
+            return
+
+        if (self.file.size >= self.max_file_bytes or
+                time.time() - self.file.opened >= self.max_file_seconds):
+            self.rotate()
+
+    def rotate(self):
+        """Close the current file. The next block starts a new file."""
+        with self._lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _on_close(self, consumer):
+        try:
+            self.flush()
+        except Exception:
+            self.logger.exception('error writing archive')
+
+    def close(self):
+        """Stop the worker, write the buffered messages and close the file."""
+        # The lock keeps the worker from being killed during a write.
+        with self._lock:
+            self.worker.kill()
+            try:
+                self.flush()
+            finally:
+                self.rotate()
+
+
+def read_index(path):
+    """Return the :class:`ArchiveBlock` entries of an archive file."""
+    try:
+        with open(path + INDEX_SUFFIX, 'rb') as fp:
+            data = fp.read()
+    except IOError:
+        return []
+
+    count = len(data) // _BLOCK.size
+    return [ArchiveBlock(*_BLOCK.unpack_from(data, i * _BLOCK.size))
+            for i in range(count)]
+
+
+def _compression_of(path):
+    for compression, (_, suffix) in COMPRESSION.items():
+        if suffix and path.endswith(suffix):
+            return compression
+    return None
+
+
+def _read_chunks(path, offset, compression):
+    wbits = COMPRESSION[compression][0]
+    if wbits is not None and offset:
+        # Blocks after the first start on a full flush of raw deflate data.
+        wbits = -zlib.MAX_WBITS
+
+    decompressor = None
+    if wbits is not None:
+        decompressor = zlib.decompressobj(wbits)
+
+    with open(path, 'rb') as fp:
+        fp.seek(offset)
+        while True:
+            chunk = fp.read(READ_SIZE)
+            if not chunk:
+                break
+
+            if decompressor is None:
+                yield chunk
+                continue
+
+            yield decompressor.decompress(chunk, READ_SIZE)
+            while decompressor.unconsumed_tail:
+                yield decompressor.decompress(
+                    decompressor.unconsumed_tail, READ_SIZE)
+
+            if decompressor.unused_data:
+                break
+
+
+def _seek_record(blocks, start):
+    # The offset of the block holding record ``start``, and the number of
+    # records before it in the block.
+    offset, skip = 0, start
+    first = 0
+    for block in blocks:
+        if first > start:
+            break
+        offset, skip = block.offset, start - first
+        first += block.count
+    return offset, skip
+
+
+def _seek_timestamp(blocks, since):
+    # The offset of the first block that may hold a message from ``since``,
+    # or None if every indexed message is older.
+    for block in blocks:
+        if block.max_timestamp >= since:
+            return block.offset
+
+    if not blocks:
+        return 0
+    return None
+
+
+def read_archive(path, since=None, start=0):
+    """Iterate over the :class:`ArchiveRecord` entries of an archive file.
+
+    The file is decompressed in chunks, so memory use does not grow with the
+    file size. With ``since``, a timestamp in nanoseconds, reading starts at
+    the first block that may hold a later message, found in the index, and
+    earlier messages are skipped. With ``start``, the first ``start`` records
+    are skipped, starting at the block holding the next one.
+
+    A file left unfinished by a crash is read up to its last complete record.
+    """
+    if since is not None and start:
+        raise ValueError('since and start are exclusive')
+
+    offset = skip = 0
+    if start:
+        offset, skip = _seek_record(read_index(path), start)
+
+    if since is not None:
+        offset = _seek_timestamp(read_index(path), since)
+        if offset is None:
+            return
+
+    buf = b''
+    for chunk in _read_chunks(path, offset, _compression_of(path)):
+        buf += chunk
+
+        position = 0
+        while len(buf) - position >= _RECORD.size:
+            timestamp, message_id, size = _RECORD.unpack_from(buf, position)
+            end = position + _RECORD.size + size
+            if end > len(buf):
+                break
+
+            if skip:
+                skip -= 1
+            elif since is None or timestamp >= since:
+                yield ArchiveRecord(
+                    message_id, timestamp, buf[end - size:end])
+            position = end
+
+        buf = buf[position:]
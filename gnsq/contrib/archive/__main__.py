@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Archive a topic to compressed files until interrupted."""
+from __future__ import absolute_import
+
+import argparse
+
+from gnsq import Consumer
+
+from . import COMPRESSION, Archiver
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m gnsq.contrib.archive')
+    parser.add_argument('topic')
+    parser.add_argument('channel')
+    parser.add_argument('path', help='the directory to write files to')
+    parser.add_argument('--nsqd-tcp-address', action='append', default=[])
+    parser.add_argument('--lookupd-http-address', action='append',
+                        default=[])
+    parser.add_argument('--prefix', default=None,
+                        help='the file name prefix (default: the topic)')
+    parser.add_argument('--compression', default='gzip',
+                        choices=[c for c in COMPRESSION if c])
+    parser.add_argument('--no-compression', dest='compression',
+                        action='store_const', const=None)
+    parser.add_argument('--max-in-flight', type=int, default=5000)
+    parser.add_argument('--flush-interval', type=float, default=1.0)
+    parser.add_argument('--max-file-bytes', type=int,
+                        default=256 * 1024 * 1024)
+    parser.add_argument('--max-file-seconds', type=float, default=3600)
+    args = parser.parse_args(argv)
+
+    if not args.nsqd_tcp_address and not args.lookupd_http_address:
+        parser.error('--nsqd-tcp-address or --lookupd-http-address required')
+
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    archiver = Archiver(
+        args.path,
+        prefix=args.prefix or args.topic,
+        compression=args.compression,
+        flush_interval=args.flush_interval,
+        max_buffered=args.max_in_flight,
+        max_file_bytes=args.max_file_bytes,
+        max_file_seconds=args.max_file_seconds,
+    )
+
+    consumer = Consumer(
+        args.topic, args.channel,
+        nsqd_tcp_addresses=args.nsqd_tcp_address,
+        lookupd_http_addresses=args.lookupd_http_address,
+        max_in_flight=args.max_in_flight,
+        batch_handler=archiver,
+    )
+
+    try:
+        consumer.start()
+    except KeyboardInterrupt:
+        consumer.close()
+        consumer.join()
+    finally:
+        archiver.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""Replay archived messages through a consumer's handlers without nsqd.
+
+Run a backfill with::
+
+    python -m gnsq.contrib.backfill myapp.workers:consumer /var/lib/archive/*
+"""
+from __future__ import absolute_import, division
+
+import gzip
+import json
+import logging
+import os
+import struct
+import time
+
+from bisect import bisect
+from collections import deque
+from itertools import islice
+
+import gevent
+import gevent.event
+
+from gnsq.contrib.archive import read_archive
+from gnsq.message import Message
+
+#: The supported file formats.
+FORMATS = ('archive', 'length', 'newline')
+
+_LENGTH = struct.Struct('>I')
+READ_SIZE = 64 * 1024
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def _read_length_prefixed(path):
+    with _open(path) as fp:
+        buf = b''
+        while True:
+            chunk = fp.read(READ_SIZE)
+            if not chunk:
+                return
+
+            buf += chunk
+            position = 0
+            while len(buf) - position >= _LENGTH.size:
+                size, = _LENGTH.unpack_from(buf, position)
+                end = position + _LENGTH.size + size
+                if end > len(buf):
+                    break
+                yield None, None, buf[end - size:end]
+                position = end
+
+            buf = buf[position:]
+
+
+def _read_newline(path):
+    with _open(path) as fp:
+        for line in fp:
+            if line.endswith(b'\n'):
+                line = line[:-1]
+            yield None, None, line
+
+
+def read_records(path, format='archive', start=0):
+    """Iterate over ``(id, timestamp, body)`` for the messages in a file.
+
+    ``format`` is one of:
+
+    * ``'archive'``: files written by :class:`~gnsq.contrib.archive.Archiver`
+    * ``'length'``: bodies each prefixed with a 4 byte big endian length
+    * ``'newline'``: newline delimited bodies, as written by ``nsq_to_file``
+
+    The ``'length'`` and ``'newline'`` formats have no ids or timestamps, so
+    these are ``None``. Files ending in ``.gz`` are decompressed.
+
+    The first ``start`` records are skipped. Archives seek to the block
+    holding the next record; the other formats are read up to it.
+    """
+    if format == 'archive':
+        return (
+            (r.id, r.timestamp, r.body)
+            for r in read_archive(path, start=start))
+
+    if format == 'length':
+        return islice(_read_length_prefixed(path), start, None)
+
+    if format == 'newline':
+        return islice(_read_newline(path), start, None)
+
+    raise ValueError('invalid format %r' % (format,))
+
+
+class Checkpoint(object):
+    """The progress of a backfill, saved to a json file.
+
+    The file is replaced atomically, so an interrupted write leaves the
+    previous checkpoint.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """Return the saved state, or ``None`` if there is none."""
+        try:
+            with open(self.path) as fp:
+                return json.load(fp)
+        except (IOError, OSError):
+            return None
+
+    def save(self, state):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(tmp, self.path)
+
+
+class LocalConnection(object):
+    """Stands in for the nsqd connection backfilled messages arrive on.
+
+    Backfilled messages do not time out, so they are not touched.
+    """
+    is_connected = True
+    msg_timeout = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class Backfill(object):
+    """Replay archived messages through the handlers of a consumer.
+
+    Messages are read from ``paths`` in order and handed to the same
+    :attr:`~gnsq.Consumer.on_message` or :attr:`~gnsq.Consumer.on_messages`
+    receivers, through the same code the consumer runs for nsqd messages:
+    ``max_tries`` and give up handling, de-duplication, exception signals and
+    finishing messages that were not responded to.
+
+    Like a consumer, at most ``max_in_flight`` messages, lowered by the
+    consumer's ready limits, are in flight across ``connections`` greenlets,
+    each handling its messages in turn as a connection's reader greenlet
+    does. Requeued messages are delivered again with one more attempt, as
+    soon as there is room rather than after the requeue delay.
+
+    With a ``checkpoint`` path, the position below which every message was
+    responded to is saved every ``checkpoint_interval`` seconds and when the
+    backfill ends, along with the file it is in. A backfill started with the
+    same checkpoint and paths resumes from there without reading the earlier
+    files, seeking within archives. Messages after the position that were
+    already responded to are handled again.
+
+    The consumer is not started. Example usage::
+
+        >>> consumer = Consumer('events', 'worker', 'localhost:4150',
+        ...                     max_in_flight=100, message_handler=handler)
+        >>> backfill = Backfill(consumer, sorted(glob.glob('archive/*.gz')),
+        ...                     checkpoint='backfill.json')
+        >>> backfill.run()
+
+    :param consumer: the :class:`~gnsq.Consumer` whose handlers to run
+
+    :param paths: the files to read, in order
+
+    :param format: the file format, see :func:`read_records`
+
+    :param checkpoint: the file to save progress to
+
+    :param checkpoint_interval: the time in seconds between checkpoints
+
+    :param connections: the number of greenlets handling messages
+
+    :param batch_size: the maximum number of messages sent to
+        :attr:`~gnsq.Consumer.on_messages` at once (default: as many as
+        there is room for)
+    """
+
+    def __init__(self, consumer, paths, format='archive', checkpoint=None,
+                 checkpoint_interval=5.0, connections=1, batch_size=None):
+        if format not in FORMATS:
+            raise ValueError('invalid format %r' % (format,))
+
+        self.logger = logging.getLogger(__name__)
+        self.consumer = consumer
+        self.paths = list(paths)
+        self.format = format
+        self.checkpoint_interval = checkpoint_interval
+        self.connections = connections
+        self.batch_size = batch_size
+
+        if checkpoint is None or isinstance(checkpoint, Checkpoint):
+            self.checkpoint = checkpoint
+        else:
+            self.checkpoint = Checkpoint(checkpoint)
+
+        self.position = 0
+        self.read = 0
+        self.in_flight = 0
+        self.finished = 0
+        self.requeued = 0
+
+        self._source = None
+        self._file = None
+        self._file_start = 0
+        self._file_starts = []
+        self._retries = deque()
+        self._outstanding = {}
+        self._changed = gevent.event.Event()
+
+    def _load_checkpoint(self):
+        state = self.checkpoint and self.checkpoint.load()
+        if not state:
+            return
+
+        self.position = self.read = state['position']
+        self.finished = state.get('finished', 0)
+        self.requeued = state.get('requeued', 0)
+
+        index = state.get('file', 0)
+        if index < len(self.paths) and self.paths[index] == state.get('path'):
+            self._file = index
+            self._file_start = state['file_position']
+
+        self.logger.info('resuming backfill at message %d', self.position)
+
+    def save_checkpoint(self):
+        """Save the current position, if there is a checkpoint."""
+        if self._outstanding:
+            self.position = min(self._outstanding.values())
+        else:
+            self.position = self.read
+
+        if self.checkpoint is None:
+            return
+
+        state = {
+            'position': self.position,
+            'finished': self.finished,
+            'requeued': self.requeued,
+        }
+
+        # The file holding the position, to resume without reading the
+        # files before it.
+        index = bisect(self._file_starts, (self.position, len(self.paths)))
+        if index:
+            start, file_index = self._file_starts[index - 1]
+            state.update(
+                file=file_index, path=self.paths[file_index],
+                file_position=start)
+
+        self.checkpoint.save(state)
+
+    def _read(self):
+        number = self._file_start
+
+        for index in range(self._file or 0, len(self.paths)):
+            self._file_starts.append((number, index))
+
+            # Without the file from a checkpoint, read up to the position.
+            skip = 0
+            if index == self._file:
+                skip = self.read - number
+                number += skip
+
+            for message_id, timestamp, body in read_records(
+                    self.paths[index], self.format, skip):
+                if number < self.read:
+                    number += 1
+                    continue
+
+                if message_id is None:
+                    message_id = ('%016x' % number).encode('ascii')
+
+                if timestamp is None:
+                    timestamp = int(time.time() * 1e9)
+
+                yield number, Message(timestamp, 1, message_id, body)
+                number += 1
+
+    def _deliver(self, message, number):
+        self._outstanding[id(message)] = number
+        message.on_finish.connect(self._handle_finish, weak=False)
+        message.on_requeue.connect(self._handle_requeue, weak=False)
+        self.in_flight += 1
+
+    def _take(self, count):
+        messages = []
+
+        while self._retries and len(messages) < count:
+            message, number = self._retries.popleft()
+            self._deliver(message, number)
+            messages.append(message)
+
+        while self._source is not None and len(messages) < count:
+            try:
+                number, message = next(self._source)
+            except StopIteration:
+                self._source = None
+                break
+
+            self.read = number + 1
+            self._deliver(message, number)
+            messages.append(message)
+
+        return messages
+
+    def _is_done(self):
+        return (
+            self._source is None and not self._retries and
+            not self.in_flight)
+
+    def _wait(self):
+        self._changed.clear()
+        self._changed.wait(0.1)
+
+    def _room(self):
+        return self.consumer._get_max_in_flight() - self.in_flight
+
+    def _run_connection(self, conn):
+        consumer = self.consumer
+        batching = consumer._is_batching
+
+        while not self._is_done():
+            room = self._room()
+            if room <= 0:
+                self._wait()
+                continue
+
+            if not batching:
+                room = 1
+            elif self.batch_size:
+                room = min(room, self.batch_size)
+
+            messages = self._take(room)
+            if not messages:
+                self._wait()
+                continue
+
+            if batching:
+                consumer.handle_messages(conn, messages)
+            else:
+                consumer.handle_message(conn, messages[0])
+
+    def _handle_finish(self, message):
+        self._respond(message)
+        self.finished += 1
+        self.consumer.on_finish.send(self.consumer, message_id=message.id)
+
+    def _handle_requeue(self, message, timeout, backoff):
+        number = self._respond(message)
+        self.requeued += 1
+
+        retry = Message(
+            message.timestamp, message.attempts + 1, message.id, message.body)
+        self._outstanding[id(retry)] = number
+        self._retries.append((retry, number))
+
+        self.consumer.on_requeue.send(
+            self.consumer, message_id=message.id, timeout=timeout)
+
+    def _respond(self, message):
+        self.in_flight -= 1
+        self._changed.set()
+        return self._outstanding.pop(id(message))
+
+    def _run_checkpoints(self):
+        while True:
+            gevent.sleep(self.checkpoint_interval)
+            self.save_checkpoint()
+
+    def run(self):
+        """Handle every message, and return the number finished."""
+        self.consumer._check_receivers()
+        self._load_checkpoint()
+        self._source = self._read()
+
+        checkpoints = gevent.spawn(self._run_checkpoints)
+        workers = [
+            gevent.spawn(self._run_connection, LocalConnection(
+                'backfill:%d' % number))
+            for number in range(self.connections)]
+
+        try:
+            gevent.joinall(workers, raise_error=True)
+        finally:
+            gevent.killall(workers + [checkpoints])
+            self.save_checkpoint()
+
+        return self.finished
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Replay archived messages through a consumer's handlers."""
+from __future__ import absolute_import, print_function
+
+import argparse
+import importlib
+
+from gnsq import Consumer
+
+from . import FORMATS, Backfill
+
+
+def load_consumer(name):
+    """Import ``module:attribute``, a consumer or a callable returning one."""
+    module_name, _, attribute = name.partition(':')
+    consumer = getattr(importlib.import_module(module_name), attribute)
+
+    if not isinstance(consumer, Consumer):
+        consumer = consumer()
+
+    return consumer
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m gnsq.contrib.backfill')
+    parser.add_argument('consumer', help='module:attribute of a consumer, or '
+                        'of a callable returning one')
+    parser.add_argument('paths', nargs='+', help='the files to read, in order')
+    parser.add_argument('--format', default='archive', choices=FORMATS)
+    parser.add_argument('--checkpoint', default=None,
+                        help='the file to save progress to')
+    parser.add_argument('--checkpoint-interval', type=float, default=5.0)
+    parser.add_argument('--connections', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    backfill = Backfill(
+        load_consumer(args.consumer),
+        args.paths,
+        format=args.format,
+        checkpoint=args.checkpoint,
+        checkpoint_interval=args.checkpoint_interval,
+        connections=args.connections,
+        batch_size=args.batch_size,
+    )
+
+    finished = backfill.run()
+    print('finished {} messages, requeued {}'.format(
+        finished, backfill.requeued))
+
+
+if __name__ == '__main__':
+    main()
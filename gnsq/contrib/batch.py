@@ -1,39 +1,115 @@
 # -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
 import logging
-import warnings
+import time
 
-import gevent.queue
+from collections import OrderedDict
+
+import gevent
+import gevent.event
 import gevent.pool
+import gevent.queue
 
 from gnsq.errors import NSQException
+from gnsq.metrics import Histogram
+
+#: Batch size histogram buckets, in messages.
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+class Batch(object):
+    """Messages buffered for one flush."""
+    __slots__ = ('key', 'messages', 'bytes', 'started')
+
+    def __init__(self, key=None):
+        self.key = key
+        self.messages = []
+        self.bytes = 0
+        self.started = time.time()
 
+    def add(self, message):
+        self.messages.append(message)
+        self.bytes += len(message.body)
 
-TIMEOUT_WARNING = 'batching timed out. batch size may be to large'
-STARVED_WARNING = 'consumer is starved. batch size may be to large'
+    def __len__(self):
+        return len(self.messages)
 
 
 class BatchHandler(object):
     """Batch message handler for gnsq.
 
-    It is recommended to use a max inflight greater than the batch size.
+    Messages are buffered without blocking the connection and flushed as a
+    batch when ``batch_size`` messages or ``max_batch_bytes`` of message
+    bodies are buffered, or when the oldest message has waited ``timeout``
+    seconds. Each batch is handled in a greenlet started with ``spawn``, or,
+    with ``flushers``, by that many long running workers, so up to that many
+    :meth:`handle_batch` calls run concurrently.
+
+    Buffered and flushing messages stay in flight. When the number of
+    concurrent batches is bounded, by ``flushers`` or a pool size passed as
+    ``spawn``, backpressure is applied through the consumer's RDY count: the
+    handler limits it to enough messages for the batch being filled, one
+    batch per flusher and ``max_pending_batches`` waiting batches (see
+    :meth:`Consumer.add_ready_limit <gnsq.Consumer.add_ready_limit>`). A
+    batch is also flushed once it holds the consumer's ``max_in_flight``
+    messages, since no more can arrive.
+
+    Flush latency and batch sizes are kept in the :attr:`flush_seconds` and
+    :attr:`batch_sizes` histograms, registered with ``registry`` when given.
 
     Example usage::
 
         >>> consumer = Consumer('topic', 'worker', max_in_flight=16)
         >>> consumer.on_message.connect(BatchHandler(8, my_handler), weak=False)
+
+    :param batch_size: the maximum number of messages in a batch
+
+    :param timeout: the maximum time in seconds a message is buffered before
+        its batch is flushed
+
+    :param spawn: spawns a greenlet to handle each batch. An integer handles
+        batches in a pool of that size
+
+    :param max_batch_bytes: flush once the buffered message bodies reach this
+        many bytes
+
+    :param flushers: handle batches in this many long running workers
+        instead of a greenlet per batch. ``spawn`` is not used
+
+    :param max_pending_batches: the number of full batches that may wait for
+        a flusher before the RDY count stops new messages (defaults to the
+        number of concurrent batches)
+
+    :param registry: a :class:`~gnsq.metrics.MetricsRegistry` to register the
+        histograms with, labelled with ``labels``
     """
     def __init__(self, batch_size, handle_batch=None, handle_message=None,
                  handle_batch_error=None, handle_message_error=None,
-                 timeout=10, spawn=gevent.spawn):
+                 timeout=10, spawn=gevent.spawn, max_batch_bytes=None,
+                 flushers=None, max_pending_batches=None, registry=None,
+                 labels=None):
         self.logger = logging.getLogger(__name__)
-        self.message_channel = gevent.queue.Channel()
         self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
         self.timeout = timeout
 
+        # The number of batches handled at once, or None if unbounded.
+        self.concurrency = flushers
+
         if isinstance(spawn, int):
+            if flushers is None:
+                self.concurrency = spawn
             spawn = gevent.pool.Pool(spawn).spawn
 
+        if max_pending_batches is None:
+            max_pending_batches = self.concurrency
+
         self.spawn = spawn
+        self.flushers = flushers
+        self.max_pending_batches = max_pending_batches
+        self.max_buffered = batch_size
+        self.consumers = set()
 
         if handle_batch is not None:
             self.handle_batch = handle_batch
@@ -47,34 +123,136 @@ class BatchHandler(object):
         if handle_message_error is not None:
             self.handle_message_error = handle_message_error
 
-        self.worker = gevent.spawn(self._run)
+        self._create_metrics(registry, labels or {})
+
+        self.buffers = OrderedDict()
+        self.buffered = 0
+        self.batches = gevent.queue.Queue()
+        self._buffering = gevent.event.Event()
+
+        if flushers is None:
+            self.workers = [gevent.spawn(self._run_spawner)]
+        else:
+            self.workers = [
+                gevent.spawn(self._run_flusher) for _ in range(flushers)]
+
+        self.worker = gevent.spawn(self._run_timer)
+
+    def _create_metrics(self, registry, labels):
+        if registry is None:
+            self.flush_seconds = Histogram()
+            self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+            return
+
+        self.flush_seconds = registry.histogram(
+            'batch_flush_seconds', 'Time to handle a batch.',
+        ).labels(**labels)
+        self.batch_sizes = registry.histogram(
+            'batch_size_messages', 'Messages per batch.', BATCH_SIZE_BUCKETS,
+        ).labels(**labels)
 
     def __call__(self, consumer, message):
+        if consumer not in self.consumers:
+            self.consumers.add(consumer)
+            consumer.add_ready_limit(self.ready_limit)
+
         message.enable_async()
-        self.message_channel.put(message)
+        key = self.key(message)
+
+        batch = self.buffers.get(key)
+        if batch is None:
+            batch = self.buffers[key] = Batch(key)
+            self._buffering.set()
+
+        batch.add(message)
+        self.buffered += 1
+
+        if self._is_full(batch):
+            self.flush(key)
+
+        # Nothing more arrives once every message in flight is buffered.
+        elif self.buffered >= min(self.max_buffered, consumer.max_in_flight):
+            self.flush(next(iter(self.buffers)))
+
+    def key(self, message):
+        return None
+
+    def _is_full(self, batch):
+        if len(batch) >= self.batch_size:
+            return True
+
+        if self.max_batch_bytes is None:
+            return False
 
-        if consumer.is_starved:
-            self.message_channel.put(StopIteration)
+        return batch.bytes >= self.max_batch_bytes
 
-    def _run(self):
+    def ready_limit(self):
+        """The number of messages the handler allows in flight.
+
+        Returns ``None``, no limit, when batches are handled in a greenlet
+        each without a bound.
+        """
+        if self.concurrency is None:
+            return None
+
+        return self.max_buffered + self.batch_size * (
+            self.concurrency + self.max_pending_batches)
+
+    def flush(self, key=None):
+        """Hand the messages buffered for ``key`` to a flusher."""
+        batch = self.buffers.pop(key, None)
+        if not self.buffers:
+            self._buffering.clear()
+
+        if batch:
+            self.buffered -= len(batch)
+            self.batches.put(batch)
+
+    def flush_all(self):
+        """Hand every buffered message to the flushers."""
+        for key in list(self.buffers):
+            self.flush(key)
+
+    def _run_timer(self):
         while True:
-            messages = []
+            self._buffering.wait()
 
-            while len(messages) < self.batch_size:
-                try:
-                    message = self.message_channel.get(timeout=self.timeout)
-                except gevent.queue.Empty:
-                    warnings.warn(TIMEOUT_WARNING, RuntimeWarning)
-                    break
+            # Buffers are created in order, so the first is the oldest.
+            for key, batch in self.buffers.items():
+                break
+            else:
+                self._buffering.clear()
+                continue
+
+            delay = batch.started + self.timeout - time.time()
+            if delay > 0:
+                gevent.sleep(delay)
+            elif self.buffers.get(key) is batch:
+                self.flush(key)
+
+    def _run_spawner(self):
+        # A pool's spawn blocks while it is full, leaving batches queued.
+        for batch in self.batches:
+            self.spawn(self._flush_batch, batch)
+
+    def _run_flusher(self):
+        for batch in self.batches:
+            self._flush_batch(batch)
 
-                if message is StopIteration:
-                    warnings.warn(STARVED_WARNING, RuntimeWarning)
-                    break
+    def _flush_batch(self, batch):
+        self.batch_sizes.observe(len(batch))
 
-                messages.append(message)
+        start = time.time()
+        try:
+            self.run_batch(batch.messages, batch.key)
+        except Exception:
+            self.logger.exception('caught exception while flushing batch')
+        finally:
+            self.flush_seconds.observe(time.time() - start)
 
-            if messages:
-                self.spawn(self.run_batch, messages)
+    def kill(self):
+        """Stop the workers. Buffered messages are not flushed."""
+        gevent.killall(self.workers + [self.worker])
 
     def finish_message(self, message):
         if message.has_responded():
@@ -102,7 +280,7 @@ class BatchHandler(object):
                 continue
             self.requeue_message(message)
 
-    def run_batch(self, messages):
+    def run_batch(self, messages, key=None):
         batch = []
 
         for message in messages:
@@ -115,7 +293,7 @@ class BatchHandler(object):
 
         if batch:
             try:
-                self.handle_batch(batch)
+                self._handle_batch(key, batch)
             except Exception as error:
                 self.logger.exception('caught exception while handling batch')
                 self.handle_batch_error(error, messages, batch)
@@ -124,6 +302,9 @@ class BatchHandler(object):
 
         self.finish_messages(messages)
 
+    def _handle_batch(self, key, batch):
+        self.handle_batch(batch)
+
     def handle_message(self, message):
         """Handle a single message.
 
@@ -161,3 +342,57 @@ class BatchHandler(object):
         This may be overridden or passed into the constructor.
         """
         pass
+
+
+class KeyedBatchHandler(BatchHandler):
+    """Batch message handler grouping messages by key.
+
+    Works like :class:`BatchHandler`, but ``partition_key(message)`` picks a
+    separate buffer for each message, for example the table or tenant a
+    message is written to. Each buffer is flushed on its own ``batch_size``,
+    ``max_batch_bytes`` and ``timeout`` triggers, and :meth:`handle_batch` is
+    called with the key and the messages of a single key.
+
+    At most ``max_buffered`` messages are buffered across all keys; beyond
+    that the oldest buffer is flushed early. When the concurrent batches are
+    bounded, the RDY count is limited to ``max_buffered`` plus the batches
+    flushing and waiting.
+
+    Example usage::
+
+        >>> def table(message):
+        ...     return json.loads(message.body)['table']
+        >>> def insert(table, messages):
+        ...     db.insert_many(table, [m.body for m in messages])
+        >>> handler = KeyedBatchHandler(table, 500, insert, max_buffered=5000)
+        >>> consumer = Consumer('rows', 'writer', max_in_flight=8000,
+        ...                     message_handler=handler)
+
+    :param partition_key: callable returning the key of a message
+
+    :param max_buffered: the maximum number of messages buffered across keys
+        (default: ``4 * batch_size``)
+
+    Other arguments are passed to :class:`BatchHandler`.
+    """
+
+    def __init__(self, partition_key, batch_size, handle_batch=None,
+                 max_buffered=None, **kwargs):
+        super(KeyedBatchHandler, self).__init__(
+            batch_size, handle_batch, **kwargs)
+        self.partition_key = partition_key
+        self.max_buffered = max_buffered or 4 * batch_size
+
+    def key(self, message):
+        return self.partition_key(message)
+
+    def _handle_batch(self, key, batch):
+        self.handle_batch(key, batch)
+
+    def handle_batch(self, key, messages):
+        """Handle the batch of messages for ``key``.
+
+        You must provide a :meth:`handle_batch` function to the constructor or
+        override this method.
+        """
+        raise RuntimeError('handle_batch must be overridden')
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""A file backed store for given up messages.
+
+Records are appended to memory mapped segment files, each with an index of
+record offsets, and can be replayed into a topic with :func:`replay` or::
+
+    python -m gnsq.contrib.deadletter PATH TOPIC --nsqd-tcp-address HOST:PORT
+"""
+from __future__ import absolute_import, division
+
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from collections import namedtuple
+
+import gevent
+
+#: Record header: magic, body length, crc32, timestamp, attempts and id.
+_HEADER = struct.Struct('>BIIqH16s')
+_META = struct.Struct('>qH16s')
+_OFFSET = struct.Struct('>Q')
+_MAGIC = 0xd1
+
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+
+logger = logging.getLogger(__name__)
+
+DeadLetterRecord = namedtuple(
+    'DeadLetterRecord', ['id', 'timestamp', 'attempts', 'body'])
+
+
+def _checksum(meta, body):
+    return zlib.crc32(body, zlib.crc32(meta)) & 0xffffffff
+
+
+class Segment(object):
+    """A segment file open for appending.
+
+    The file is created at ``size`` bytes and memory mapped, so appending a
+    record is a copy into the page cache. It is truncated to the records
+    written when closed.
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.offset = 0
+        self.count = 0
+
+        self.file = open(path + SEGMENT_SUFFIX, 'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.index = open(path + INDEX_SUFFIX, 'wb')
+
+    def fits(self, size):
+        return self.offset + size <= self.size
+
+    def append(self, message):
+        body = message.body
+        meta = _META.pack(message.timestamp, message.attempts, message.id)
+
+        _HEADER.pack_into(
+            self.map, self.offset, _MAGIC, len(body),
+            _checksum(meta, body), message.timestamp, message.attempts,
+            message.id)
+
+        start = self.offset + _HEADER.size
+        self.map[start:start + len(body)] = body
+        self.index.write(_OFFSET.pack(self.offset))
+
+        self.offset = start + len(body)
+        self.count += 1
+
+    def flush(self):
+        # The records go to disk before the index entries pointing at them.
+        self.map.flush()
+        self.index.flush()
+        os.fsync(self.index.fileno())
+
+    def close(self):
+        self.flush()
+        self.map.close()
+        self.file.truncate(self.offset)
+        self.file.close()
+        self.index.close()
+
+
+def _index_count(path):
+    try:
+        return os.path.getsize(path + INDEX_SUFFIX) // _OFFSET.size
+    except OSError:
+        return 0
+
+
+def _index_offset(path, number):
+    with open(path + INDEX_SUFFIX, 'rb') as fp:
+        fp.seek(number * _OFFSET.size)
+        offset, = _OFFSET.unpack(fp.read(_OFFSET.size))
+    return offset
+
+
+def _check_index(path):
+    """Return the number of records in a segment and of usable index entries.
+
+    The index is written behind the records, so after a crash it may miss the
+    last records or, unless flushed, point past the records on disk. The
+    records after the last indexed one are counted by scanning them.
+    """
+    indexed = _index_count(path)
+
+    if indexed:
+        tail = sum(1 for _ in read_segment(
+            path, _index_offset(path, indexed - 1)))
+        if tail:
+            return indexed - 1 + tail, indexed
+
+    return sum(1 for _ in read_segment(path)), 0
+
+
+def read_segment(path, offset=0):
+    """Iterate over the records of a segment from ``offset``.
+
+    Stops at the end of the written records, so a segment left at its full
+    size by a crash is read up to the last complete record.
+    """
+    with open(path + SEGMENT_SUFFIX, 'rb') as fp:
+        if not os.fstat(fp.fileno()).st_size:
+            return
+
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for record in _read_records(data, offset):
+                yield record
+        finally:
+            data.close()
+
+
+def _read_records(data, offset):
+    end = len(data)
+
+    while offset + _HEADER.size <= end:
+        magic, size, crc, timestamp, attempts, message_id = \
+            _HEADER.unpack_from(data, offset)
+
+        start = offset + _HEADER.size
+        if magic != _MAGIC or start + size > end:
+            return
+
+        body = data[start:start + size]
+        if _checksum(_META.pack(timestamp, attempts, message_id), body) != crc:
+            logger.warning('corrupt dead letter record at offset %d', offset)
+            return
+
+        yield DeadLetterRecord(message_id, timestamp, attempts, body)
+        offset = start + size
+
+
+class DeadLetterStore(object):
+    """Store given up messages in rotating segment files.
+
+    Each message is written as a length prefixed binary record, with its id,
+    timestamp, attempts and a checksum, to a memory mapped segment file in
+    the ``path`` directory. A new segment is started once ``segment_size``
+    bytes are written. Next to each segment an index holds the offset of
+    every record, so records can be counted and read from any position
+    without scanning. Records missing from the index after a crash are
+    found by scanning from the last indexed record.
+
+    Writing a record copies it into the mapped file without a system call, so
+    the store keeps up with the consumer however many messages are given up.
+    Written records reach the disk when the operating system writes the pages
+    back, on :meth:`flush` and on :meth:`close`.
+
+    A store opened on an existing directory appends to a new segment. Use
+    :meth:`records` or :func:`replay` to read the records back.
+
+    Example usage::
+
+        >>> store = DeadLetterStore('/var/lib/app/topic.__BURY__')
+        >>> consumer.on_giving_up.connect(store, weak=False)
+        >>> consumer.on_close.connect(lambda consumer: store.close(),
+        ...                           weak=False)
+
+    :param path: the directory to write segments to
+
+    :param segment_size: the size in bytes of each segment file
+    """
+
+    def __init__(self, path, segment_size=64 * 1024 * 1024):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.path = path
+        self.segment_size = segment_size
+        self.segment = None
+
+    def segments(self):
+        """Return the paths of the segments, oldest first, without suffix."""
+        names = sorted(
+            name[:-len(SEGMENT_SUFFIX)] for name in os.listdir(self.path)
+            if name.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.path, name) for name in names]
+
+    def _next_segment_path(self):
+        segments = self.segments()
+        number = 0
+        if segments:
+            number = int(os.path.basename(segments[-1])) + 1
+        return os.path.join(self.path, '%020d' % number)
+
+    def __call__(self, consumer, message):
+        self.append(message)
+
+    def append(self, message):
+        """Write a message, or anything with the same attributes."""
+        size = _HEADER.size + len(message.body)
+
+        if self.segment is None or not self.segment.fits(size):
+            self._rotate(size)
+
+        self.segment.append(message)
+
+    def _rotate(self, size):
+        if self.segment is not None:
+            self.segment.close()
+
+        self.segment = Segment(
+            self._next_segment_path(), max(self.segment_size, size))
+
+    def flush(self):
+        """Write the open segment and its index to disk."""
+        if self.segment is not None:
+            self.segment.flush()
+
+    def close(self):
+        """Close the open segment. Later messages start a new segment."""
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def _flush_index(self):
+        # Reads share the page cache with the mapped segment, only the index
+        # is buffered.
+        if self.segment is not None:
+            self.segment.index.flush()
+
+    def __len__(self):
+        self._flush_index()
+        return sum(_check_index(path)[0] for path in self.segments())
+
+    def records(self, start=0):
+        """Iterate over the stored records, skipping the first ``start``."""
+        self._flush_index()
+
+        for path in self.segments():
+            count, indexed = _check_index(path)
+            if start >= count:
+                start -= count
+                continue
+
+            # Seek to the record, or to the last indexed one before it.
+            number = min(start, max(indexed - 1, 0))
+            offset = _index_offset(path, number) if number else 0
+            skip, start = start - number, 0
+
+            for record in read_segment(path, offset):
+                if skip:
+                    skip -= 1
+                    continue
+                yield record
+
+
+def replay(records, topic, rate=None, batch_size=100, sleep=gevent.sleep):
+    """Publish the bodies of ``records`` to ``topic``.
+
+    Bodies are sent with ``MPUB`` in batches of ``batch_size``, at no more
+    than ``rate`` messages per second if given. ``topic`` is a
+    :class:`~gnsq.topic.Topic` handle, for example from
+    :meth:`Producer.topic <gnsq.Producer.topic>`.
+
+    Returns the number of messages published.
+
+    Example usage::
+
+        >>> producer = Producer('localhost:4150')
+        >>> producer.start()
+        >>> replay(store.records(), producer.topic('topic'), rate=5000)
+    """
+    started = time.time()
+    sent = 0
+    batch = []
+
+    def publish():
+        topic.multipublish(batch)
+        del batch[:]
+
+    for record in records:
+        batch.append(record.body)
+        if len(batch) < batch_size:
+            continue
+
+        publish()
+        sent += batch_size
+
+        if rate:
+            delay = started + sent / rate - time.time()
+            if delay > 0:
+                sleep(delay)
+
+    if batch:
+        sent += len(batch)
+        publish()
+
+    return sent
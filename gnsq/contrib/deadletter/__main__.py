@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""Replay the messages of a dead-letter store into a topic."""
+from __future__ import absolute_import, print_function
+
+import argparse
+
+from gnsq import Producer
+
+from . import DeadLetterStore, replay
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m gnsq.contrib.deadletter')
+    parser.add_argument('path', help='the dead-letter store directory')
+    parser.add_argument('topic', help='the topic to publish to')
+    parser.add_argument('--nsqd-tcp-address', action='append', required=True,
+                        help='nsqd to publish to, may be given more than once')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='maximum messages published per second')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--start', type=int, default=0,
+                        help='number of records to skip')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    store = DeadLetterStore(args.path)
+
+    producer = Producer(args.nsqd_tcp_address)
+    producer.start()
+
+    try:
+        sent = replay(
+            store.records(args.start), producer.topic(args.topic),
+            rate=args.rate, batch_size=args.batch_size)
+    finally:
+        producer.close()
+        producer.join()
+
+    print('replayed {} messages to {}'.format(sent, args.topic))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,36 @@
 # -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import base64
 import itertools
 import json
+import logging
 import sys
+import time
+
+from collections import deque
+
+import gevent
+import gevent.event
+import gevent.lock
 
 import gnsq
+from gnsq.metrics import Counter
+
+
+def _encode_body(body):
+    """Return json fields for a message body.
+
+    Bodies that are valid utf-8 are kept as text, others are base64 encoded
+    with ``'encoding': 'base64'``.
+    """
+    try:
+        return {'body': body.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {
+            'body': base64.b64encode(body).decode('ascii'),
+            'encoding': 'base64',
+        }
 
 
 class LogGiveupHandler(object):
@@ -34,7 +61,8 @@ class JSONLogGiveupHandler(LogGiveupHandler):
     """Log messages as json on giveup.
 
     Works like :class:`LogGiveupHandler` but serializes the message details as
-    json before writing to the log.
+    json before writing to the log. Message bodies that are not utf-8 are
+    base64 encoded.
 
     Example usage::
 
@@ -43,12 +71,13 @@ class JSONLogGiveupHandler(LogGiveupHandler):
         ...     JSONLogGiveupHandler(fp.write), weak=False)
     """
     def format_message(self, message):
-        return json.dumps({
+        data = {
             'timestamp': message.timestamp,
             'attempts': message.attempts,
-            'id': message.id,
-            'body': message.body,
-        })
+            'id': message.id.decode('ascii'),
+        }
+        data.update(_encode_body(message.body))
+        return json.dumps(data)
 
 
 class NsqdGiveupHandler(object):
@@ -59,6 +88,10 @@ class NsqdGiveupHandler(object):
     :meth:`format_message`. Messages can be requeued with the `nsq_to_nsq`
     utility.
 
+    Each message is published as it is given up, blocking the connection.
+    Prefer :class:`DeadLetterForwarder` when many messages may be given up at
+    once.
+
     Example usage::
 
         >>> giveup_handler = NsqdGiveupHandler('topic.__BURY__')
@@ -78,3 +111,261 @@ class NsqdGiveupHandler(object):
     def __call__(self, consumer, message):
         nsq = next(self.nsqds)
         nsq.publish(self.topic, self.format_message(message))
+
+
+class DeadLetterForwarder(object):
+    """Forward given up messages to nsq in batches.
+
+    Unlike :class:`NsqdGiveupHandler`, messages are not published from the
+    connection's greenlet. They are buffered and published with ``MPUB`` by a
+    background greenlet, once ``batch_size`` messages are buffered or every
+    ``flush_interval`` seconds. ``publisher`` is a :class:`~gnsq.Producer` or
+    a :class:`~gnsq.NsqdHTTPClient`, or a list of them used in turn.
+
+    Each message is wrapped in a json envelope (see :meth:`envelope`) with the
+    original topic, channel, attempts and timestamps, so it can be inspected
+    and replayed. Message bodies that are not utf-8 are base64 encoded.
+
+    At most ``max_buffered`` messages are buffered. When the buffer is full,
+    ``overflow`` picks what happens to a new message:
+
+    * ``'drop_oldest'``: drop the oldest buffered message
+    * ``'drop_newest'``: drop the new message
+    * ``'block'``: wait for room, blocking the connection
+
+    Batches that fail to publish are put back in the buffer and retried after
+    ``flush_interval``. After ``max_retries`` failures in a row the batch is
+    dropped, so a batch nsqd rejects does not hold up the messages behind it.
+    Dropped messages are counted in :attr:`dropped` and logged. The buffer is
+    flushed when a consumer closes and on :meth:`close`.
+
+    Example usage::
+
+        >>> producer = Producer('localhost:4150')
+        >>> producer.start()
+        >>> forwarder = DeadLetterForwarder('topic.__BURY__', producer)
+        >>> consumer.on_giving_up.connect(forwarder, weak=False)
+
+    :param topic: the topic to forward messages to
+
+    :param publisher: a client or list of clients to publish with
+
+    :param batch_size: the maximum number of messages per ``MPUB``
+
+    :param flush_interval: the maximum time in seconds a message is buffered
+
+    :param max_buffered: the maximum number of messages buffered
+
+    :param overflow: ``'drop_oldest'``, ``'drop_newest'`` or ``'block'``
+
+    :param envelope: wrap messages in a json envelope. If ``False`` the
+        message body is forwarded as is
+
+    :param max_retries: the number of times a failed batch is retried before
+        it is dropped, or ``None`` to retry forever
+
+    :param registry: a :class:`~gnsq.metrics.MetricsRegistry` to register the
+        counters with, labelled with ``labels``
+    """
+    OVERFLOW_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+    def __init__(self, topic, publisher, batch_size=100, flush_interval=1.0,
+                 max_buffered=10000, overflow='drop_oldest', envelope=True,
+                 max_retries=5, registry=None, labels=None):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError('invalid overflow policy %r' % (overflow,))
+
+        if not isinstance(publisher, (list, tuple)):
+            publisher = [publisher]
+
+        if not publisher:
+            raise ValueError('at least one publisher is required')
+
+        self.logger = logging.getLogger(__name__)
+        self.topic = topic
+        self.topics = itertools.cycle([
+            (p.topic(topic), self._publish_kwargs(p)) for p in publisher])
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.overflow = overflow
+        self.use_envelope = envelope
+        self.max_retries = max_retries
+        self.consumers = set()
+        self._failures = 0
+
+        self._create_metrics(registry, labels or {})
+
+        self.buffer = deque()
+        self._full = gevent.event.Event()
+        self._room = gevent.event.Event()
+        self._room.set()
+        self._lock = gevent.lock.RLock()
+        self.worker = gevent.spawn(self._run)
+
+    def _create_metrics(self, registry, labels):
+        if registry is None:
+            self.forwarded = Counter()
+            self.dropped = Counter()
+            return
+
+        self.forwarded = registry.counter(
+            'giveup_forwarded_total', 'Given up messages forwarded.',
+        ).labels(**labels)
+        self.dropped = registry.counter(
+            'giveup_dropped_total', 'Given up messages dropped.',
+        ).labels(**labels)
+
+        buffered = registry.gauge(
+            'giveup_buffered', 'Given up messages waiting to be forwarded.',
+        ).labels(**labels)
+        registry.add_collector(lambda: buffered.set(len(self.buffer)))
+
+    def __call__(self, consumer, message):
+        if consumer not in self.consumers:
+            self.consumers.add(consumer)
+            consumer.on_close.connect(self._on_close, weak=False)
+
+        self.put(self.format_message(consumer, message))
+
+    def put(self, data):
+        """Buffer a formatted message for forwarding."""
+        while self.overflow == 'block' and self.is_full:
+            self._room.clear()
+            self._room.wait()
+
+        if self.is_full:
+            if self.overflow == 'drop_newest':
+                self._drop(1)
+                return
+
+            else:
+                self.buffer.popleft()
+                self._drop(1)
+
+        self.buffer.append(data)
+        if len(self.buffer) >= self.batch_size:
+            self._full.set()
+
+    @property
+    def is_full(self):
+        return len(self.buffer) >= self.max_buffered
+
+    def _drop(self, count):
+        self.dropped.inc(count)
+        self.logger.warning(
+            'dead letter buffer full, dropped %d message(s)', count)
+
+    def envelope(self, consumer, message):
+        """Return the dict forwarded as json for ``message``."""
+        envelope = {
+            'topic': consumer.topic,
+            'channel': consumer.channel,
+            'id': message.id.decode('ascii'),
+            'attempts': message.attempts,
+            'timestamp': message.timestamp,
+            'gave_up_at': time.time(),
+        }
+        envelope.update(_encode_body(message.body))
+        return envelope
+
+    def format_message(self, consumer, message):
+        if not self.use_envelope:
+            return message.body
+        data = json.dumps(self.envelope(consumer, message), sort_keys=True)
+        return data.encode('utf-8')
+
+    def _run(self):
+        while True:
+            # Partial batches wait for the interval.
+            full = self._full.wait(self.flush_interval)
+            try:
+                self._flush(self.batch_size if full else 1)
+            except Exception:
+                self.logger.exception('error forwarding dead letters')
+                gevent.sleep(self.flush_interval)
+
+    @staticmethod
+    def _publish_kwargs(publisher):
+        # Newline delimited http bodies cannot hold arbitrary messages.
+        if isinstance(publisher, gnsq.NsqdHTTPClient):
+            return {'binary': True}
+        return {}
+
+    def _publish(self, batch):
+        topic, kwargs = next(self.topics)
+        try:
+            topic.multipublish(batch, **kwargs)
+
+        except Exception:
+            self._failures += 1
+            if self.max_retries is None or self._failures <= self.max_retries:
+                self._restore(batch)
+                raise
+
+            self._failures = 0
+            self.dropped.inc(len(batch))
+            self.logger.error(
+                'dropped %d dead letter(s) after %d failed publishes',
+                len(batch), self.max_retries + 1)
+            raise
+
+        except BaseException:
+            # Also when the worker is killed mid publish.
+            self._restore(batch)
+            raise
+
+        self._failures = 0
+        self.forwarded.inc(len(batch))
+
+    def _restore(self, batch):
+        self.buffer.extendleft(reversed(batch))
+
+        overflow = len(self.buffer) - self.max_buffered
+        if overflow <= 0:
+            return
+
+        for _ in range(overflow):
+            if self.overflow == 'drop_oldest':
+                self.buffer.popleft()
+            else:
+                self.buffer.pop()
+
+        self._drop(overflow)
+
+    def flush(self):
+        """Publish every buffered message.
+
+        Raises the publish error if a batch fails. The batch is put back in
+        the buffer.
+        """
+        self._flush(1)
+
+    def _flush(self, min_size):
+        with self._lock:
+            while len(self.buffer) >= min_size:
+                count = min(len(self.buffer), self.batch_size)
+                batch = [self.buffer.popleft() for _ in range(count)]
+                self._room.set()
+
+                if len(self.buffer) < self.batch_size:
+                    self._full.clear()
+
+                self._publish(batch)
+
+    def _on_close(self, consumer):
+        try:
+            self.flush()
+        except Exception:
+            self.logger.exception('error forwarding dead letters')
+
+    def kill(self):
+        """Stop the worker. Buffered messages are not flushed."""
+        self.worker.kill()
+
+    def close(self):
+        """Stop the worker and flush the buffer."""
+        # The lock keeps the worker from being killed during a publish.
+        with self._lock:
+            self.kill()
+            self.flush()
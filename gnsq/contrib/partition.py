@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+import zlib
+
+import gevent
+import gevent.queue
+import six
+
+from gnsq.errors import NSQException, NSQRequeueMessage
+
+
+def partition_hash(key):
+    """Stable hash of a partition key.
+
+    Text and bytes keys are hashed with crc32, so a key maps to the same lane
+    in every process. Other keys use :func:`hash`.
+    """
+    if isinstance(key, six.text_type):
+        key = key.encode('utf-8')
+
+    if isinstance(key, bytes):
+        return zlib.crc32(key) & 0xffffffff
+
+    return hash(key)
+
+
+class Lane(object):
+    """A serial worker for the messages of one partition."""
+
+    def __init__(self, handler, index):
+        self.handler = handler
+        self.index = index
+        self.queue = gevent.queue.Queue()
+        self.depth = 0
+        self.worker = gevent.spawn(self._run)
+
+    def put(self, consumer, message):
+        self.depth += 1
+        self.queue.put((consumer, message))
+
+    def _run(self):
+        for consumer, message in self.queue:
+            try:
+                self.handler._handle(consumer, message)
+            finally:
+                self.depth -= 1
+                self.handler._lane_done(consumer, self)
+
+
+class PartitionedHandler(object):
+    """Ordered processing per key with parallelism across keys.
+
+    ``partition_key(message)`` extracts a key from each message, and the key
+    is hashed onto one of ``lanes`` serial workers. Messages with the same key
+    are handled one at a time in the order they were received, while
+    different lanes run concurrently.
+
+    Each lane is allowed ``lane_budget`` messages in flight. Beyond that a
+    lane keeps the messages it already holds without using up the budget of
+    the other lanes, up to ``max_lane_depth``. The combined budget is applied
+    to the consumer's RDY count (see
+    :meth:`Consumer.add_ready_limit <gnsq.Consumer.add_ready_limit>`), so a hot
+    key slows down delivery instead of blocking the other lanes. The
+    consumer's ``max_in_flight`` remains the overall cap.
+
+    Messages are finished when the handler returns, unless it responded
+    itself, and requeued if it raises. As with nsq generally, a requeued or
+    timed out message is redelivered out of order.
+
+    Example usage::
+
+        >>> def account_id(message):
+        ...     return json.loads(message.body)['account_id']
+        >>> handler = PartitionedHandler(account_id, handle_event, lanes=16)
+        >>> consumer = Consumer('events', 'worker', max_in_flight=256,
+        ...                     message_handler=handler)
+
+    :param partition_key: callable returning the key of a message
+
+    :param handle_message: callable taking the consumer and the message
+
+    :param lanes: the number of serial workers
+
+    :param lane_budget: messages in flight per lane before it applies
+        backpressure
+
+    :param max_lane_depth: the most messages a single lane holds before the
+        consumer stops receiving messages altogether (default: ``16 *
+        lane_budget``)
+    """
+
+    def __init__(self, partition_key, handle_message=None, lanes=8,
+                 lane_budget=2, max_lane_depth=None):
+        self.logger = logging.getLogger(__name__)
+        self.partition_key = partition_key
+        self.lane_budget = lane_budget
+        self.max_lane_depth = max_lane_depth or 16 * lane_budget
+        self.consumers = set()
+
+        if handle_message is not None:
+            self.handle_message = handle_message
+
+        self.lanes = [Lane(self, index) for index in range(lanes)]
+
+    def __call__(self, consumer, message):
+        if consumer not in self.consumers:
+            self.consumers.add(consumer)
+            consumer.add_ready_limit(self.ready_limit)
+
+        message.enable_async()
+        lane = self.lane(self.partition_key(message))
+        lane.put(consumer, message)
+
+        # A lane past its budget widens the limit by the messages it holds, so
+        # the other lanes keep theirs.
+        if lane.depth > self.lane_budget:
+            consumer.redistribute_ready_state()
+
+    def lane(self, key):
+        """The :class:`Lane` a key is handled on."""
+        return self.lanes[partition_hash(key) % len(self.lanes)]
+
+    def ready_limit(self):
+        """The number of messages the lanes allow in flight."""
+        return sum(self._allowance(lane) for lane in self.lanes)
+
+    def _allowance(self, lane):
+        if lane.depth < self.lane_budget:
+            return self.lane_budget
+        return min(lane.depth, self.max_lane_depth)
+
+    def handle_message(self, consumer, message):
+        """Handle a single message.
+
+        Override this method or provide ``handle_message`` to the handler.
+        """
+        raise RuntimeError('handle_message must be overridden')
+
+    def _handle(self, consumer, message):
+        try:
+            self.handle_message(consumer, message)
+
+        except NSQRequeueMessage as error:
+            return self._requeue(consumer, message, error.backoff)
+
+        except Exception:
+            self.logger.exception('caught exception while handling message')
+            return self._requeue(consumer, message, True)
+
+        if message.has_responded():
+            return
+
+        try:
+            message.finish()
+        except NSQException as error:
+            self.logger.warning('error finishing message (%r)', error)
+
+    def _requeue(self, consumer, message, backoff):
+        if message.has_responded():
+            return
+
+        if backoff is None:
+            backoff = consumer.backoff_on_requeue
+
+        try:
+            message.requeue(consumer.requeue_delay, backoff)
+        except NSQException as error:
+            self.logger.warning('error requeueing message (%r)', error)
+
+    def _lane_done(self, consumer, lane):
+        if lane.depth >= self.lane_budget:
+            consumer.redistribute_ready_state()
+
+    def kill(self):
+        """Stop the lane workers."""
+        gevent.killall([lane.worker for lane in self.lanes])
@@ -1,13 +1,25 @@
 # -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import time
+
+from collections import deque
+
 import gevent.queue
 
+from gnsq.metrics import Histogram
+
+#: Queue time histogram buckets, in seconds.
+QUEUE_BUCKETS = (
+    0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+
 
 class QueueHandler(gevent.queue.Queue):
     """Iterator like api for gnsq.
 
     Example usage::
 
-        >>> queue = QueueHandler()
+        >>> queue = QueueHandler(high_watermark=64)
         >>> consumer = Consumer('topic', 'worker', max_in_flight=16)
         >>> consumer.on_message.connect(queue)
         >>> consumer.start(block=False)
@@ -19,14 +31,105 @@ class QueueHandler(gevent.queue.Queue):
 
         >>> gevent.pool.Pool().map(queue, my_handler)
 
+    With a ``high_watermark``, the consumers feeding the queue are paused with
+    RDY 0 once it holds that many messages, and resumed when it drains to
+    ``low_watermark``. Connections stay open and keep answering heartbeats
+    while paused. Prefer this to ``maxsize``, which blocks the connection
+    until there is room.
+
+    The time messages spend queued is kept in the :attr:`queue_seconds`
+    histogram, registered with ``registry`` when given.
+
     :param maxsize: maximum number of messages that can be queued. If less than
         or equal to zero or None, the queue size is infinite.
+
+    :param high_watermark: pause the consumers at this many queued messages
+
+    :param low_watermark: resume the consumers at this many queued messages
+        (default: half the ``high_watermark``)
+
+    :param registry: a :class:`~gnsq.metrics.MetricsRegistry` to register the
+        metrics with, labelled with ``labels``
     """
 
+    def __init__(self, maxsize=None, high_watermark=None, low_watermark=None,
+                 registry=None, labels=None):
+        super(QueueHandler, self).__init__(maxsize)
+        self.high_watermark = high_watermark
+
+        if low_watermark is None and high_watermark is not None:
+            low_watermark = high_watermark // 2
+
+        self.low_watermark = low_watermark
+        self.paused = False
+        self.consumers = set()
+        self._queued_at = deque()
+
+        if registry is None:
+            self.queue_seconds = Histogram(QUEUE_BUCKETS)
+        else:
+            self._register_metrics(registry, labels or {})
+
+    def _register_metrics(self, registry, labels):
+        self.queue_seconds = registry.histogram(
+            'queue_wait_seconds', 'Time messages spend queued.',
+            QUEUE_BUCKETS,
+        ).labels(**labels)
+
+        depth = registry.gauge(
+            'queue_depth', 'Queued messages.').labels(**labels)
+        paused = registry.gauge(
+            'queue_paused', 'Whether the queue has paused its consumers.',
+        ).labels(**labels)
+
+        def collect():
+            depth.set(self.qsize())
+            paused.set(int(self.paused))
+
+        registry.add_collector(collect)
+
     def __call__(self, consumer, message):
+        if consumer not in self.consumers:
+            self.consumers.add(consumer)
+            consumer.add_ready_limit(self.ready_limit)
+
         message.enable_async()
         self.put(message)
 
+    def ready_limit(self):
+        """``0`` while paused, otherwise no limit."""
+        return 0 if self.paused else None
+
+    def put(self, item, *args, **kwargs):
+        self._queued_at.append(time.time())
+        try:
+            super(QueueHandler, self).put(item, *args, **kwargs)
+        except gevent.queue.Full:
+            self._queued_at.pop()
+            raise
+
+        if self.high_watermark is None or self.paused:
+            return
+
+        if self.qsize() >= self.high_watermark:
+            self._set_paused(True)
+
+    def get(self, *args, **kwargs):
+        item = super(QueueHandler, self).get(*args, **kwargs)
+
+        if self._queued_at:
+            self.queue_seconds.observe(time.time() - self._queued_at.popleft())
+
+        if self.paused and self.qsize() <= self.low_watermark:
+            self._set_paused(False)
+
+        return item
+
+    def _set_paused(self, paused):
+        self.paused = paused
+        for consumer in self.consumers:
+            consumer.redistribute_ready_state()
+
 
 class ChannelHandler(gevent.queue.Channel):
     """Iterator like api for gnsq.
@@ -1,9 +1,24 @@
 # -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+import random
+import sys
+import time
+
+import gevent
+import gevent.queue
+
+from gnsq.metrics import Counter
 
 
 class SentryExceptionHandler(object):
     """Log gnsq exceptions to sentry.
 
+    Each exception is reported from the handler, before the message is
+    requeued. See :class:`AggregatingSentryExceptionHandler` to report from a
+    background greenlet.
+
     Example usage::
 
         >>> from raven import Sentry
@@ -30,3 +45,196 @@ class SentryExceptionHandler(object):
             extra['message'] = self.message_extra(message)
 
         self.client.captureException(extra=extra)
+
+
+class _Window(object):
+    __slots__ = ('started', 'count', 'suppressed')
+
+    def __init__(self, started):
+        self.started = started
+        self.count = 0
+        self.suppressed = 0
+
+
+class AggregatingSentryExceptionHandler(SentryExceptionHandler):
+    """Report gnsq exceptions to sentry from a background greenlet.
+
+    Exceptions are grouped by :meth:`fingerprint`, the exception type and the
+    line it was raised from. Within each ``window`` of seconds the first
+    ``reports_per_window`` exceptions of a group are reported, and further
+    ones only with a chance of ``sample_rate``. When the window ends the
+    number of exceptions not reported is sent as a single message.
+
+    Reports are queued and sent by a background greenlet, so a failing
+    handler does not wait on sentry before its message is requeued. At most
+    ``max_queued`` reports wait; beyond that exceptions are counted as
+    suppressed.
+
+    Reported and suppressed exceptions are counted in :attr:`reported` and
+    :attr:`suppressed`, registered with ``registry`` when given.
+
+    Example usage::
+
+        >>> from raven import Client
+        >>> handler = AggregatingSentryExceptionHandler(Client(), window=60)
+        >>> consumer.on_exception.connect(handler, weak=False)
+
+    :param client: a sentry client with ``captureException`` and
+        ``captureMessage``
+
+    :param window: the aggregation window in seconds
+
+    :param reports_per_window: the number of exceptions reported per group
+        and window
+
+    :param sample_rate: the chance an exception past ``reports_per_window``
+        is reported anyway
+
+    :param max_queued: the maximum number of reports waiting to be sent
+
+    :param registry: a :class:`~gnsq.metrics.MetricsRegistry` to register the
+        counters with, labelled with ``labels``
+    """
+
+    def __init__(self, client, window=60, reports_per_window=1, sample_rate=0,
+                 max_queued=100, registry=None, labels=None,
+                 clock=time.time):
+        super(AggregatingSentryExceptionHandler, self).__init__(client)
+        self.logger = logging.getLogger(__name__)
+        self.window = window
+        self.reports_per_window = reports_per_window
+        self.sample_rate = sample_rate
+        self.clock = clock
+
+        self._create_metrics(registry, labels or {})
+
+        self.windows = {}
+        self._closed = []
+        self._next_sweep = clock() + window
+        self.reports = gevent.queue.Queue(max_queued)
+        self.worker = gevent.spawn(self._run)
+
+    def _create_metrics(self, registry, labels):
+        if registry is None:
+            self.reported = Counter()
+            self.suppressed = Counter()
+            return
+
+        self.reported = registry.counter(
+            'sentry_reported_total', 'Exceptions reported to sentry.',
+        ).labels(**labels)
+        self.suppressed = registry.counter(
+            'sentry_suppressed_total', 'Exceptions not reported to sentry.',
+        ).labels(**labels)
+
+    def fingerprint(self, exc_info):
+        """Return the group of an exception.
+
+        Override this to group exceptions differently.
+        """
+        exc_type, _, tb = exc_info
+        name = '%s.%s' % (exc_type.__module__, exc_type.__name__)
+
+        if tb is None:
+            return name
+
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+
+        code = tb.tb_frame.f_code
+        return '%s:%s:%d' % (name, code.co_filename, tb.tb_lineno)
+
+    def __call__(self, consumer, message, error):
+        exc_info = sys.exc_info()
+        if exc_info[1] is not error:
+            traceback = getattr(error, '__traceback__', None)
+            exc_info = (type(error), error, traceback)
+
+        fingerprint = self.fingerprint(exc_info)
+        window = self._get_window(fingerprint)
+        window.count += 1
+
+        if not self._should_report(window):
+            window.suppressed += 1
+            self.suppressed.inc()
+            return
+
+        extra = {}
+        if message:
+            extra['message'] = self.message_extra(message)
+
+        try:
+            self.reports.put_nowait((exc_info, extra))
+        except gevent.queue.Full:
+            window.suppressed += 1
+            self.suppressed.inc()
+
+    def _get_window(self, fingerprint):
+        now = self.clock()
+        window = self.windows.get(fingerprint)
+
+        if window is not None and now - window.started >= self.window:
+            self._close_window(fingerprint, window)
+            window = None
+
+        if window is None:
+            window = self.windows[fingerprint] = _Window(now)
+
+        return window
+
+    def _should_report(self, window):
+        if window.count <= self.reports_per_window:
+            return True
+        return random.random() < self.sample_rate
+
+    def _close_window(self, fingerprint, window):
+        del self.windows[fingerprint]
+        if window.suppressed:
+            self._closed.append((fingerprint, window))
+
+    def _run(self):
+        while True:
+            try:
+                exc_info, extra = self.reports.get(
+                    timeout=max(self._next_sweep - self.clock(), 0))
+            except gevent.queue.Empty:
+                pass
+            else:
+                self._send(self.client.captureException,
+                           exc_info=exc_info, extra=extra)
+                self.reported.inc()
+
+            if self.clock() >= self._next_sweep:
+                self.sweep()
+
+    def sweep(self):
+        """Close the windows that ended and report their suppressed counts."""
+        now = self.clock()
+        self._next_sweep = now + self.window
+
+        for fingerprint, window in list(self.windows.items()):
+            if now - window.started >= self.window:
+                self._close_window(fingerprint, window)
+
+        closed, self._closed = self._closed, []
+        for fingerprint, window in closed:
+            self._send(
+                self.client.captureMessage,
+                'suppressed %d of %d exceptions' % (
+                    window.suppressed, window.count),
+                extra={
+                    'fingerprint': fingerprint,
+                    'suppressed': window.suppressed,
+                    'count': window.count,
+                    'window': self.window,
+                })
+
+    def _send(self, capture, *args, **kwargs):
+        try:
+            capture(*args, **kwargs)
+        except Exception:
+            self.logger.exception('error reporting to sentry')
+
+    def kill(self):
+        """Stop the worker. Queued reports are not sent."""
+        self.worker.kill()
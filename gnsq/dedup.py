@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division
+
+import hashlib
+import math
+import struct
+import time
+
+from collections import OrderedDict
+
+from .metrics import Counter
+
+_HASH = struct.Struct('>QQ')
+
+
+class LRUCache(object):
+    """Remembers the ``maxsize`` most recently seen keys exactly.
+
+    Memory grows with ``maxsize`` at roughly 100 bytes per message id, so it
+    suits up to a few hundred thousand ids. Use :class:`RotatingBloomFilter`
+    for more.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+
+    def __contains__(self, key):
+        try:
+            self._keys[key] = self._keys.pop(key)
+        except KeyError:
+            return False
+        return True
+
+    def add(self, key):
+        self._keys.pop(key, None)
+        self._keys[key] = None
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class BloomFilter(object):
+    """A fixed size set of keys with false positives but no false negatives.
+
+    Sized for ``capacity`` keys at a false positive rate of ``error_rate``.
+    """
+
+    def __init__(self, capacity, error_rate):
+        bits = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.size = max(int(math.ceil(bits)), 8)
+        self.hashes = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _indexes(self, key):
+        h1, h2 = _HASH.unpack_from(hashlib.sha1(key).digest())
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def __contains__(self, key):
+        bits = self.bits
+        for index in self._indexes(key):
+            if not bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        bits = self.bits
+        for index in self._indexes(key):
+            bits[index >> 3] |= 1 << (index & 7)
+        self.count += 1
+
+
+class RotatingBloomFilter(object):
+    """Remembers recent keys in a fixed amount of memory.
+
+    Keys are added to the newest of ``generations`` Bloom filters, each sized
+    for ``capacity`` keys. When the newest is full, or ``ttl`` seconds have
+    passed, the oldest is dropped and a new one started, so a key is
+    remembered for at least ``(generations - 1) * capacity`` further keys or
+    ``ttl`` seconds, whichever comes first.
+
+    Memory is fixed at :attr:`nbytes`, about 3.6 bytes per key of capacity per
+    generation at the default ``error_rate``. A false positive makes a new key
+    look like a duplicate; the chance is about ``generations * error_rate``
+    per lookup.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=1e-6, ttl=None,
+                 generations=2, clock=time.time):
+        if generations < 2:
+            raise ValueError('generations must be at least 2')
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.ttl = ttl
+        self.clock = clock
+
+        if ttl is None:
+            self.period = None
+        else:
+            self.period = ttl / (generations - 1)
+
+        self.filters = [
+            BloomFilter(capacity, error_rate) for _ in range(generations)]
+        self.rotated_at = clock()
+
+    @property
+    def nbytes(self):
+        return sum(len(f.bits) for f in self.filters)
+
+    def _rotate(self):
+        self.filters.pop()
+        self.filters.insert(0, BloomFilter(self.capacity, self.error_rate))
+        self.rotated_at = self.clock()
+
+    def _check_rotate(self):
+        if self.period is None:
+            return
+
+        elapsed = self.clock() - self.rotated_at
+        for _ in range(min(int(elapsed // self.period), len(self.filters))):
+            self._rotate()
+
+    def __contains__(self, key):
+        self._check_rotate()
+        return any(key in f for f in self.filters)
+
+    def add(self, key):
+        self._check_rotate()
+        if self.filters[0].count >= self.capacity:
+            self._rotate()
+        self.filters[0].add(key)
+
+
+class Deduplicator(object):
+    """Skips messages that were recently finished.
+
+    Finished messages are recorded in ``cache`` (an :class:`LRUCache` by
+    default) by id, or by a digest of their body if ``digest`` is set. Body
+    digests also catch duplicates published twice, but treat distinct
+    messages with the same body as duplicates.
+
+    Only finished messages are recorded, so a duplicate delivered while the
+    original is still being handled is handled again.
+
+    :param registry: a :class:`~gnsq.metrics.MetricsRegistry` to register the
+        hit and miss counters with, labelled with ``labels``
+    """
+
+    def __init__(self, cache=None, digest=False, registry=None, labels=None):
+        if cache is None:
+            cache = LRUCache()
+
+        self.cache = cache
+        self.digest = digest
+
+        if registry is None:
+            self.hits = Counter()
+            self.misses = Counter()
+        else:
+            labels = labels or {}
+            self.hits = registry.counter(
+                'consumer_dedup_hits_total',
+                'Duplicate messages finished without handling.',
+            ).labels(**labels)
+            self.misses = registry.counter(
+                'consumer_dedup_misses_total',
+                'Messages not found in the dedup cache.',
+            ).labels(**labels)
+
+    def key(self, message):
+        if self.digest:
+            return hashlib.sha1(message.body).digest()
+        return message.id
+
+    def is_duplicate(self, message):
+        """Check ``message`` and record it once it is finished."""
+        if self.key(message) in self.cache:
+            self.hits.inc()
+            return True
+
+        self.misses.inc()
+        message.on_finish.connect(self.finished, weak=False)
+        return False
+
+    def finished(self, message):
+        self.cache.add(self.key(message))
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division
+
+import time
+
+from .metrics import Histogram
+
+#: Lag histogram buckets, in seconds.
+LAG_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    60.0, 300.0, 900.0, 3600.0)
+
+RECEIVE = 'receive'
+FINISH = 'finish'
+
+
+class LagTracker(object):
+    """Delivery lag of the messages handled by a consumer.
+
+    Lag is measured from the nsqd message timestamp, to when the message is
+    received (``'receive'``) and to when it is finished (``'finish'``), so
+    client and nsqd clocks must roughly agree. Percentiles are estimated from
+    fixed buckets and reported as the bucket's upper bound.
+
+    :meth:`roll` starts a new window. :meth:`percentile` covers the last
+    complete window, or every message so far until the first window ends.
+
+    :param registry: a :class:`~gnsq.metrics.MetricsRegistry` to register the
+        histograms with, labelled with ``labels``
+    """
+
+    def __init__(self, registry=None, labels=None, buckets=LAG_BUCKETS):
+        self.histograms = {}
+        for kind in (RECEIVE, FINISH):
+            if registry is None:
+                histogram = Histogram(tuple(buckets))
+            else:
+                histogram = registry.histogram(
+                    'consumer_{}_lag_seconds'.format(kind),
+                    'Time from publish to message {}.'.format(kind), buckets,
+                ).labels(**(labels or {}))
+            self.histograms[kind] = histogram
+
+        self.receive = self.histograms[RECEIVE]
+        self.finish = self.histograms[FINISH]
+        self._snapshots = {}
+        self._windows = {}
+
+    def received(self, message):
+        """Record the receive lag and track when ``message`` is finished."""
+        self.receive.observe(time.time() - message.timestamp / 1e9)
+        message.on_finish.connect(self.finished, weak=False)
+
+    def finished(self, message):
+        self.finish.observe(time.time() - message.timestamp / 1e9)
+
+    def roll(self):
+        """End the current window."""
+        for kind, histogram in self.histograms.items():
+            counts = list(histogram.counts)
+            last = self._snapshots.get(kind) or [0] * len(counts)
+            self._windows[kind] = [new - old for new, old in zip(counts, last)]
+            self._snapshots[kind] = counts
+
+    def percentile(self, percent, kind=RECEIVE):
+        """The lag in seconds at ``percent`` (0 to 100), or ``None``."""
+        histogram = self.histograms[kind]
+        return histogram.percentile(percent, self._windows.get(kind))
+
+    def percentiles(self, percents=(50, 90, 99)):
+        """``{kind: {percent: lag}}`` for both kinds of lag."""
+        return {
+            kind: {p: self.percentile(p, kind) for p in percents}
+            for kind in self.histograms
+        }
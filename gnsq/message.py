@@ -1,10 +1,48 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import time
+
 import blinker
 from .decorators import cached_property
 from .errors import NSQException
 
 
+class Lease(object):
+    """The claim a connection holds on an in-flight message.
+
+    A lease expires when its connection closes (nsqd will redeliver the
+    message to another connection), when nsqd's ``msg_timeout`` passes without
+    a touch, or when it is abandoned. A connection is never reconnected, so
+    it identifies the connection generation the message was delivered on.
+
+    :param conn: the :class:`~gnsq.NsqdTCPClient` that received the message
+
+    :param timeout: seconds until nsqd times the message out
+    """
+    __slots__ = ('conn', 'timeout', 'deadline', 'abandoned')
+
+    def __init__(self, conn, timeout):
+        self.conn = conn
+        self.timeout = timeout
+        self.deadline = time.time() + timeout
+        self.abandoned = False
+
+    def renew(self):
+        """Restart the timeout, as nsqd does on ``TOUCH``."""
+        self.deadline = time.time() + self.timeout
+
+    def remaining(self):
+        """Seconds until the timeout, negative once passed."""
+        return self.deadline - time.time()
+
+    def is_expired(self):
+        return (
+            self.abandoned or
+            not self.conn.is_connected or
+            time.time() > self.deadline
+        )
+
+
 class Message(object):
     """A class representing a message received from nsqd."""
     def __init__(self, timestamp, attempts, id, body):
@@ -12,6 +50,7 @@ class Message(object):
         self.attempts = attempts
         self.id = id
         self.body = body
+        self.lease = None
         self._has_responded = False
         self._is_async = False
 
@@ -56,6 +95,15 @@ class Message(object):
         """Returns whether or not this message has been responded to."""
         return self._has_responded
 
+    def is_expired(self):
+        """Returns whether the message's :class:`Lease` has expired.
+
+        Once expired nsqd has or will redeliver the message, so any further
+        work on it is wasted and :meth:`finish`, :meth:`requeue` and
+        :meth:`touch` are not sent. Long running handlers may poll this.
+        """
+        return self.lease is not None and self.lease.is_expired()
+
     def finish(self):
         """
         Respond to nsqd that you’ve processed this message successfully
@@ -81,3 +129,22 @@ class Message(object):
         if self._has_responded:
             raise NSQException('already responded')
         self.on_touch.send(self)
+
+
+def finish_all(messages):
+    """Finish every message in ``messages`` not yet responded to."""
+    for message in messages:
+        if not message.has_responded():
+            message.finish()
+
+
+def requeue_all(messages, time_ms=0, backoff=True):
+    """Requeue every message in ``messages`` not yet responded to.
+
+    Only the first requeue backs off, so a failed batch counts as a single
+    failure.
+    """
+    for message in messages:
+        if not message.has_responded():
+            message.requeue(time_ms, backoff)
+            backoff = False
@@ -0,0 +1,463 @@
+# -*- coding: utf-8 -*-
+"""gnsq.metrics
+
+A small in-process metrics registry with Prometheus text and statsd
+exposition. Updates are plain attribute increments with no locking, so they
+are cheap enough for the per-message path; with the threading backend a
+concurrent update may occasionally be lost.
+"""
+from __future__ import absolute_import, division
+
+import re
+import socket
+
+from bisect import bisect_left
+from collections import OrderedDict
+
+from .backends import get_backend
+
+__all__ = [
+    'MetricsRegistry',
+    'StatsdExporter',
+    'ConsumerMetrics',
+]
+
+#: Default histogram buckets, in seconds.
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STATSD_PACKET_SIZE = 1432
+_INVALID_STATSD_CHARS = re.compile(r'[^a-zA-Z0-9_-]')
+
+
+def _format_float(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+class Counter(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Histogram(object):
+    """Counts observations into fixed buckets.
+
+    ``counts[i]`` is the number of observations less than or equal to
+    ``buckets[i]`` and greater than the previous bucket; the last count is the
+    ``+Inf`` bucket.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def percentile(self, percent, counts=None):
+        """Estimate a percentile (0 to 100) as the upper bound of its bucket.
+
+        Values in the ``+Inf`` bucket are reported as the largest bucket.
+        ``counts`` defaults to :attr:`counts` and may be the difference of
+        two snapshots.
+        """
+        if counts is None:
+            counts = self.counts
+
+        total = sum(counts)
+        if not total:
+            return None
+
+        rank = percent / 100 * total
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return self.buckets[-1]
+
+
+class MetricFamily(object):
+    """All the labelled instances of one metric."""
+
+    def __init__(self, name, help, type, factory):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.factory = factory
+        self.children = OrderedDict()
+
+    def labels(self, **labels):
+        """Return the metric for these label values, creating it once."""
+        key = tuple(sorted(labels.items()))
+        try:
+            return self.children[key]
+        except KeyError:
+            return self.children.setdefault(key, self.factory())
+
+    def remove(self, **labels):
+        self.children.pop(tuple(sorted(labels.items())), None)
+
+    def clear(self):
+        self.children.clear()
+
+
+class MetricsRegistry(object):
+    """A collection of counters, gauges and histograms.
+
+    Example::
+
+        registry = MetricsRegistry()
+        requests = registry.counter('requests_total', 'Requests handled.')
+        requests.labels(path='/').inc()
+        print(registry.to_prometheus())
+
+    :param prefix: prepended to every metric name (with an underscore)
+    """
+
+    def __init__(self, prefix='gnsq'):
+        self.prefix = prefix
+        self._families = OrderedDict()
+        self._collectors = []
+
+    def _family(self, name, help, type, factory):
+        if self.prefix:
+            name = '{}_{}'.format(self.prefix, name)
+
+        family = self._families.get(name)
+        if family is None:
+            family = MetricFamily(name, help, type, factory)
+            self._families[name] = family
+
+        elif family.type != type:
+            raise ValueError('{} already registered as a {}'.format(
+                name, family.type))
+
+        return family
+
+    def counter(self, name, help):
+        return self._family(name, help, 'counter', Counter)
+
+    def gauge(self, name, help):
+        return self._family(name, help, 'gauge', Gauge)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        buckets = tuple(sorted(buckets))
+        return self._family(
+            name, help, 'histogram', lambda: Histogram(buckets))
+
+    def add_collector(self, collector):
+        """Call ``collector()`` before each exposition.
+
+        Collectors update gauges which are cheaper to read on demand than to
+        keep current, such as connection ready counts.
+        """
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        self._collectors.remove(collector)
+
+    def collect(self):
+        """Run the collectors and return the metric families."""
+        for collector in list(self._collectors):
+            collector()
+        return list(self._families.values())
+
+    def to_prometheus(self):
+        """Render every metric in the Prometheus text exposition format."""
+        lines = []
+        for family in self.collect():
+            lines.append('# HELP {} {}'.format(family.name, family.help))
+            lines.append('# TYPE {} {}'.format(family.name, family.type))
+
+            for labels, metric in list(family.children.items()):
+                if family.type == 'histogram':
+                    lines.extend(_histogram_lines(family.name, labels, metric))
+                else:
+                    lines.append(_sample(family.name, labels, metric.value))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _sample(name, labels, value):
+    if labels:
+        name += '{%s}' % ','.join(
+            '{}="{}"'.format(k, _escape_label(v)) for k, v in labels)
+    return '{} {}'.format(name, _format_float(value))
+
+
+def _histogram_lines(name, labels, histogram):
+    cumulative = 0
+    bounds = histogram.buckets + (float('inf'),)
+    for bound, count in zip(bounds, histogram.counts):
+        cumulative += count
+        bucket_labels = labels + (('le', _format_float(bound)),)
+        yield _sample(name + '_bucket', bucket_labels, cumulative)
+
+    yield _sample(name + '_sum', labels, histogram.sum)
+    yield _sample(name + '_count', labels, histogram.count)
+
+
+class StatsdExporter(object):
+    """Periodically send the metrics of a registry to statsd over udp.
+
+    Metrics are pre-aggregated in process, so each flush sends one line per
+    metric rather than one per event: counters as the increase since the last
+    flush, gauges as their value and histograms as ``count`` and ``sum``
+    counters plus ``p50``, ``p90`` and ``p99`` gauges over the interval.
+    Label values are appended to the metric name in label name order.
+
+    :param registry: the :class:`MetricsRegistry` to export
+
+    :param host: the statsd host
+
+    :param port: the statsd udp port
+
+    :param interval: seconds between flushes
+
+    :param backend: the backend used to run the flush loop (see
+        :mod:`gnsq.backends`)
+    """
+    percentiles = (50, 90, 99)
+
+    def __init__(self, registry, host='127.0.0.1', port=8125, interval=10,
+                 backend=None):
+        self.registry = registry
+        self.address = (host, port)
+        self.interval = interval
+        self._backend = get_backend(backend)
+        self._socket = None
+        self._task = None
+        self._running = False
+        self._last = {}
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._task = self._backend.spawn(self._run)
+        return self
+
+    def stop(self, flush=True):
+        self._running = False
+        if self._task is not None:
+            self._task.kill(block=False)
+            self._task = None
+        if flush:
+            self.flush()
+
+    def _run(self):
+        try:
+            while self._running:
+                self._backend.sleep(self.interval)
+                self.flush()
+        except self._backend.TaskExit:
+            pass
+
+    def _delta(self, key, value):
+        last = self._last.get(key, 0)
+        self._last[key] = value
+        return value - last
+
+    def lines(self):
+        """Build the statsd lines for one flush."""
+        lines = []
+        for family in self.registry.collect():
+            for labels, metric in list(family.children.items()):
+                name = _statsd_name(family.name, labels)
+                handler = getattr(self, '_{}_lines'.format(family.type))
+                lines.extend(handler(name, metric))
+        return lines
+
+    def _counter_lines(self, name, counter):
+        delta = self._delta(name, counter.value)
+        if delta:
+            yield '{}:{}|c'.format(name, delta)
+
+    def _gauge_lines(self, name, gauge):
+        yield '{}:{}|g'.format(name, gauge.value)
+
+    def _histogram_lines(self, name, histogram):
+        last = self._last.get(name) or [0] * len(histogram.counts)
+        counts = list(histogram.counts)
+        self._last[name] = counts
+        interval_counts = [new - old for new, old in zip(counts, last)]
+
+        count = sum(interval_counts)
+        if not count:
+            return
+
+        total = self._delta(name + '.sum', histogram.sum)
+        yield '{}.count:{}|c'.format(name, count)
+        yield '{}.sum:{}|c'.format(name, total)
+
+        for percent in self.percentiles:
+            value = histogram.percentile(percent, interval_counts)
+            yield '{}.p{}:{}|g'.format(name, percent, value)
+
+    def flush(self):
+        """Send the current metrics to statsd."""
+        if self._socket is None:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        for packet in _packets(self.lines()):
+            try:
+                self._socket.sendto(packet, self.address)
+            except socket.error:
+                pass
+
+
+def _statsd_name(name, labels):
+    parts = [name]
+    parts.extend(_INVALID_STATSD_CHARS.sub('_', str(v)) for _, v in labels)
+    return '.'.join(parts)
+
+
+def _packets(lines):
+    packet = []
+    size = 0
+    for line in lines:
+        line = line.encode('utf-8')
+        if packet and size + len(line) + 1 > STATSD_PACKET_SIZE:
+            yield b'\n'.join(packet)
+            packet, size = [], 0
+        packet.append(line)
+        size += len(line) + 1
+
+    if packet:
+        yield b'\n'.join(packet)
+
+
+class ConnectionMetrics(object):
+    """The per connection metrics of a :class:`ConsumerMetrics`."""
+    __slots__ = ('received', 'finished', 'requeued', 'abandoned', 'given_up')
+
+    def __init__(self, metrics, labels):
+        self.received = metrics.received.labels(**labels)
+        self.finished = metrics.finished.labels(**labels)
+        self.requeued = metrics.requeued.labels(**labels)
+        self.abandoned = metrics.abandoned.labels(**labels)
+        self.given_up = metrics.given_up.labels(**labels)
+
+
+class ConsumerMetrics(object):
+    """Binds the metrics of a :class:`~gnsq.Consumer` to a registry.
+
+    The metrics for each connection are looked up once and kept, so counting
+    a message is a dict lookup and an integer increment. Ready counts and
+    in flight messages are read from the connections on collection.
+    """
+
+    def __init__(self, consumer, registry):
+        self.consumer = consumer
+        self.registry = registry
+        self.labels = {'topic': consumer.topic, 'channel': consumer.channel}
+        self.connections = {}
+
+        self.received = registry.counter(
+            'consumer_messages_received_total', 'Messages received.')
+        self.finished = registry.counter(
+            'consumer_messages_finished_total', 'Messages finished.')
+        self.requeued = registry.counter(
+            'consumer_messages_requeued_total', 'Messages requeued.')
+        self.abandoned = registry.counter(
+            'consumer_messages_abandoned_total',
+            'Messages abandoned after their lease expired.')
+        self.given_up = registry.counter(
+            'consumer_messages_given_up_total',
+            'Messages given up on after max_tries.')
+        self.connects = registry.counter(
+            'consumer_connections_total', 'Successful nsqd connections.')
+        self.connection_failures = registry.counter(
+            'consumer_connection_failures_total',
+            'Failed or lost nsqd connections.')
+        self.backoff = registry.counter(
+            'consumer_backoff_seconds_total', 'Time spent backing off.')
+        self.ready_count = registry.gauge(
+            'consumer_ready_count', 'Current RDY count.')
+        self.in_flight = registry.gauge(
+            'consumer_in_flight', 'Messages in flight.')
+        self.in_flight_bytes = registry.gauge(
+            'consumer_in_flight_bytes', 'Size of message bodies in flight.')
+        self.max_in_flight_bytes = registry.gauge(
+            'consumer_max_in_flight_bytes',
+            'Configured in flight bytes budget.')
+        self.max_in_flight = registry.gauge(
+            'consumer_max_in_flight', 'Configured max in flight.')
+
+        self.handler_seconds = registry.histogram(
+            'consumer_handler_seconds', 'Message handler latency.'
+        ).labels(**self.labels)
+
+        registry.add_collector(self.collect)
+
+    def _conn_labels(self, conn):
+        return dict(self.labels, nsqd=str(conn))
+
+    def connection(self, conn):
+        try:
+            return self.connections[conn]
+        except KeyError:
+            metrics = ConnectionMetrics(self, self._conn_labels(conn))
+            return self.connections.setdefault(conn, metrics)
+
+    def connected(self, conn):
+        self.connects.labels(**self._conn_labels(conn)).inc()
+
+    def connection_failed(self, conn):
+        self.connection_failures.labels(**self._conn_labels(conn)).inc()
+
+    def backing_off(self, conn, interval):
+        self.backoff.labels(**self._conn_labels(conn)).inc(interval)
+
+    def collect(self):
+        self.ready_count.clear()
+        self.in_flight.clear()
+        self.in_flight_bytes.clear()
+
+        for conn in list(self.consumer._connections):
+            labels = self._conn_labels(conn)
+            self.ready_count.labels(**labels).set(conn.ready_count)
+            self.in_flight.labels(**labels).set(conn.in_flight)
+            self.in_flight_bytes.labels(**labels).set(conn.in_flight_bytes)
+
+        self.max_in_flight.labels(**self.labels).set(
+            self.consumer.max_in_flight)
+
+        if self.consumer.max_in_flight_bytes:
+            self.max_in_flight_bytes.labels(**self.labels).set(
+                self.consumer.max_in_flight_bytes)
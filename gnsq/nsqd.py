@@ -1,27 +1,28 @@
 # -*- coding: utf-8 -*-
-from __future__ import absolute_import
+from __future__ import absolute_import, division
 
 import json
+import socket
 import time
 
 import blinker
 
-from gevent import socket
-
 from . import protocol as nsq
 from . import errors
 
+from .backends import get_backend
 from .decorators import cached_property, deprecated
 from .httpclient import HTTPClient, USERAGENT
-from .message import Message
+from .message import Lease, Message
 from .states import CONNECTED, DISCONNECTED, INIT
 from .stream import Stream
+from .topic import TopicMixin
 
 HOSTNAME = socket.gethostname()
 SHORTNAME = HOSTNAME.split('.')[0]
 
 
-class NsqdTCPClient(object):
+class NsqdTCPClient(TopicMixin):
     """Low level object representing a TCP connection to nsqd.
 
     :param address: the host or ip address of the nsqd
@@ -71,6 +72,17 @@ class NsqdTCPClient(object):
     :param user_agent: a string identifying the agent for this client in the
         spirit of HTTP (default: ``<client_library_name>/<version>``) (requires
         nsqd 0.2.25+)
+
+    :param msg_timeout: the time in seconds nsqd waits for a response to a
+        message before redelivering it. Defaults to the nsqd setting. After
+        :meth:`identify` the negotiated value is available in milliseconds as
+        :attr:`msg_timeout` (requires nsqd 0.2.28+)
+
+    :param max_batch_size: the maximum number of messages sent at once through
+        :attr:`on_messages`. Defaults to every message decoded from one read
+
+    :param backend: the I/O backend, ``'gevent'`` (default), ``'threading'``
+        or a backend instance (see :mod:`gnsq.backends`)
     """
     def __init__(
         self,
@@ -90,6 +102,9 @@ class NsqdTCPClient(object):
         sample_rate=0,
         auth_secret=None,
         user_agent=USERAGENT,
+        msg_timeout=None,
+        max_batch_size=None,
+        backend=None,
     ):
         self.address = address
         self.port = port
@@ -107,14 +122,26 @@ class NsqdTCPClient(object):
         self.deflate_level = deflate_level
         self.sample_rate = sample_rate
         self.auth_secret = auth_secret
+        self.max_batch_size = max_batch_size
         self.user_agent = user_agent
+        self.backend = get_backend(backend)
+
+        if msg_timeout is None:
+            self._requested_msg_timeout = None
+            self.msg_timeout = 60000
+        else:
+            self._requested_msg_timeout = self.msg_timeout = int(
+                1000 * msg_timeout)
 
         self.state = INIT
         self.last_response = time.time()
         self.last_message = time.time()
         self.ready_count = 0
         self.in_flight = 0
+        self.in_flight_bytes = 0
         self.max_ready_count = 2500
+        self._lock = self.backend.StateLock()
+        self._batch = None
 
         self._frame_handlers = {
             nsq.FRAME_TYPE_RESPONSE: self.handle_response,
@@ -131,6 +158,17 @@ class NsqdTCPClient(object):
         """
         return blinker.Signal(doc='Emitted when a message frame is received.')
 
+    @cached_property
+    def on_messages(self):
+        """Emitted with the messages decoded from a single read.
+
+        While any receiver is connected, messages are collected into lists of
+        up to ``max_batch_size`` instead of sending :attr:`on_message`. The
+        signal sender is the connection and the ``messages`` are sent as an
+        argument.
+        """
+        return blinker.Signal(doc='Emitted with a batch of messages.')
+
     @cached_property
     def on_response(self):
         """Emitted when a response frame is received.
@@ -169,6 +207,15 @@ class NsqdTCPClient(object):
         """
         return blinker.Signal(doc='Emitted after the a message is requeued.')
 
+    @cached_property
+    def on_abandon(self):
+        """Emitted after a message with an expired lease is abandoned.
+
+        The signal sender is the connection and the ``message`` is sent as an
+        argument.
+        """
+        return blinker.Signal(doc='Emitted after a message is abandoned.')
+
     @cached_property
     def on_auth(self):
         """Emitted after the connection is successfully authenticated.
@@ -210,7 +257,8 @@ class NsqdTCPClient(object):
         if self.is_connected:
             return
 
-        stream = Stream(self.address, self.port, self.timeout)
+        stream = Stream(
+            self.address, self.port, self.timeout, backend=self.backend)
         stream.connect()
 
         self.stream = stream
@@ -246,7 +294,9 @@ class NsqdTCPClient(object):
 
         :returns: tuple of the frame type and the processed data.
         """
-        response = self._read_response()
+        return self._process_response(self._read_response())
+
+    def _process_response(self, response):
         frame, data = nsq.unpack_response(response)
         self.last_response = time.time()
 
@@ -276,33 +326,118 @@ class NsqdTCPClient(object):
 
     def handle_message(self, data):
         self.last_message = time.time()
-        self.in_flight += 1
 
         message = Message(*nsq.unpack_message(data))
+        with self._lock:
+            self.in_flight += 1
+            self.in_flight_bytes += len(message.body)
+
+        message.lease = Lease(self, self.msg_timeout / 1000)
         message.on_finish.connect(self.handle_finish)
         message.on_requeue.connect(self.handle_requeue)
         message.on_touch.connect(self.handle_touch)
 
-        self.on_message.send(self, message=message)
+        if self._batch is None:
+            self.on_message.send(self, message=message)
+            return message
+
+        self._batch.append(message)
+        if len(self._batch) == self.max_batch_size:
+            batch, self._batch = self._batch, []
+            self.on_messages.send(self, messages=batch)
+
         return message
 
     def handle_finish(self, message):
+        if message.is_expired():
+            return self.abandon(message)
+        self._release(message)
         self.finish(message.id)
 
     def handle_requeue(self, message, timeout, backoff):
+        if message.is_expired():
+            return self.abandon(message)
+        self._release(message)
         self.requeue(message.id, timeout, backoff)
 
     def handle_touch(self, message):
+        if message.is_expired():
+            return self.abandon(message)
+        message.lease.renew()
         self.touch(message.id)
 
+    def abandon(self, message):
+        """Stop tracking a message whose lease expired, without responding.
+
+        nsqd has timed the message out or dropped it with the connection, so
+        a FIN or REQ would fail. Emits :attr:`on_abandon` once per message.
+        """
+        if message.lease.abandoned:
+            return
+
+        message.lease.abandoned = True
+        self._release(message)
+        if self.is_connected:
+            self.finish_inflight()
+
+        self.on_abandon.send(self, message=message)
+
+    def _release(self, message):
+        with self._lock:
+            self.in_flight_bytes -= len(message.body)
+
     def finish_inflight(self):
-        self.in_flight -= 1
+        with self._lock:
+            self.in_flight -= 1
 
     def listen(self):
         """Listen to incoming responses until the connection closes."""
         while self.is_connected:
+            if self.on_messages.receivers:
+                self._read_batch(self._read_next)
+            else:
+                self.read_response()
+
+    def _read_next(self):
+        self.read_response()
+        self._read_buffered()
+
+    def _read_buffered(self):
+        while self.is_connected and self._has_response():
             self.read_response()
 
+    def _read_batch(self, read):
+        self._batch = []
+        try:
+            read()
+        finally:
+            batch, self._batch = self._batch, None
+
+        if batch:
+            self.on_messages.send(self, messages=batch)
+
+    def _has_response(self):
+        header = self.stream.peek(4)
+        if len(header) < 4:
+            return False
+        return len(self.stream.buffer) >= 4 + nsq.unpack_size(header)
+
+    def read_available(self):
+        """Read once from the socket and handle every complete response.
+
+        Used by non-blocking readers once the socket is readable.
+        """
+        try:
+            self.stream.fill()
+        except Exception:
+            self.close_stream()
+            raise
+
+        if self.on_messages.receivers:
+            self._read_batch(self._read_buffered)
+        else:
+            self._read_buffered()
+
     def check_ok(self, expected=nsq.OK):
         frame, data = self.read_response()
         if frame == nsq.FRAME_TYPE_ERROR:
@@ -326,13 +461,8 @@ class NsqdTCPClient(object):
         self.stream.upgrade_to_defalte(self.deflate_level)
         self.check_ok()
 
-    def identify(self):
-        """Update client metadata on the server and negotiate features.
-
-        :returns: nsqd response data if there was feature negotiation,
-            otherwise ``None``
-        """
-        self.send(nsq.identify({
+    def _identify_options(self):
+        options = {
             # nsqd 0.2.28+
             'client_id': self.client_id,
             'hostname': self.hostname,
@@ -356,15 +486,20 @@ class NsqdTCPClient(object):
             # nsqd nsqd 0.2.25+
             'sample_rate': self.sample_rate,
             'user_agent': self.user_agent,
-        }))
+        }
 
-        frame, data = self.read_response()
+        # nsqd 0.2.28+
+        if self._requested_msg_timeout is not None:
+            options['msg_timeout'] = self._requested_msg_timeout
+
+        return options
 
+    def _parse_identify_response(self, frame, data):
         if frame == nsq.FRAME_TYPE_ERROR:
             raise data
 
         if data == nsq.OK:
-            return
+            return None
 
         try:
             data = json.loads(data.decode('utf-8'))
@@ -376,6 +511,21 @@ class NsqdTCPClient(object):
                 '{!r}'.format(data))
 
         self.max_ready_count = data.get('max_rdy_count', self.max_ready_count)
+        self.msg_timeout = data.get('msg_timeout', self.msg_timeout)
+        return data
+
+    def identify(self):
+        """Update client metadata on the server and negotiate features.
+
+        :returns: nsqd response data if there was feature negotiation,
+            otherwise ``None``
+        """
+        self.send(nsq.identify(self._identify_options()))
+        frame, data = self.read_response()
+
+        data = self._parse_identify_response(frame, data)
+        if data is None:
+            return
 
         if self.tls_v1 and data.get('tls_v1'):
             self.upgrade_to_tls()
@@ -396,7 +546,9 @@ class NsqdTCPClient(object):
         """Send authorization secret to nsqd."""
         self.send(nsq.auth(self.auth_secret))
         frame, data = self.read_response()
+        return self._handle_auth_response(frame, data)
 
+    def _handle_auth_response(self, frame, data):
         if frame == nsq.FRAME_TYPE_ERROR:
             raise data
 
@@ -439,6 +591,15 @@ class NsqdTCPClient(object):
         """
         self.send(nsq.multipublish(topic, messages))
 
+    def _publish_topic(self, encoder, data, defer=None):
+        if defer is None:
+            self.send(encoder.publish(data))
+        else:
+            self.send(encoder.deferpublish(data, defer))
+
+    def _multipublish_topic(self, encoder, messages):
+        self.send(encoder.multipublish(messages))
+
     def ready(self, count):
         """Indicate you are ready to receive ``count`` messages."""
         self.ready_count = count
@@ -489,7 +650,7 @@ class NsqdTCPClient(object):
         return hash(self) < hash(other)
 
 
-class NsqdHTTPClient(HTTPClient):
+class NsqdHTTPClient(TopicMixin, HTTPClient):
     """Low level http client for nsqd.
 
     :param host: nsqd host address (default: localhost)
@@ -515,6 +676,9 @@ class NsqdHTTPClient(HTTPClient):
             (requires nsq 0.3.6)
         """
         nsq.assert_valid_topic_name(topic)
+        return self._publish(topic, data, defer)
+
+    def _publish(self, topic, data, defer):
         fields = {'topic': topic}
 
         if defer is not None:
@@ -522,6 +686,9 @@ class NsqdHTTPClient(HTTPClient):
 
         return self._request('POST', '/pub', fields=fields, body=data)
 
+    def _publish_topic(self, encoder, data, defer=None):
+        return self._publish(encoder.name, data, defer)
+
     def _validate_mpub_message(self, message):
         if b'\n' not in message:
             return message
@@ -543,6 +710,9 @@ class NsqdHTTPClient(HTTPClient):
         expected to be in the following wire protocol format.
         """
         nsq.assert_valid_topic_name(topic)
+        return self._multipublish(topic, messages, binary)
+
+    def _multipublish(self, topic, messages, binary):
         fields = {'topic': topic}
 
         if binary:
@@ -553,6 +723,9 @@ class NsqdHTTPClient(HTTPClient):
 
         return self._request('POST', '/mpub', fields=fields, body=body)
 
+    def _multipublish_topic(self, encoder, messages, binary=False):
+        return self._multipublish(encoder.name, messages, binary)
+
     def create_topic(self, topic):
         """Create a topic."""
         nsq.assert_valid_topic_name(topic)
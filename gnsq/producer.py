@@ -5,23 +5,20 @@ import logging
 from collections import defaultdict, deque
 
 import blinker
-import gevent
-
-from gevent.event import AsyncResult
-from gevent.pool import Group
-from gevent.queue import Queue, Empty
 
 from . import protocol as nsq
 
+from .backends import get_backend
 from .backofftimer import BackoffTimer
 from .decorators import cached_property
 from .errors import NSQException, NSQNoConnections
 from .nsqd import NsqdTCPClient
 from .states import INIT, RUNNING, CLOSED
+from .topic import TopicMixin
 from .util import parse_nsqds
 
 
-class Producer(object):
+class Producer(TopicMixin):
     """High level NSQ producer.
 
     A Producer will connect to the nsqd tcp addresses and support async
@@ -36,16 +33,26 @@ class Producer(object):
         producer.start()
         producer.publish('topic', b'hello world')
 
+    Topics published to repeatedly can use a :class:`~gnsq.topic.Topic`
+    handle, which validates the name once and keeps per topic stats::
+
+        events = producer.topic('events')
+        events.publish(b'hello world')
+        events.multipublish([b'hello', b'world'])
+
     :param nsqd_tcp_addresses: a sequence of string addresses of the nsqd
         instances this consumer should connect to
 
     :param max_backoff_duration: the maximum time we will allow a backoff state
         to last in seconds. If zero, backoff wil not occur
 
+    :param backend: the I/O backend, ``'gevent'`` (default), ``'threading'``
+        or a backend instance (see :mod:`gnsq.backends`)
+
     :param **kwargs: passed to :class:`~gnsq.NsqdTCPClient` initialization
     """
     def __init__(self, nsqd_tcp_addresses=[], max_backoff_duration=128,
-                 **kwargs):
+                 backend=None, **kwargs):
         if not nsqd_tcp_addresses:
             raise ValueError('must specify at least one nsqd or lookupd')
 
@@ -54,11 +61,14 @@ class Producer(object):
         self.conn_kwargs = kwargs
         self.logger = logging.getLogger(__name__)
 
+        self._backend = get_backend(backend)
+        self.conn_kwargs['backend'] = self._backend
+
         self._state = INIT
-        self._connections = Queue()
+        self._connections = self._backend.Queue()
         self._connection_backoffs = defaultdict(self._create_backoff)
         self._response_queues = {}
-        self._workers = Group()
+        self._workers = self._backend.Group()
 
     @cached_property
     def on_response(self):
@@ -122,7 +132,7 @@ class Producer(object):
         while True:
             try:
                 conn = self._connections.get(block=False)
-            except Empty:
+            except self._backend.Empty:
                 break
 
             conn.close_stream()
@@ -166,10 +176,8 @@ class Producer(object):
         self.logger.info('[%s] connection successful', conn)
         self.handle_connection_success(conn)
 
-    def _listen(self, conn):
-        try:
-            conn.listen()
-        except NSQException as error:
+    def _handle_listen_exit(self, conn, error):
+        if error is not None:
             self.logger.warning('[%s] connection lost (%r)', conn, error)
 
         self.handle_connection_failure(conn)
@@ -177,7 +185,8 @@ class Producer(object):
     def handle_connection_success(self, conn):
         self._response_queues[conn] = deque()
         self._put_connection(conn)
-        self._workers.spawn(self._listen, conn)
+        self._workers.add(
+            self._backend.listen(conn, self._handle_listen_exit))
         self._connection_backoffs[conn].success()
 
     def handle_connection_failure(self, conn):
@@ -190,7 +199,7 @@ class Producer(object):
         seconds = self._connection_backoffs[conn].failure().get_interval()
         self.logger.debug('[%s] retrying in %ss', conn, seconds)
 
-        gevent.spawn_later(
+        self._backend.spawn_later(
             seconds, self.connect_to_nsqd, conn.address, conn.port)
 
     def handle_auth(self, conn, response):
@@ -236,7 +245,7 @@ class Producer(object):
         while True:
             try:
                 conn = self._connections.get(block=block, timeout=timeout)
-            except Empty:
+            except self._backend.Empty:
                 raise NSQNoConnections
 
             if conn.is_connected:
@@ -272,19 +281,8 @@ class Producer(object):
             from the nsqd server, and any error response is raised. Otherwise
             an :class:`~gevent.event.AsyncResult` is returned
         """
-        result = AsyncResult()
-        conn = self._get_connection(block=block, timeout=timeout)
-
-        try:
-            self._response_queues[conn].append(result)
-            conn.publish(topic, data, defer=defer)
-        finally:
-            self._put_connection(conn)
-
-        if raise_error:
-            return result.get()
-
-        return result
+        return self._send(
+            block, timeout, raise_error, 'publish', topic, data, defer)
 
     def multipublish(self, topic, messages, block=True, timeout=None,
                      raise_error=True):
@@ -306,12 +304,28 @@ class Producer(object):
             from the nsqd server, and any error response is raised. Otherwise
             an :class:`~gevent.event.AsyncResult` is returned
         """
-        result = AsyncResult()
+        return self._send(
+            block, timeout, raise_error, 'multipublish', topic, messages)
+
+    def _publish_topic(self, encoder, data, defer=None, block=True,
+                       timeout=None, raise_error=True):
+        return self._send(
+            block, timeout, raise_error, '_publish_topic', encoder, data,
+            defer)
+
+    def _multipublish_topic(self, encoder, messages, block=True,
+                            timeout=None, raise_error=True):
+        return self._send(
+            block, timeout, raise_error, '_multipublish_topic', encoder,
+            messages)
+
+    def _send(self, block, timeout, raise_error, method, *args):
+        result = self._backend.AsyncResult()
         conn = self._get_connection(block=block, timeout=timeout)
 
         try:
             self._response_queues[conn].append(result)
-            conn.multipublish(topic, messages)
+            getattr(conn, method)(*args)
         finally:
             self._put_connection(conn)
 
@@ -30,6 +30,7 @@ SPACE = b' '
 EMPTY = b''
 HEARTBEAT = b'_heartbeat_'
 OK = b'OK'
+CLOSE_WAIT = b'CLOSE_WAIT'
 
 IDENTIFY = b'IDENTIFY'
 AUTH = b'AUTH'
@@ -48,6 +49,21 @@ FRAME_TYPE_RESPONSE = 0
 FRAME_TYPE_ERROR = 1
 FRAME_TYPE_MESSAGE = 2
 
+SIZE = struct.Struct('>l')
+MESSAGE_HEADER = struct.Struct('>qh')
+
+FIN_PREFIX = FIN + SPACE
+REQ_PREFIX = REQ + SPACE
+TOUCH_PREFIX = TOUCH + SPACE
+REQ_NO_TIMEOUT = SPACE + b'0' + NEWLINE
+CLS_COMMAND = CLS + NEWLINE
+NOP_COMMAND = NOP + NEWLINE
+
+#: Ready counts with a precomputed ``RDY`` command (nsqd's default maximum).
+READY_CACHE_SIZE = 2501
+READY_COMMANDS = tuple(
+    six.b('RDY {}\n'.format(count)) for count in range(READY_CACHE_SIZE))
+
 
 #
 # Helpers
@@ -85,26 +101,23 @@ def assert_valid_channel_name(channel):
 # Responses
 #
 def unpack_size(data):
-    return struct.unpack('>l', data)[0]
+    return SIZE.unpack(data)[0]
 
 
 def unpack_response(data):
-    return unpack_size(data[:4]), data[4:]
+    return SIZE.unpack_from(data)[0], data[4:]
 
 
 def unpack_message(data):
-    timestamp = struct.unpack('>q', data[:8])[0]
-    attempts = struct.unpack('>h', data[8:10])[0]
-    message_id = data[10:26]
-    body = data[26:]
-    return timestamp, attempts, message_id, body
+    timestamp, attempts = MESSAGE_HEADER.unpack_from(data)
+    return timestamp, attempts, data[10:26], data[26:]
 
 
 #
 # Commands
 #
 def _packsize(data):
-    return struct.pack('>l', len(data))
+    return SIZE.pack(len(data))
 
 
 def _packbody(body):
@@ -126,6 +139,15 @@ def _command(cmd, body, *params):
     return EMPTY.join((SPACE.join((cmd,) + params), NEWLINE, _packbody(body)))
 
 
+# FIN, REQ, TOUCH, RDY, CLS and NOP are sent for every message or ready
+# update, so they are built by concatenating precomputed parts rather than
+# going through _command.
+def _message_id(message_id):
+    if isinstance(message_id, bytes):
+        return message_id
+    return message_id.encode('utf-8')
+
+
 def identify(data):
     return _command(IDENTIFY, six.b(json.dumps(data)))
 
@@ -160,6 +182,34 @@ def deferpublish(topic_name, data, delay_ms):
     return _command(DPUB, data, topic_name, six.b('{}'.format(delay_ms)))
 
 
+class TopicEncoder(object):
+    """Publish commands for a single topic.
+
+    The topic name is validated and encoded once, and the command prefixes are
+    cached, so encoding a message is a couple of concatenations.
+    """
+    __slots__ = ('name', 'pub_prefix', 'mpub_prefix', 'dpub_prefix')
+
+    def __init__(self, topic_name):
+        assert_valid_topic_name(topic_name)
+        encoded = _encode_param(topic_name)
+        self.name = topic_name
+        self.pub_prefix = PUB + SPACE + encoded + NEWLINE
+        self.mpub_prefix = MPUB + SPACE + encoded + NEWLINE
+        self.dpub_prefix = DPUB + SPACE + encoded + SPACE
+
+    def publish(self, data):
+        return self.pub_prefix + _packbody(data)
+
+    def multipublish(self, messages):
+        return self.mpub_prefix + _packbody(multipublish_body(messages))
+
+    def deferpublish(self, data, delay_ms):
+        return EMPTY.join((
+            self.dpub_prefix, six.b('{}'.format(delay_ms)), NEWLINE,
+            _packbody(data)))
+
+
 def ready(count):
     if not isinstance(count, int):
         raise TypeError('ready count must be an integer')
@@ -167,26 +217,35 @@ def ready(count):
     if count < 0:
         raise ValueError('ready count cannot be negative')
 
-    return _command(RDY, None, six.b('{}'.format(count)))
+    if count < READY_CACHE_SIZE:
+        return READY_COMMANDS[count]
+
+    return six.b('RDY {}\n'.format(count))
 
 
 def finish(message_id):
-    return _command(FIN, None, message_id)
+    return FIN_PREFIX + _message_id(message_id) + NEWLINE
 
 
 def requeue(message_id, timeout=0):
     if not isinstance(timeout, int):
         raise TypeError('requeue timeout must be an integer')
-    return _command(REQ, None, message_id, six.b('{}'.format(timeout)))
+
+    if timeout == 0:
+        return REQ_PREFIX + _message_id(message_id) + REQ_NO_TIMEOUT
+
+    return EMPTY.join((
+        REQ_PREFIX, _message_id(message_id), SPACE,
+        six.b('{}'.format(timeout)), NEWLINE))
 
 
 def touch(message_id):
-    return _command(TOUCH, None, message_id)
+    return TOUCH_PREFIX + _message_id(message_id) + NEWLINE
 
 
 def close():
-    return _command(CLS, None)
+    return CLS_COMMAND
 
 
 def nop():
-    return _command(NOP, None)
+    return NOP_COMMAND
@@ -4,8 +4,6 @@ from __future__ import absolute_import, division
 import random
 from multiprocessing import cpu_count
 
-from gevent.queue import Queue
-
 from .consumer import Consumer
 from .decorators import deprecated
 from .errors import NSQNoConnections
@@ -32,13 +30,13 @@ class Reader(Consumer):
         else:
             self.max_concurrency = max_concurrency
 
+        super(Reader, self).__init__(*args, **kwargs)
+
         if self.max_concurrency:
-            self.queue = Queue()
+            self.queue = self._backend.Queue()
         else:
             self.queue = None
 
-        super(Reader, self).__init__(*args, **kwargs)
-
     def start(self, *args, **kwargs):
         if self._state == INIT:
             for _ in range(self.max_concurrency):
@@ -70,7 +68,7 @@ class Reader(Consumer):
         return super(Reader, self)._handle_message(message)
 
     def _run(self):
-        for conn, message in self.queue:
+        for conn, message in iter(self.queue.get, None):
             if not conn.is_connected:
                 continue
             super(Reader, self).handle_message(conn, message)
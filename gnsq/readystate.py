@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division
+
+import random
+import time
+
+from .backofftimer import BackoffTimer
+from .decorators import cached_property
+from .errors import NSQSocketError
+from .states import RUNNING, BACKOFF, THROTTLED
+
+
+class ReadyStateMixin(object):
+    """RDY distribution and backoff state machine shared by the consumers.
+
+    The consumer must provide the attributes ``_connections`` (a mapping of
+    connection to state), ``_message_backoffs``, ``max_in_flight``,
+    ``low_ready_idle_timeout``, ``max_backoff_duration``, ``logger`` and
+    ``is_running``, and the methods:
+
+    * ``redistribute_ready_state()``, which schedules
+      :meth:`_redistribute_ready_state` on its event loop
+    * ``_call_later(seconds, func, *args)``, which calls ``func(*args)``
+      after ``seconds``
+    """
+
+    def _create_backoff(self):
+        return BackoffTimer(max_interval=self.max_backoff_duration)
+
+    @cached_property
+    def _ready_limits(self):
+        return []
+
+    def add_ready_limit(self, limit):
+        """Cap the total RDY count with ``limit()``.
+
+        ``limit`` is called whenever RDY counts are redistributed and returns
+        the maximum number of messages to have in flight, or ``None`` for no
+        limit. Handlers applying backpressure call
+        :meth:`redistribute_ready_state` when their limit changes.
+        """
+        self._ready_limits.append(limit)
+
+    def remove_ready_limit(self, limit):
+        self._ready_limits.remove(limit)
+
+    def _get_max_in_flight(self):
+        max_in_flight = self.max_in_flight
+        for limit in self._ready_limits:
+            value = limit()
+            if value is not None:
+                max_in_flight = min(max_in_flight, max(value, 0))
+        return max_in_flight
+
+    def _get_ready_state(self):
+        max_in_flight = self._get_max_in_flight()
+        if len(self._connections) > max_in_flight:
+            return self._get_unsaturated_ready_state(max_in_flight)
+        return self._get_saturated_ready_state(max_in_flight)
+
+    def _redistribute_ready_state(self):
+        if not self.is_running:
+            return
+
+        for conn, count in self._get_ready_state().items():
+            if conn.ready_count == count:
+                self.logger.debug('[%s] RDY count already %d', conn, count)
+                continue
+
+            self.logger.debug('[%s] sending RDY %d', conn, count)
+
+            try:
+                conn.ready(count)
+            except NSQSocketError as error:
+                self.logger.warning(
+                    '[%s] RDY %d failed (%r)', conn, count, error)
+
+    def _get_unsaturated_ready_state(self, max_in_flight):
+        ready_state = {}
+        active = []
+
+        for conn, state in self._connections.items():
+            if state == BACKOFF:
+                ready_state[conn] = 0
+
+            elif state in (RUNNING, THROTTLED):
+                active.append(conn)
+
+        random.shuffle(active)
+
+        for conn in active[max_in_flight:]:
+            ready_state[conn] = 0
+
+        for conn in active[:max_in_flight]:
+            ready_state[conn] = 1
+
+        return ready_state
+
+    def _get_saturated_ready_state(self, max_in_flight):
+        ready_state = {}
+        active = []
+        now = time.time()
+
+        for conn, state in self._connections.items():
+            if state == BACKOFF:
+                ready_state[conn] = 0
+
+            elif state == THROTTLED:
+                ready_state[conn] = 1
+
+            elif state == RUNNING:
+                if (now - conn.last_message) > self.low_ready_idle_timeout:
+                    self.logger.info(
+                        '[%s] idle connection, giving up RDY count', conn)
+                    ready_state[conn] = 1
+
+                else:
+                    active.append(conn)
+
+        if not active:
+            return ready_state
+
+        ready_available = max_in_flight - sum(ready_state.values())
+        connection_max_in_flight = ready_available // len(active)
+
+        for conn in active:
+            ready_state[conn] = connection_max_in_flight
+
+        for conn in random.sample(active, ready_available % len(active)):
+            ready_state[conn] += 1
+
+        return ready_state
+
+    def _start_backoff(self, conn):
+        self._connections[conn] = BACKOFF
+
+        interval = self._message_backoffs[conn].get_interval()
+        self._call_later(interval, self._start_throttled, conn)
+
+        self.logger.info('[%s] backing off for %s seconds', conn, interval)
+        self.redistribute_ready_state()
+
+    def _start_throttled(self, conn):
+        if self._connections.get(conn) != BACKOFF:
+            return
+
+        self._connections[conn] = THROTTLED
+        self.logger.info('[%s] testing backoff state with RDY 1', conn)
+        self.redistribute_ready_state()
+
+    def _complete_backoff(self, conn):
+        if self._message_backoffs[conn].is_reset():
+            self._connections[conn] = RUNNING
+            self.logger.info('throttle complete, resuming normal operation')
+            self.redistribute_ready_state()
+        else:
+            self._start_backoff(conn)
+
+    def _finish_message(self, conn, backoff):
+        if not self.max_backoff_duration:
+            return
+
+        try:
+            state = self._connections[conn]
+        except KeyError:
+            return
+
+        if state == BACKOFF:
+            return
+
+        if backoff:
+            self._message_backoffs[conn].failure()
+            self._start_backoff(conn)
+
+        elif state == THROTTLED:
+            self._message_backoffs[conn].success()
+            self._complete_backoff(conn)
@@ -8,3 +8,4 @@ RUNNING = 3
 BACKOFF = 4
 THROTTLED = 5
 CLOSED = 6
+DRAINING = 7
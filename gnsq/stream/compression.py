@@ -1,13 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
-from errno import EWOULDBLOCK
-from gnsq.errors import NSQSocketError
 
 
 class CompressionSocket(object):
+    """Incremental decoder wrapping a connected socket.
+
+    Compressed frames may span several socket reads. Partial input is kept by
+    the decompressor and the real socket is only read again when more bytes
+    are needed, so a read never spins waiting for a complete frame.
+    """
     def __init__(self, socket):
         self._socket = socket
-        self._bootstrapped = None
+        self._bootstrapped = b''
 
     def __getattr__(self, name):
         return getattr(self._socket, name)
@@ -17,21 +21,29 @@ class CompressionSocket(object):
             return
         self._bootstrapped = self.decompress(data)
 
-    def recv(self, size):
+    def read_into(self, buffer, size):
+        """Read from the socket and decompress into ``buffer``.
+
+        Reads at most ``size`` compressed bytes and appends the decoded output
+        (if any) to the ``bytearray`` ``buffer``. Returns the number of raw
+        bytes consumed, ``0`` meaning the peer closed the connection.
+        """
         if self._bootstrapped:
-            data = self._bootstrapped
-            self._bootstrapped = None
-            return data
+            data, self._bootstrapped = self._bootstrapped, b''
+            buffer.extend(data)
+            return len(data)
 
         chunk = self._socket.recv(size)
-        if not chunk:
-            return chunk
+        if chunk:
+            buffer.extend(self.decompress(chunk))
+        return len(chunk)
 
-        uncompressed = self.decompress(chunk)
-        if not uncompressed:
-            raise NSQSocketError(EWOULDBLOCK, 'Operation would block')
-
-        return uncompressed
+    def recv(self, size):
+        buffer = bytearray()
+        while not buffer:
+            if not self.read_into(buffer, size):
+                break
+        return bytes(buffer)
 
     def sendall(self, data):
         self._socket.sendall(self.compress(data))
@@ -1,18 +1,22 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import socket
+
 from mmap import PAGESIZE
-from errno import ENOTCONN, EDEADLK, EAGAIN, EWOULDBLOCK
+from errno import ENOTCONN
+from ssl import PROTOCOL_TLSv1_2, CERT_NONE
 
 import six
 
-import gevent
-from gevent import socket
-from gevent.lock import Semaphore
-from gevent.ssl import SSLSocket, PROTOCOL_TLSv1_2, CERT_NONE
-
+from gnsq.backends import get_backend
 from gnsq.errors import NSQSocketError
 
+try:
+    from gevent.ssl import SSLSocket  # noqa: F401
+except ImportError:
+    from ssl import SSLSocket  # noqa: F401
+
 try:
     from .snappy import SnappySocket
 except ImportError:
@@ -23,16 +27,21 @@ from .defalte import DefalteSocket
 
 class Stream(object):
     def __init__(self, address, port, timeout, buffer_size=PAGESIZE,
-                 lock_class=Semaphore):
+                 lock_class=None, backend=None):
         self.address = address
         self.port = port
         self.timeout = timeout
+        self.backend = get_backend(backend)
 
-        self.buffer = b''
+        self.buffer = bytearray()
         self.buffer_size = buffer_size
 
+        if lock_class is None:
+            lock_class = self.backend.Lock
+
         self.socket = None
         self.lock = lock_class()
+        self._read_into = self._recv_into
 
     @property
     def is_connected(self):
@@ -48,36 +57,53 @@ class Stream(object):
             return
 
         try:
-            self.socket = socket.create_connection(
-                address=(self.address, self.port),
-                timeout=self.timeout,
-            )
+            self.socket = self.backend.create_connection(
+                (self.address, self.port), self.timeout)
 
         except socket.error as error:
             six.raise_from(NSQSocketError(*error.args), error)
 
-    def read(self, size):
-        while len(self.buffer) < size:
-            self.ensure_connection()
+    def _recv_into(self, buffer, size):
+        packet = self.socket.recv(size)
+        buffer.extend(packet)
+        return len(packet)
 
-            try:
-                packet = self.socket.recv(self.buffer_size)
-            except socket.error as error:
-                if error.errno in (EDEADLK, EAGAIN, EWOULDBLOCK):
-                    gevent.sleep()
-                    continue
-                six.raise_from(NSQSocketError(*error.args), error)
+    def fill(self):
+        """Read the next chunk from the socket into the buffer.
 
-            if not packet:
-                self.close()
+        Blocks until data is available. Raises
+        :class:`~gnsq.errors.NSQSocketError` if the connection is closed.
+        """
+        self.ensure_connection()
+
+        try:
+            count = self._read_into(self.buffer, self.buffer_size)
+
+            # Drain data already decrypted by an ssl socket since the socket
+            # itself will not be reported as readable again.
+            while count and getattr(self.socket, 'pending', int)():
+                count = self._read_into(self.buffer, self.buffer_size)
+
+        except socket.error as error:
+            six.raise_from(NSQSocketError(*error.args), error)
+
+        if not count:
+            self.close()
+            self.ensure_connection()
 
-            self.buffer += packet
+    def read(self, size):
+        while len(self.buffer) < size:
+            self.fill()
 
-        data = self.buffer[:size]
-        self.buffer = self.buffer[size:]
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
 
         return data
 
+    def peek(self, size):
+        """Return up to ``size`` buffered bytes without consuming them."""
+        return bytes(self.buffer[:size])
+
     def send(self, data):
         self.ensure_connection()
 
@@ -88,8 +114,8 @@ class Stream(object):
                 six.raise_from(NSQSocketError(*error.args), error)
 
     def consume_buffer(self):
-        data = self.buffer
-        self.buffer = b''
+        data = bytes(self.buffer)
+        self.buffer = bytearray()
         return data
 
     def close(self):
@@ -98,7 +124,8 @@ class Stream(object):
 
         socket = self.socket
         self.socket = None
-        self.buffer = b''
+        self.buffer = bytearray()
+        self._read_into = self._recv_into
 
         socket.close()
 
@@ -113,7 +140,7 @@ class Stream(object):
         self.ensure_connection()
 
         try:
-            self.socket = SSLSocket(
+            self.socket = self.backend.wrap_ssl(
                 self.socket,
                 keyfile=keyfile,
                 certfile=certfile,
@@ -131,8 +158,10 @@ class Stream(object):
         self.ensure_connection()
         self.socket = SnappySocket(self.socket)
         self.socket.bootstrap(self.consume_buffer())
+        self._read_into = self.socket.read_into
 
     def upgrade_to_defalte(self, level):
         self.ensure_connection()
         self.socket = DefalteSocket(self.socket, level)
         self.socket.bootstrap(self.consume_buffer())
+        self._read_into = self.socket.read_into
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""gnsq.testing
+
+Pure python fake nsqd and nsqlookupd servers for hermetic tests and
+benchmarks, with latency, throughput and fault injection. Each server runs on
+a gevent hub in a background thread, so gevent, threaded and asyncio clients
+can all use it from the same process. Run ``python -m gnsq.testing`` to serve
+them from a separate process instead.
+"""
+from __future__ import absolute_import
+
+from .faults import Faults
+from .lookupd import FakeLookupd
+from .nsqd import FakeNsqd
+
+__all__ = [
+    'Faults',
+    'FakeLookupd',
+    'FakeNsqd',
+]
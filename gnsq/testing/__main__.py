@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Serve a fake nsqd (and optionally nsqlookupd) until interrupted.
+
+The listening addresses are printed in the same format as nsqd logs them::
+
+    TCP: listening on 127.0.0.1:4150
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import sys
+import time
+
+from . import Faults, FakeLookupd, FakeNsqd
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m gnsq.testing')
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--tcp-port', type=int, default=0)
+    parser.add_argument('--http-port', type=int, default=0)
+    parser.add_argument('--lookupd-http-port', type=int, default=None,
+                        help='also serve a fake nsqlookupd on this port')
+    parser.add_argument('--msg-timeout', type=float, default=60)
+    parser.add_argument('--throughput', type=float, default=None,
+                        help='maximum messages delivered per second')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--disconnect-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    faults = Faults(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        disconnect_rate=args.disconnect_rate,
+        seed=args.seed,
+    )
+
+    lookupd = None
+    if args.lookupd_http_port is not None:
+        lookupd = FakeLookupd(args.address, args.lookupd_http_port).start()
+        print('LOOKUPD_HTTP: listening on', lookupd.http_address)
+
+    nsqd = FakeNsqd(
+        address=args.address,
+        tcp_port=args.tcp_port,
+        http_port=args.http_port,
+        lookupd=lookupd,
+        msg_timeout=args.msg_timeout,
+        throughput=args.throughput,
+        faults=faults,
+    ).start()
+
+    print('TCP: listening on', nsqd.tcp_address)
+    print('HTTP: listening on', nsqd.http_address)
+    sys.stdout.flush()
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        nsqd.stop()
+        if lookupd is not None:
+            lookupd.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import random
+
+import gevent
+
+
+class Faults(object):
+    """Latency and fault injection settings for the fake servers.
+
+    All randomness comes from a private :class:`random.Random` so a run can be
+    reproduced by passing the same ``seed``.
+
+    :param latency: seconds to wait before handling each command or request
+
+    :param jitter: maximum number of random extra seconds added to ``latency``
+
+    :param error_rate: probability (``0`` to ``1``) that a publish or http
+        request fails with an error response
+
+    :param disconnect_rate: probability that a tcp connection is dropped after
+        handling a command
+
+    :param seed: seed for the random number generator
+    """
+    def __init__(self, latency=0, jitter=0, error_rate=0, disconnect_rate=0,
+                 seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.disconnect_rate = disconnect_rate
+        self.random = random.Random(seed)
+
+    def delay(self):
+        """Return the number of seconds to wait before the next response."""
+        if not self.jitter:
+            return self.latency
+        return self.latency + self.jitter * self.random.random()
+
+    def sleep(self):
+        seconds = self.delay()
+        if seconds > 0:
+            gevent.sleep(seconds)
+
+    def _chance(self, rate):
+        return rate > 0 and self.random.random() < rate
+
+    def should_fail(self):
+        return self._chance(self.error_rate)
+
+    def should_disconnect(self):
+        return self._chance(self.disconnect_rate)
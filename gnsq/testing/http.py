@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import json
+
+from gevent.pywsgi import WSGIServer
+from six.moves.urllib.parse import parse_qs
+
+from .server import ServerThread
+
+STATUS_TEXT = {
+    200: '200 OK',
+    400: '400 Bad Request',
+    404: '404 Not Found',
+    405: '405 Method Not Allowed',
+    500: '500 Internal Server Error',
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request(object):
+    def __init__(self, environ):
+        self.method = environ['REQUEST_METHOD']
+        self.path = environ.get('PATH_INFO', '/')
+        self.query = parse_qs(environ.get('QUERY_STRING', ''))
+
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        self.body = environ['wsgi.input'].read(length) if length else b''
+
+    def arg(self, name, default=None):
+        try:
+            return self.query[name][0]
+        except (KeyError, IndexError):
+            return default
+
+    def require(self, name):
+        value = self.arg(name)
+        if value is None:
+            raise HTTPError(400, 'MISSING_ARG_{}'.format(name.upper()))
+        return value
+
+
+class FakeHTTPServer(object):
+    """Minimal json http api served with :mod:`gevent.pywsgi`.
+
+    The server runs on its own :class:`~gnsq.testing.server.ServerThread`.
+    Subclasses fill ``routes`` with ``path: method_name`` pairs. Handlers take
+    a :class:`Request` and return the response data: ``bytes`` are sent as
+    text, anything else is encoded as json.
+    """
+    routes = {}
+
+    def __init__(self, address, http_port, faults):
+        self.address = address
+        self.faults = faults
+        self.http_server = None
+        self.server_thread = None
+        self._http_port = http_port
+
+    @property
+    def http_port(self):
+        return self.http_server.server_port
+
+    @property
+    def http_address(self):
+        return '%s:%d' % (self.address, self.http_port)
+
+    def start(self):
+        self.server_thread = ServerThread(type(self).__name__).start()
+        self.call(self._start)
+        return self
+
+    def stop(self):
+        self.call(self._stop)
+        self.server_thread.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def call(self, func, *args):
+        """Run ``func`` on the server thread and return the result."""
+        return self.server_thread.call(func, *args)
+
+    def _start(self):
+        self.http_server = WSGIServer(
+            (self.address, self._http_port), self._application, log=None)
+        self.http_server.start()
+
+    def _stop(self):
+        self.http_server.stop()
+
+    def _dispatch(self, request):
+        try:
+            handler = getattr(self, self.routes[request.path])
+        except KeyError:
+            raise HTTPError(404, 'NOT_FOUND')
+
+        if self.faults.should_fail():
+            raise HTTPError(500, 'INTERNAL_ERROR')
+
+        return handler(request)
+
+    def _application(self, environ, start_response):
+        self.faults.sleep()
+
+        try:
+            status, data = 200, self._dispatch(Request(environ))
+        except HTTPError as error:
+            status, data = error.status, {'message': error.message}
+
+        if isinstance(data, bytes):
+            content_type = 'text/plain; charset=utf-8'
+        else:
+            content_type = 'application/json; charset=utf-8'
+            data = json.dumps(data).encode('utf-8')
+
+        start_response(STATUS_TEXT[status], [
+            ('Content-Type', content_type),
+            ('Content-Length', str(len(data))),
+        ])
+        return [data]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from collections import defaultdict
+
+from .faults import Faults
+from .http import FakeHTTPServer, HTTPError
+
+
+class FakeLookupd(FakeHTTPServer):
+    """In-process nsqlookupd serving the http lookup api.
+
+    :class:`FakeNsqd` instances created with ``lookupd=`` register their topics
+    and channels here directly, there is no lookupd tcp protocol.
+
+    Example usage::
+
+        with FakeLookupd() as lookupd, FakeNsqd(lookupd=lookupd) as nsqd:
+            consumer = Consumer('topic', 'channel',
+                                lookupd_http_addresses=lookupd.http_address)
+
+    :param address: the address to listen on
+
+    :param http_port: the http port (defaults to a random free port)
+
+    :param faults: a :class:`~gnsq.testing.Faults` applied to every request
+    """
+    routes = {
+        '/ping': 'ping',
+        '/info': 'info',
+        '/lookup': 'lookup',
+        '/topics': 'topics',
+        '/channels': 'channels',
+        '/nodes': 'nodes',
+        '/topic/create': 'create_topic',
+        '/topic/delete': 'delete_topic',
+        '/channel/create': 'create_channel',
+        '/channel/delete': 'delete_channel',
+        '/topic/tombstone': 'tombstone_topic',
+    }
+
+    def __init__(self, address='127.0.0.1', http_port=0, faults=None):
+        super(FakeLookupd, self).__init__(
+            address, http_port, faults or Faults())
+        self._topics = defaultdict(set)
+        self._producers = {}
+        self._registrations = defaultdict(set)
+        self._tombstones = defaultdict(set)
+
+    def register(self, producer, topic, channel=None):
+        """Register ``topic`` (and optionally ``channel``) for a producer.
+
+        ``producer`` is the nsqd info dict as returned by ``/nodes``.
+        """
+        key = self._producer_key(producer)
+        self._producers[key] = producer
+        self._registrations[key].add(topic)
+        self._topics[topic]
+
+        if channel is not None:
+            self._topics[topic].add(channel)
+
+    def unregister(self, producer, topic=None):
+        """Remove a producer from ``topic``, or from every topic."""
+        key = self._producer_key(producer)
+        if topic is None:
+            self._registrations.pop(key, None)
+            self._producers.pop(key, None)
+        else:
+            self._registrations[key].discard(topic)
+
+    def _producer_key(self, producer):
+        return producer['broadcast_address'], producer['tcp_port']
+
+    def _topic_producers(self, topic):
+        return [
+            self._producers[key]
+            for key, topics in sorted(self._registrations.items())
+            if topic in topics and topic not in self._tombstones[key]
+        ]
+
+    def ping(self, request):
+        return b'OK'
+
+    def info(self, request):
+        return {'version': '1.0.0-compat'}
+
+    def lookup(self, request):
+        topic = request.require('topic')
+        if topic not in self._topics:
+            raise HTTPError(404, 'TOPIC_NOT_FOUND')
+
+        return {
+            'channels': sorted(self._topics[topic]),
+            'producers': self._topic_producers(topic),
+        }
+
+    def topics(self, request):
+        return {'topics': sorted(self._topics)}
+
+    def channels(self, request):
+        topic = request.require('topic')
+        return {'channels': sorted(self._topics.get(topic, ()))}
+
+    def nodes(self, request):
+        producers = []
+        for key, producer in sorted(self._producers.items()):
+            topics = sorted(self._registrations[key])
+            node = dict(producer, topics=topics, tombstones=[
+                topic in self._tombstones[key] for topic in topics])
+            producers.append(node)
+        return {'producers': producers}
+
+    def create_topic(self, request):
+        self._topics[request.require('topic')]
+        return b''
+
+    def delete_topic(self, request):
+        topic = request.require('topic')
+        self._topics.pop(topic, None)
+        for topics in self._registrations.values():
+            topics.discard(topic)
+        return b''
+
+    def create_channel(self, request):
+        topic = request.require('topic')
+        self._topics[topic].add(request.require('channel'))
+        return b''
+
+    def delete_channel(self, request):
+        topic = request.require('topic')
+        self._topics[topic].discard(request.require('channel'))
+        return b''
+
+    def tombstone_topic(self, request):
+        topic = request.require('topic')
+        node = request.require('node')
+
+        for key, producer in self._producers.items():
+            address = producer['broadcast_address'], producer['http_port']
+            if '%s:%d' % address == node:
+                self._tombstones[key].add(topic)
+                return b''
+
+        raise HTTPError(404, 'PRODUCER_NOT_FOUND')
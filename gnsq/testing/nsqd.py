@@ -0,0 +1,909 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division
+
+import json
+import socket
+import struct
+import time
+
+from collections import deque
+from itertools import count
+
+import gevent
+import six
+
+from gevent.event import Event
+from gevent.lock import Semaphore
+from gevent.server import StreamServer
+
+from .. import protocol as nsq
+from ..stream.defalte import DefalteSocket
+from .faults import Faults
+from .http import FakeHTTPServer, HTTPError
+
+try:
+    from ..stream.snappy import SnappySocket
+except ImportError:
+    SnappySocket = None  # pyflakes.ignore
+
+VERSION = '1.0.0-compat'
+CLOSE_WAIT = b'CLOSE_WAIT'
+
+FRAME_HEADER = struct.Struct('>ll')
+MESSAGE_HEADER = struct.Struct('>qh')
+
+
+def pack_frame(frame_type, data):
+    return FRAME_HEADER.pack(len(data) + 4, frame_type) + data
+
+
+class ProtocolError(Exception):
+    """An error frame sent to the client, closing the connection if fatal."""
+
+    def __init__(self, code, description='', fatal=True):
+        super(ProtocolError, self).__init__(code, description)
+        self.code = code
+        self.description = description
+        self.fatal = fatal
+
+    @property
+    def data(self):
+        if not self.description:
+            return self.code
+        return self.code + b' ' + six.b(self.description)
+
+
+class FakeMessage(object):
+    __slots__ = ('id', 'body', 'timestamp', 'attempts', 'client', 'deadline')
+
+    def __init__(self, id, body, timestamp=None):
+        self.id = id
+        self.body = body
+        self.timestamp = timestamp or int(time.time() * 1e9)
+        self.attempts = 0
+        self.client = None
+        self.deadline = None
+
+    def copy(self):
+        return FakeMessage(self.id, self.body, self.timestamp)
+
+    def pack(self):
+        header = MESSAGE_HEADER.pack(self.timestamp, self.attempts)
+        return header + self.id + self.body
+
+
+class Channel(object):
+    """Queue, in flight and deferred bookkeeping for a single channel.
+
+    One greenlet delivers messages round robin to the subscribed clients that
+    have spare RDY capacity and another requeues messages whose timeout
+    expired.
+    """
+
+    def __init__(self, nsqd, topic, name):
+        self.nsqd = nsqd
+        self.topic = topic
+        self.name = name
+
+        self.queue = deque()
+        self.in_flight = {}
+        self.clients = deque()
+        self.deferred_count = 0
+
+        self.message_count = 0
+        self.finish_count = 0
+        self.requeue_count = 0
+        self.timeout_count = 0
+
+        self._wakeup = Event()
+        self._workers = [
+            gevent.spawn(self._deliver_loop),
+            gevent.spawn(self._timeout_loop),
+        ]
+
+    def close(self):
+        gevent.killall(self._workers)
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    def put(self, message):
+        self.queue.append(message)
+        self.wakeup()
+
+    def defer(self, message, delay):
+        self.deferred_count += 1
+        gevent.spawn_later(delay, self._undefer, message)
+
+    def _undefer(self, message):
+        self.deferred_count -= 1
+        self.put(message)
+
+    def add_client(self, client):
+        self.clients.append(client)
+        self.wakeup()
+
+    def remove_client(self, client):
+        try:
+            self.clients.remove(client)
+        except ValueError:
+            pass
+
+        for message in list(self.in_flight.values()):
+            if message.client is client:
+                self._pop_in_flight(message.id)
+                self.put(message)
+
+    def empty(self):
+        self.queue.clear()
+
+    def _next_client(self):
+        for _ in range(len(self.clients)):
+            client = self.clients[0]
+            self.clients.rotate(-1)
+            if client.can_receive():
+                return client
+        return None
+
+    def _deliver_loop(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self.queue:
+                client = self._next_client()
+                if client is None:
+                    break
+
+                self.nsqd.pace()
+                if not client.can_receive():
+                    continue
+
+                message = self.queue.popleft()
+                message.attempts += 1
+                message.client = client
+                message.deadline = time.time() + client.msg_timeout
+
+                self.in_flight[message.id] = message
+                self.message_count += 1
+                client.in_flight += 1
+                client.send_message(message)
+
+    def _timeout_loop(self):
+        while True:
+            gevent.sleep(self.nsqd.timeout_check_interval)
+
+            now = time.time()
+            for message in list(self.in_flight.values()):
+                if message.deadline > now:
+                    continue
+
+                self._pop_in_flight(message.id)
+                self.timeout_count += 1
+                self.put(message)
+
+    def _pop_in_flight(self, message_id):
+        message = self.in_flight.pop(message_id)
+        message.client.in_flight -= 1
+        message.client = None
+        return message
+
+    def _get_in_flight(self, client, message_id, code):
+        message = self.in_flight.get(message_id)
+        if message is None or message.client is not client:
+            raise ProtocolError(code, '%s %s' % (
+                code.decode('ascii'), message_id.decode('ascii')), False)
+        return message
+
+    def finish(self, client, message_id):
+        self._get_in_flight(client, message_id, b'E_FIN_FAILED')
+        self._pop_in_flight(message_id)
+        self.finish_count += 1
+        self.wakeup()
+
+    def requeue(self, client, message_id, delay):
+        self._get_in_flight(client, message_id, b'E_REQ_FAILED')
+        message = self._pop_in_flight(message_id)
+        self.requeue_count += 1
+
+        if delay > 0:
+            self.defer(message, delay)
+        else:
+            self.put(message)
+
+    def touch(self, client, message_id):
+        message = self._get_in_flight(client, message_id, b'E_TOUCH_FAILED')
+        message.deadline = time.time() + client.msg_timeout
+
+    def stats(self):
+        return {
+            'channel_name': self.name,
+            'depth': len(self.queue),
+            'in_flight_count': len(self.in_flight),
+            'deferred_count': self.deferred_count,
+            'message_count': self.message_count,
+            'requeue_count': self.requeue_count,
+            'timeout_count': self.timeout_count,
+            'clients': [client.stats() for client in self.clients],
+            'paused': False,
+        }
+
+
+class Topic(object):
+    """A topic copies each message to every channel.
+
+    Like nsqd, messages published before the first channel exists are kept and
+    handed to that channel once it is created.
+    """
+
+    def __init__(self, nsqd, name):
+        self.nsqd = nsqd
+        self.name = name
+        self.channels = {}
+        self.backlog = deque()
+        self.message_count = 0
+
+    def close(self):
+        for channel in self.channels.values():
+            channel.close()
+
+    def get_channel(self, name):
+        if name in self.channels:
+            return self.channels[name]
+
+        channel = self.channels[name] = Channel(self.nsqd, self, name)
+        self.nsqd.register(self.name, name)
+
+        while self.backlog:
+            channel.put(self.backlog.popleft())
+
+        return channel
+
+    def delete_channel(self, name):
+        channel = self.channels.pop(name, None)
+        if channel is not None:
+            channel.close()
+
+    def put(self, body, delay=0):
+        self.message_count += 1
+        message = FakeMessage(self.nsqd.next_message_id(), body)
+
+        if not self.channels:
+            self.backlog.append(message)
+            return
+
+        for channel in self.channels.values():
+            if delay > 0:
+                channel.defer(message.copy(), delay)
+            else:
+                channel.put(message.copy())
+
+    def empty(self):
+        self.backlog.clear()
+        for channel in self.channels.values():
+            channel.empty()
+
+    def stats(self):
+        return {
+            'topic_name': self.name,
+            'depth': len(self.backlog),
+            'message_count': self.message_count,
+            'channels': [c.stats() for c in self.channels.values()],
+            'paused': False,
+        }
+
+
+class FakeClient(object):
+    """Server side of a single V2 protocol connection."""
+    read_size = 64 * 1024
+
+    def __init__(self, nsqd, sock, address):
+        self.nsqd = nsqd
+        self.socket = sock
+        self.remote_address = '%s:%d' % address[:2]
+
+        self.client_id = ''
+        self.hostname = ''
+        self.user_agent = ''
+        self.snappy = False
+        self.deflate = False
+        self.heartbeat_interval = nsqd.heartbeat_interval
+        self.msg_timeout = nsqd.msg_timeout
+
+        self.channel = None
+        self.ready_count = 0
+        self.in_flight = 0
+        self.closing = False
+        self.connected = True
+        self.last_received = time.time()
+
+        self._buffer = bytearray()
+        self._lock = Semaphore()
+        self._heartbeat = None
+
+    def can_receive(self):
+        return (
+            self.connected and
+            not self.closing and
+            self.in_flight < self.ready_count
+        )
+
+    def _fill(self):
+        data = self.socket.recv(self.read_size)
+        if not data:
+            raise EOFError
+        self._buffer.extend(data)
+        self.last_received = time.time()
+
+    def read(self, size):
+        while len(self._buffer) < size:
+            self._fill()
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def read_line(self):
+        while True:
+            index = self._buffer.find(b'\n')
+            if index >= 0:
+                return self.read(index + 1)[:-1]
+            self._fill()
+
+    def read_body(self):
+        size = nsq.unpack_size(self.read(4))
+        if size > self.nsqd.max_body_size:
+            raise ProtocolError(b'E_BAD_BODY', 'body too big %d' % size)
+        return self.read(size)
+
+    def send(self, frame_type, data):
+        frame = pack_frame(frame_type, data)
+        with self._lock:
+            try:
+                self.socket.sendall(frame)
+            except socket.error:
+                self.close()
+
+    def send_response(self, data):
+        self.send(nsq.FRAME_TYPE_RESPONSE, data)
+
+    def send_message(self, message):
+        self.send(nsq.FRAME_TYPE_MESSAGE, message.pack())
+
+    def close(self):
+        if not self.connected:
+            return
+
+        self.connected = False
+        if self.channel is not None:
+            self.channel.remove_client(self)
+
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+
+    def _restart_heartbeat(self):
+        if self._heartbeat is not None:
+            self._heartbeat.kill(block=False)
+        self._heartbeat = gevent.spawn(self._heartbeat_loop)
+
+    def run(self):
+        self._restart_heartbeat()
+
+        try:
+            if self.read(4) != nsq.MAGIC_V2:
+                raise ProtocolError(b'E_BAD_PROTOCOL')
+
+            while self.connected:
+                self.handle_command(self.read_line())
+
+                if self.nsqd.faults.should_disconnect():
+                    break
+
+        except ProtocolError as error:
+            self.send(nsq.FRAME_TYPE_ERROR, error.data)
+
+        except (EOFError, socket.error):
+            pass
+
+        finally:
+            self._heartbeat.kill(block=False)
+            self.close()
+
+    def handle_command(self, line):
+        params = line.split(b' ')
+        name = 'cmd_' + params[0].decode('ascii', 'replace').lower()
+        handler = getattr(self, name, None)
+        if handler is None:
+            raise ProtocolError(
+                b'E_INVALID', 'invalid command %r' % params[0])
+
+        self.nsqd.faults.sleep()
+
+        try:
+            handler(*params[1:])
+        except TypeError:
+            raise ProtocolError(
+                b'E_INVALID', 'wrong number of params for %r' % params[0])
+        except ProtocolError as error:
+            if error.fatal:
+                raise
+            self.send(nsq.FRAME_TYPE_ERROR, error.data)
+
+    def _heartbeat_loop(self):
+        while self.heartbeat_interval > 0:
+            gevent.sleep(self.heartbeat_interval)
+
+            # nsqd drops clients that do not answer two heartbeats
+            if time.time() - self.last_received > 2 * self.heartbeat_interval:
+                self.close()
+                return
+
+            self.send_response(nsq.HEARTBEAT)
+
+    def _negotiate(self, options):
+        self.client_id = options.get('client_id', '')
+        self.hostname = options.get('hostname', '')
+        self.user_agent = options.get('user_agent', '')
+
+        heartbeat_interval = options.get('heartbeat_interval', 0)
+        if heartbeat_interval == -1:
+            self.heartbeat_interval = 0
+        elif heartbeat_interval:
+            self.heartbeat_interval = heartbeat_interval / 1000
+
+        msg_timeout = options.get('msg_timeout', 0)
+        if msg_timeout:
+            self.msg_timeout = msg_timeout / 1000
+
+        self.snappy = bool(options.get('snappy') and SnappySocket)
+        self.deflate = bool(options.get('deflate') and not self.snappy)
+        deflate_level = min(options.get('deflate_level', 6), 9)
+
+        return {
+            'max_rdy_count': self.nsqd.max_rdy_count,
+            'version': VERSION,
+            'max_msg_timeout': int(self.nsqd.max_msg_timeout * 1000),
+            'msg_timeout': int(self.msg_timeout * 1000),
+            'tls_v1': False,
+            'deflate': self.deflate,
+            'deflate_level': deflate_level,
+            'max_deflate_level': 9,
+            'snappy': self.snappy,
+            'sample_rate': 0,
+            'auth_required': self.nsqd.auth_secret is not None,
+            'output_buffer_size': options.get('output_buffer_size', 16384),
+            'output_buffer_timeout': options.get('output_buffer_timeout', 250),
+        }
+
+    def cmd_identify(self):
+        try:
+            options = json.loads(self.read_body().decode('utf-8'))
+        except ValueError:
+            raise ProtocolError(b'E_BAD_BODY', 'failed to decode JSON body')
+
+        response = self._negotiate(options)
+        self._restart_heartbeat()
+        if not options.get('feature_negotiation'):
+            self.send_response(nsq.OK)
+            return
+
+        self.send_response(six.b(json.dumps(response)))
+
+        if self.snappy:
+            self.socket = SnappySocket(self.socket)
+            self.send_response(nsq.OK)
+
+        elif self.deflate:
+            self.socket = DefalteSocket(self.socket, response['deflate_level'])
+            self.send_response(nsq.OK)
+
+    def cmd_auth(self):
+        secret = self.read_body()
+
+        if self.nsqd.auth_secret is None:
+            raise ProtocolError(b'E_AUTH_DISABLED', 'AUTH disabled')
+
+        if secret != self.nsqd.auth_secret:
+            raise ProtocolError(b'E_AUTH_FAILED', 'AUTH failed')
+
+        self.send_response(six.b(json.dumps({
+            'identity': self.client_id,
+            'identity_url': '',
+            'permission_count': 1,
+        })))
+
+    def cmd_sub(self, topic, channel):
+        if self.channel is not None:
+            raise ProtocolError(b'E_INVALID', 'cannot SUB twice')
+
+        topic, channel = topic.decode('utf-8'), channel.decode('utf-8')
+        if not nsq.valid_topic_name(topic):
+            raise ProtocolError(b'E_BAD_TOPIC', 'invalid topic name')
+
+        if not nsq.valid_channel_name(channel):
+            raise ProtocolError(b'E_BAD_CHANNEL', 'invalid channel name')
+
+        self.channel = self.nsqd.get_topic(topic).get_channel(channel)
+        self.channel.add_client(self)
+        self.send_response(nsq.OK)
+
+    def _get_channel(self, command):
+        if self.channel is None:
+            raise ProtocolError(
+                b'E_INVALID', 'cannot %s in current state' % command)
+        return self.channel
+
+    def cmd_rdy(self, count):
+        count = int(count)
+        if not 0 <= count <= self.nsqd.max_rdy_count:
+            raise ProtocolError(b'E_INVALID', 'RDY count %d out of range' % (
+                count))
+
+        self.ready_count = count
+        self._get_channel('RDY').wakeup()
+
+    def cmd_fin(self, message_id):
+        self._get_channel('FIN').finish(self, message_id)
+
+    def cmd_req(self, message_id, timeout):
+        delay = min(int(timeout) / 1000, self.nsqd.max_msg_timeout)
+        self._get_channel('REQ').requeue(self, message_id, delay)
+
+    def cmd_touch(self, message_id):
+        self._get_channel('TOUCH').touch(self, message_id)
+
+    def cmd_cls(self):
+        self._get_channel('CLS')
+        self.closing = True
+        self.send_response(CLOSE_WAIT)
+
+    def cmd_nop(self):
+        pass
+
+    def _get_topic(self, topic):
+        topic = topic.decode('utf-8')
+        if not nsq.valid_topic_name(topic):
+            raise ProtocolError(b'E_BAD_TOPIC', 'invalid topic name')
+        return self.nsqd.get_topic(topic)
+
+    def cmd_pub(self, topic):
+        topic = self._get_topic(topic)
+        body = self.read_body()
+
+        if self.nsqd.faults.should_fail():
+            raise ProtocolError(b'E_PUB_FAILED', 'PUB failed')
+
+        topic.put(body)
+        self.send_response(nsq.OK)
+
+    def cmd_mpub(self, topic):
+        topic = self._get_topic(topic)
+        messages = unpack_multipublish(self.read_body())
+
+        if self.nsqd.faults.should_fail():
+            raise ProtocolError(b'E_MPUB_FAILED', 'MPUB failed')
+
+        for body in messages:
+            topic.put(body)
+        self.send_response(nsq.OK)
+
+    def cmd_dpub(self, topic, delay_ms):
+        topic = self._get_topic(topic)
+        body = self.read_body()
+        delay = int(delay_ms) / 1000
+
+        if not 0 <= delay <= self.nsqd.max_msg_timeout:
+            raise ProtocolError(b'E_INVALID', 'DPUB timeout out of range')
+
+        if self.nsqd.faults.should_fail():
+            raise ProtocolError(b'E_DPUB_FAILED', 'DPUB failed')
+
+        topic.put(body, delay)
+        self.send_response(nsq.OK)
+
+    def stats(self):
+        return {
+            'client_id': self.client_id,
+            'hostname': self.hostname,
+            'user_agent': self.user_agent,
+            'remote_address': self.remote_address,
+            'ready_count': self.ready_count,
+            'in_flight_count': self.in_flight,
+            'snappy': self.snappy,
+            'deflate': self.deflate,
+        }
+
+
+def unpack_multipublish(body):
+    try:
+        num_messages = nsq.unpack_size(body[:4])
+        messages, offset = [], 4
+
+        for _ in range(num_messages):
+            size = nsq.unpack_size(body[offset:offset + 4])
+            offset += 4
+            messages.append(body[offset:offset + size])
+            offset += size
+
+    except struct.error:
+        raise ProtocolError(b'E_BAD_BODY', 'invalid MPUB body')
+
+    if offset != len(body) or not messages:
+        raise ProtocolError(b'E_BAD_BODY', 'invalid MPUB body')
+
+    return messages
+
+
+class FakeNsqd(FakeHTTPServer):
+    """In-process nsqd speaking the V2 tcp protocol and the http api.
+
+    Supports IDENTIFY feature negotiation (snappy, deflate, heartbeats and
+    message timeouts), AUTH, SUB, RDY, FIN, REQ, TOUCH, CLS, NOP, PUB, MPUB and
+    DPUB. Messages are kept in memory. TLS is never negotiated.
+
+    Example usage::
+
+        with FakeNsqd(latency=0.001) as nsqd:
+            producer = Producer(nsqd.tcp_address)
+
+    :param address: the address to listen on
+
+    :param tcp_port: the tcp port (defaults to a random free port)
+
+    :param http_port: the http port (defaults to a random free port)
+
+    :param lookupd: a :class:`~gnsq.testing.FakeLookupd` to register topics
+        and channels with
+
+    :param msg_timeout: default seconds before an in flight message is
+        requeued
+
+    :param max_msg_timeout: maximum ``msg_timeout``, requeue and defer delay
+        in seconds
+
+    :param heartbeat_interval: default seconds between heartbeats
+
+    :param max_rdy_count: the maximum RDY count a client may send
+
+    :param throughput: the maximum number of messages delivered per second,
+        across all channels (unlimited by default)
+
+    :param auth_secret: if set, clients must AUTH with this secret
+
+    :param faults: a :class:`~gnsq.testing.Faults` for latency and fault
+        injection. Alternatively pass its arguments (``latency``,
+        ``error_rate``, ...) as keyword arguments
+    """
+    routes = {
+        '/ping': 'ping',
+        '/info': 'http_info',
+        '/stats': 'http_stats',
+        '/pub': 'http_publish',
+        '/mpub': 'http_multipublish',
+        '/topic/create': 'http_create_topic',
+        '/topic/delete': 'http_delete_topic',
+        '/topic/empty': 'http_empty_topic',
+        '/channel/create': 'http_create_channel',
+        '/channel/delete': 'http_delete_channel',
+        '/channel/empty': 'http_empty_channel',
+    }
+
+    max_body_size = 5 * 1024 * 1024
+    timeout_check_interval = 0.1
+
+    def __init__(self, address='127.0.0.1', tcp_port=0, http_port=0,
+                 lookupd=None, msg_timeout=60, max_msg_timeout=900,
+                 heartbeat_interval=30, max_rdy_count=2500, throughput=None,
+                 auth_secret=None, faults=None, **kwargs):
+        super(FakeNsqd, self).__init__(
+            address, http_port, faults or Faults(**kwargs))
+
+        self.lookupd = lookupd
+        self.msg_timeout = msg_timeout
+        self.max_msg_timeout = max_msg_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.max_rdy_count = max_rdy_count
+        self.throughput = throughput
+        self.auth_secret = auth_secret
+        self.start_time = int(time.time())
+
+        self.topics = {}
+        self.clients = set()
+
+        self.tcp_server = None
+        self._tcp_port = tcp_port
+        self._message_ids = count(1)
+        self._next_delivery = 0
+
+    @property
+    def tcp_port(self):
+        return self.tcp_server.server_port
+
+    @property
+    def tcp_address(self):
+        return '%s:%d' % (self.address, self.tcp_port)
+
+    @property
+    def node_info(self):
+        """The producer description reported to lookupd."""
+        return {
+            'version': VERSION,
+            'broadcast_address': self.address,
+            'hostname': self.address,
+            'remote_address': self.address,
+            'tcp_port': self.tcp_port,
+            'http_port': self.http_port,
+            'start_time': self.start_time,
+        }
+
+    def _start(self):
+        self.tcp_server = StreamServer(
+            (self.address, self._tcp_port), self._handle)
+        self.tcp_server.start()
+        super(FakeNsqd, self)._start()
+
+    def _stop(self):
+        self.tcp_server.stop()
+        super(FakeNsqd, self)._stop()
+        self._disconnect_all()
+
+        for topic in self.topics.values():
+            topic.close()
+
+        if self.lookupd is not None:
+            self.lookupd.unregister(self.node_info)
+
+    def _handle(self, sock, address):
+        client = FakeClient(self, sock, address)
+        self.clients.add(client)
+        try:
+            client.run()
+        finally:
+            self.clients.discard(client)
+
+    def disconnect_all(self):
+        """Drop every client connection, simulating an nsqd restart."""
+        self.call(self._disconnect_all)
+
+    def _disconnect_all(self):
+        for client in list(self.clients):
+            client.close()
+
+    def next_message_id(self):
+        return six.b('%016x' % next(self._message_ids))
+
+    def pace(self):
+        """Sleep as needed to keep deliveries under ``throughput``."""
+        if not self.throughput:
+            return
+
+        now = time.time()
+        if self._next_delivery > now:
+            gevent.sleep(self._next_delivery - now)
+
+        self._next_delivery = max(now, self._next_delivery)
+        self._next_delivery += 1 / self.throughput
+
+    def register(self, topic, channel=None):
+        if self.lookupd is not None:
+            self.lookupd.register(self.node_info, topic, channel)
+
+    def get_topic(self, name):
+        if name not in self.topics:
+            self.topics[name] = Topic(self, name)
+            self.register(name)
+        return self.topics[name]
+
+    def publish(self, topic, body, delay=0):
+        """Publish a message directly, bypassing the network."""
+        self.call(self._publish, topic, body, delay)
+
+    def _publish(self, topic, body, delay=0):
+        self.get_topic(topic).put(body, delay)
+
+    def create_channel(self, topic, channel):
+        """Create a channel so messages published afterwards are kept."""
+        self.call(self._create_channel, topic, channel)
+
+    def _create_channel(self, topic, channel):
+        self.get_topic(topic).get_channel(channel)
+
+    def stats(self):
+        """Return the same statistics as ``/stats?format=json``."""
+        return self.call(self._stats)
+
+    def _stats(self):
+        return {
+            'version': VERSION,
+            'health': 'OK',
+            'start_time': self.start_time,
+            'topics': [t.stats() for t in self.topics.values()],
+        }
+
+    def _require_topic(self, request):
+        topic = request.require('topic')
+        if not nsq.valid_topic_name(topic):
+            raise HTTPError(400, 'INVALID_TOPIC')
+        return topic
+
+    def _existing_topic(self, request):
+        try:
+            return self.topics[self._require_topic(request)]
+        except KeyError:
+            raise HTTPError(404, 'TOPIC_NOT_FOUND')
+
+    def ping(self, request):
+        return b'OK'
+
+    def http_info(self, request):
+        return self.node_info
+
+    def http_stats(self, request):
+        if request.arg('format') != 'json':
+            return six.b(json.dumps(self._stats(), indent=2))
+        return self._stats()
+
+    def http_publish(self, request):
+        topic = self._require_topic(request)
+        delay = int(request.arg('defer', 0)) / 1000
+        self._publish(topic, request.body, delay)
+        return b'OK'
+
+    def http_multipublish(self, request):
+        topic = self._require_topic(request)
+
+        if request.arg('binary') == 'true':
+            try:
+                messages = unpack_multipublish(request.body)
+            except ProtocolError:
+                raise HTTPError(400, 'INVALID_MESSAGE')
+        else:
+            messages = [m for m in request.body.split(b'\n') if m]
+
+        for body in messages:
+            self._publish(topic, body)
+        return b'OK'
+
+    def http_create_topic(self, request):
+        self.get_topic(self._require_topic(request))
+        return b''
+
+    def http_delete_topic(self, request):
+        topic = self._existing_topic(request)
+        topic.close()
+        del self.topics[topic.name]
+
+        if self.lookupd is not None:
+            self.lookupd.unregister(self.node_info, topic.name)
+        return b''
+
+    def http_empty_topic(self, request):
+        self._existing_topic(request).empty()
+        return b''
+
+    def _channel_name(self, request):
+        channel = request.require('channel')
+        if not nsq.valid_channel_name(channel):
+            raise HTTPError(400, 'INVALID_CHANNEL')
+        return channel
+
+    def http_create_channel(self, request):
+        self._create_channel(
+            self._require_topic(request), self._channel_name(request))
+        return b''
+
+    def http_delete_channel(self, request):
+        topic = self._existing_topic(request)
+        topic.delete_channel(self._channel_name(request))
+        return b''
+
+    def http_empty_channel(self, request):
+        topic = self._existing_topic(request)
+        try:
+            channel = topic.channels[self._channel_name(request)]
+        except KeyError:
+            raise HTTPError(404, 'CHANNEL_NOT_FOUND')
+
+        channel.empty()
+        return b''
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import sys
+import threading
+
+from collections import deque
+
+import gevent
+import six
+
+from gevent.event import Event
+
+
+class _Call(object):
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.value = None
+        self.exc_info = None
+        self.done = threading.Event()
+
+    def run(self):
+        try:
+            self.value = self.func(*self.args)
+        except Exception:
+            self.exc_info = sys.exc_info()
+        finally:
+            self.done.set()
+
+    def result(self):
+        self.done.wait()
+        if self.exc_info is not None:
+            six.reraise(*self.exc_info)
+        return self.value
+
+
+class ServerThread(object):
+    """A gevent hub running in its own native thread.
+
+    The fake servers live entirely on this hub, so clients in the calling
+    thread may block on plain sockets (threads, asyncio, urllib3 without
+    monkey patching) without stalling the server.
+    """
+
+    def __init__(self, name='gnsq.testing'):
+        self.thread = threading.Thread(target=self._run, name=name)
+        self.thread.daemon = True
+        self._calls = deque()
+        self._started = threading.Event()
+        self._wakeup = None
+        self._stopped = None
+
+    def start(self):
+        self.thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        self.call(self._stopped.set)
+        self.thread.join()
+
+    def _run(self):
+        hub = gevent.get_hub()
+        self._stopped = Event()
+        self._wakeup = hub.loop.async_()
+        self._wakeup.start(self._spawn_calls)
+        self._started.set()
+
+        try:
+            self._stopped.wait()
+        finally:
+            self._wakeup.close()
+
+    def _spawn_calls(self):
+        while self._calls:
+            gevent.spawn(self._calls.popleft().run)
+
+    def call(self, func, *args):
+        """Run ``func`` in a greenlet on the server hub and return its result.
+
+        Calls made from the server thread itself run inline.
+        """
+        if threading.current_thread() is self.thread:
+            return func(*args)
+
+        call = _Call(func, args)
+        self._calls.append(call)
+        self._wakeup.send()
+        return call.result()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division
+
+import logging
+import time
+
+
+class Timer(object):
+    __slots__ = ('tick', 'func', 'args', 'cancelled')
+
+    def __init__(self, tick, func, args):
+        self.tick = tick
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel(object):
+    """A hashed timer wheel for large numbers of coarse timers.
+
+    Scheduling and cancelling are constant time: a timer is appended to the
+    slot of the tick it expires on, and :meth:`advance` only visits the slots
+    of the ticks that passed. Timers fire up to one ``tick`` late.
+
+    The wheel does not run itself; the owner calls :meth:`advance`
+    periodically, usually every ``tick`` seconds from a single worker. An
+    exception raised by a timer is logged and the other timers still fire.
+
+    :param tick: the timer resolution in seconds
+
+    :param slots: the number of slots. Timers further away than
+        ``tick * slots`` wait in their slot for more than one turn
+
+    :param lock: a lock protecting the slots, needed when timers are
+        scheduled from several threads
+    """
+
+    def __init__(self, tick=0.5, slots=512, lock=None, clock=time.time):
+        self.logger = logging.getLogger(__name__)
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.lock = lock
+        self.clock = clock
+        self.current_tick = self._tick(clock())
+        self.pending = 0
+
+    def _tick(self, now):
+        return int(now / self.tick)
+
+    def schedule(self, delay, func, *args):
+        """Call ``func(*args)`` after ``delay`` seconds.
+
+        Returns a :class:`Timer` which can be cancelled.
+        """
+        tick = max(self._tick(self.clock() + delay), self.current_tick + 1)
+        timer = Timer(tick, func, args)
+
+        if self.lock is None:
+            self._add(timer)
+        else:
+            with self.lock:
+                self._add(timer)
+
+        return timer
+
+    def _add(self, timer):
+        self.slots[timer.tick % len(self.slots)].append(timer)
+        self.pending += 1
+
+    def _expire(self, now):
+        expired = []
+        target = self._tick(now)
+
+        # Every slot is visited once per turn, so more than a full turn of
+        # elapsed ticks needs no extra visits.
+        start = max(self.current_tick + 1, target - len(self.slots) + 1)
+
+        for tick in range(start, target + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+
+            remaining = []
+            for timer in slot:
+                if timer.tick <= target:
+                    expired.append(timer)
+                else:
+                    remaining.append(timer)
+
+            slot[:] = remaining
+
+        self.current_tick = max(self.current_tick, target)
+        self.pending -= len(expired)
+        return expired
+
+    def advance(self, now=None):
+        """Fire the timers that expired by ``now``.
+
+        Returns the number of timers fired.
+        """
+        if now is None:
+            now = self.clock()
+
+        if self.lock is None:
+            expired = self._expire(now)
+        else:
+            with self.lock:
+                expired = self._expire(now)
+
+        fired = 0
+        for timer in expired:
+            if timer.cancelled:
+                continue
+
+            try:
+                timer.func(*timer.args)
+            except Exception:
+                self.logger.exception('error in timer %r', timer.func)
+
+            fired += 1
+
+        return fired
+
+    def __len__(self):
+        return self.pending
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from . import protocol as nsq
+from .decorators import cached_property
+
+
+class TopicStats(object):
+    """Counters for the messages published through a :class:`Topic`.
+
+    ``requests`` counts publish calls, ``messages`` and ``bytes`` the messages
+    they carried and ``errors`` the calls that raised. With
+    ``raise_error=False`` on a :class:`~gnsq.Producer`, errors returned through
+    the result are not counted.
+    """
+    __slots__ = ('requests', 'messages', 'bytes', 'errors')
+
+    def __init__(self):
+        self.requests = 0
+        self.messages = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def record(self, messages, size):
+        self.requests += 1
+        self.messages += messages
+        self.bytes += size
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Topic(object):
+    """A handle for publishing to a single topic.
+
+    Returned by ``topic()`` on :class:`~gnsq.Producer`,
+    :class:`~gnsq.NsqdTCPClient` and :class:`~gnsq.NsqdHTTPClient`. The topic
+    name is validated once, and the tcp clients reuse the encoded command
+    prefixes for every message.
+
+    Keyword arguments are passed to the client, for example ``block`` or
+    ``raise_error`` on a :class:`~gnsq.Producer`.
+    """
+
+    def __init__(self, client, name):
+        self.client = client
+        self.encoder = nsq.TopicEncoder(name)
+        self.stats = TopicStats()
+
+    @property
+    def name(self):
+        return self.encoder.name
+
+    def _call(self, func, *args, **kwargs):
+        try:
+            return func(self.encoder, *args, **kwargs)
+        except Exception:
+            self.stats.errors += 1
+            raise
+
+    def publish(self, data, defer=None, **kwargs):
+        """Publish a message to the topic.
+
+        :param data: bytestring data to publish
+
+        :param defer: duration in milliseconds to defer before publishing
+            (requires nsq 0.3.6)
+        """
+        result = self._call(
+            self.client._publish_topic, data, defer, **kwargs)
+        self.stats.record(1, len(data))
+        return result
+
+    def defer(self, data, delay_ms, **kwargs):
+        """Publish a message delivered after ``delay_ms`` milliseconds."""
+        return self.publish(data, delay_ms, **kwargs)
+
+    def multipublish(self, messages, **kwargs):
+        """Publish an iterable of messages to the topic."""
+        messages = list(messages)
+        result = self._call(
+            self.client._multipublish_topic, messages, **kwargs)
+        self.stats.record(len(messages), sum(len(m) for m in messages))
+        return result
+
+    def __repr__(self):
+        return '<Topic {!r} client={}>'.format(self.name, self.client)
+
+
+class TopicMixin(object):
+    """Adds :meth:`topic` to a client.
+
+    The client implements ``_publish_topic(encoder, data, defer, **kwargs)``
+    and ``_multipublish_topic(encoder, messages, **kwargs)``, where
+    ``encoder`` is the handle's :class:`~gnsq.protocol.TopicEncoder`.
+    """
+
+    @cached_property
+    def _topics(self):
+        return {}
+
+    def topic(self, name):
+        """Return the :class:`~gnsq.topic.Topic` handle for ``name``.
+
+        Handles are cached, so their stats cover every publish made through
+        them.
+        """
+        try:
+            return self._topics[name]
+        except KeyError:
+            return self._topics.setdefault(name, Topic(self, name))
@@ -6,6 +6,19 @@ from setuptools import setup
 with open('README.rst') as readme_file:
     readme = readme_file.read()
 
+packages = [
+    'gnsq',
+    'gnsq.aio',
+    'gnsq.backends',
+    'gnsq.benchmarks',
+    'gnsq.contrib',
+    'gnsq.contrib.archive',
+    'gnsq.contrib.backfill',
+    'gnsq.contrib.deadletter',
+    'gnsq.stream',
+    'gnsq.testing',
+]
+
 
 setup(
     name='gnsq',
@@ -16,11 +29,7 @@ setup(
     author='Trevor Olson',
     author_email='trevor@heytrevor.com',
     url='https://github.com/wtolson/gnsq',
-    packages=[
-        'gnsq',
-        'gnsq.contrib',
-        'gnsq.stream',
-    ],
+    packages=packages,
     package_dir={'gnsq': 'gnsq'},
     include_package_data=True,
     install_requires=[
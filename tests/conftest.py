@@ -1,5 +1,12 @@
+import sys
+
 import pytest
 
+# Native coroutine syntax does not compile before python 3.5.
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('test_aio.py')
+
 
 def pytest_addoption(parser):
     parser.addoption(
@@ -1,6 +1,27 @@
+import struct
+
+import six
+
 from gevent.event import AsyncResult
 from gevent.server import StreamServer
 
+from gnsq import protocol as nsq
+
+
+def mock_response(frame_type, data):
+    body_size = 4 + len(data)
+    body_size_packed = struct.pack('>l', body_size)
+    frame_type_packed = struct.pack('>l', frame_type)
+    return body_size_packed + frame_type_packed + data
+
+
+def mock_response_message(timestamp, attempts, id, body):
+    timestamp_packed = struct.pack('>q', timestamp)
+    attempts_packed = struct.pack('>h', attempts)
+    id = six.b('%016d' % id)
+    data = timestamp_packed + attempts_packed + id + body
+    return mock_response(nsq.FRAME_TYPE_MESSAGE, data)
+
 
 class mock_server(object):
     def __init__(self, handler):
@@ -24,3 +45,43 @@ class mock_server(object):
         if exc_type is None:
             self.result.get()
         self.server.stop()
+
+
+class threaded_mock_server(object):
+    """Like :class:`mock_server` but served from a plain thread.
+
+    Used to test the threading backend, where blocking a real thread inside a
+    gevent server would deadlock.
+    """
+
+    def __init__(self, handler):
+        import socket
+        import threading
+
+        self.handler = handler
+        self.error = None
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.server_port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+
+    def _serve(self):
+        socket, address = self.server.accept()
+        try:
+            self.handler(socket, address)
+        except Exception as error:
+            self.error = error
+        finally:
+            socket.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.thread.join(5)
+        self.server.close()
+        if exc_type is None and self.error is not None:
+            raise self.error
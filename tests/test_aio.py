@@ -0,0 +1,128 @@
+import json
+import subprocess
+import sys
+
+import pytest
+import six
+
+asyncio = pytest.importorskip('asyncio')
+aio = pytest.importorskip('gnsq.aio')
+
+from gnsq import protocol as nsq  # noqa: E402
+from gnsq.errors import NSQRequeueMessage  # noqa: E402
+
+from mock_server import mock_response, mock_response_message  # noqa: E402
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(asyncio.wait_for(coro, 10))
+    finally:
+        loop.close()
+
+
+async def read_identify(reader, writer):
+    assert await reader.readexactly(4) == b'  V2'
+    assert await reader.readexactly(9) == b'IDENTIFY\n'
+    size = nsq.unpack_size(await reader.readexactly(4))
+    json.loads((await reader.readexactly(size)).decode('utf-8'))
+    resp = six.b(json.dumps({'max_rdy_count': 2500}))
+    writer.write(mock_response(nsq.FRAME_TYPE_RESPONSE, resp))
+
+
+def test_consumer_messages():
+    commands = []
+
+    async def handle(reader, writer):
+        await read_identify(reader, writer)
+        assert await reader.readline() == b'SUB topic channel\n'
+        writer.write(mock_response(nsq.FRAME_TYPE_RESPONSE, b'OK'))
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+
+            commands.append(line)
+            if line == b'RDY 1\n':
+                for i in range(4):
+                    writer.write(mock_response_message(0, 1, i, b'hi'))
+
+    async def main():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        handled = []
+
+        async def handler(consumer, message):
+            assert message.body == b'hi'
+            handled.append(message.id)
+            if len(handled) == 4:
+                asyncio.get_event_loop().call_later(0.1, consumer.close)
+            if message.id == b'0000000000000003':
+                raise NSQRequeueMessage(backoff=False)
+
+        consumer = aio.AsyncConsumer(
+            'topic', 'channel', '127.0.0.1:%d' % port,
+            message_handler=handler, max_in_flight=4)
+
+        await consumer.start()
+        server.close()
+        return handled
+
+    handled = run(main())
+    assert len(handled) == 4
+    assert b'RDY 1\n' in commands
+    assert b'FIN 0000000000000000\n' in commands
+    assert b'REQ 0000000000000003 0\n' in commands
+
+
+def test_producer_pipelining():
+    received = []
+
+    async def handle(reader, writer):
+        await read_identify(reader, writer)
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            size = nsq.unpack_size(await reader.readexactly(4))
+            received.append((line, await reader.readexactly(size)))
+            writer.write(mock_response(nsq.FRAME_TYPE_RESPONSE, b'OK'))
+
+    async def main():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+
+        producer = aio.AsyncProducer('127.0.0.1:%d' % port)
+        await producer.start()
+
+        results = await asyncio.gather(*[
+            producer.publish('topic', b'hi') for _ in range(10)
+        ])
+        assert results == 10 * [b'OK']
+
+        assert await producer.multipublish('topic', [b'a', b'b']) == b'OK'
+
+        producer.close()
+        server.close()
+
+    run(main())
+    assert len(received) == 11
+    assert received[0] == (b'PUB topic\n', b'hi')
+    assert received[-1][0] == b'MPUB topic\n'
+
+
+def test_unsupported_options():
+    with pytest.raises(ValueError):
+        aio.AsyncNsqdTCPClient(snappy=True)
+
+
+def test_without_gevent():
+    script = (
+        'import sys; sys.modules["gevent"] = None\n'
+        'from gnsq.aio import AsyncNsqdTCPClient\n'
+        'assert AsyncNsqdTCPClient().backend.name == "threading"\n'
+    )
+    subprocess.check_call([sys.executable, '-c', script])
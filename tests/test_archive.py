@@ -0,0 +1,179 @@
+import os
+
+import gevent
+import pytest
+
+from blinker import Signal
+
+from gnsq import Consumer, Producer
+from gnsq.contrib.archive import (
+    ArchiveFile, Archiver, read_archive, read_index)
+from gnsq.message import Message
+from gnsq.testing import FakeNsqd
+
+
+class FakeConsumer(object):
+    max_in_flight = 1000
+
+    def __init__(self):
+        self.on_close = Signal()
+
+
+class FakeConn(object):
+    def __init__(self):
+        self.finished = []
+
+    def finish(self, message_id):
+        self.finished.append(message_id)
+
+
+def make_messages(start, count, conn):
+    messages = []
+    for i in range(start, start + count):
+        message = Message(
+            i * 1000, 1, b'%016d' % i, b'message %d' % i * (i % 5 + 1))
+        message.on_finish.connect(
+            lambda m: conn.finish(m.id), weak=False)
+        messages.append(message)
+    return messages
+
+
+def archive_files(path):
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if not name.endswith('.idx'))
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'zlib', None])
+def test_blocks_and_index(tmpdir, compression):
+    path = str(tmpdir)
+    conn = FakeConn()
+    consumer = FakeConsumer()
+    archiver = Archiver(
+        path, prefix='topic', compression=compression, flush_interval=60)
+
+    for start in (0, 100, 200):
+        messages = make_messages(start, 100, conn)
+        archiver(consumer, messages)
+        assert not conn.finished[start:]
+        archiver.flush()
+        assert len(conn.finished) == start + 100
+
+    archiver.close()
+
+    filename, = archive_files(path)
+    assert os.path.basename(filename).startswith('topic.')
+    blocks = read_index(filename)
+    assert [b.count for b in blocks] == [100, 100, 100]
+    assert blocks[1].min_timestamp == 100000
+    assert blocks[1].max_timestamp == 199000
+
+    records = list(read_archive(filename))
+    assert len(records) == 300
+    assert records[7].id == b'%016d' % 7
+    assert records[7].timestamp == 7000
+    assert records[7].body == b'message 7' * 3
+
+    since = list(read_archive(filename, since=150000))
+    assert [r.timestamp for r in since] == [i * 1000 for i in range(150, 300)]
+    assert list(read_archive(filename, since=10 ** 12)) == []
+
+    for start in (100, 250, 300):
+        skipped = list(read_archive(filename, start=start))
+        assert [r.timestamp for r in skipped] == \
+            [i * 1000 for i in range(start, 300)]
+
+
+def test_read_unfinished_file(tmpdir):
+    filename = str(tmpdir.join('archive.gz'))
+    archive = ArchiveFile(filename, 'gzip')
+
+    archiver = Archiver(str(tmpdir.join('unused')), flush_interval=60)
+    archiver.file = archive
+    archiver(FakeConsumer(), make_messages(0, 10, FakeConn()))
+    archiver.flush()
+    archiver.worker.kill()
+
+    # The file is not closed, so it has no gzip trailer.
+    assert len(list(read_archive(filename))) == 10
+    assert len(list(read_archive(filename, since=5000))) == 5
+
+
+def test_rotation(tmpdir):
+    path = str(tmpdir)
+    conn = FakeConn()
+    archiver = Archiver(path, max_file_bytes=1, flush_interval=0.01)
+
+    archiver(FakeConsumer(), make_messages(0, 10, conn))
+    gevent.sleep(0.05)
+    archiver(FakeConsumer(), make_messages(10, 10, conn))
+    gevent.sleep(0.05)
+    archiver.close()
+
+    files = archive_files(path)
+    assert len(files) == 2
+    assert len(conn.finished) == 20
+    assert [len(list(read_archive(f))) for f in files] == [10, 10]
+
+
+def test_write_error_requeues(tmpdir):
+    class Conn(FakeConn):
+        def __init__(self):
+            super(Conn, self).__init__()
+            self.requeued = []
+
+        def requeue(self, message_id):
+            self.requeued.append(message_id)
+
+    conn = Conn()
+    archiver = Archiver(str(tmpdir), flush_interval=60)
+    messages = make_messages(0, 3, conn)
+    for message in messages:
+        message.on_requeue.connect(
+            lambda m, **kwargs: conn.requeue(m.id), weak=False)
+
+    def fail(*args):
+        raise IOError('disk full')
+
+    archiver._write_block = fail
+    archiver(FakeConsumer(), messages)
+    with pytest.raises(IOError):
+        archiver.flush()
+
+    assert len(conn.requeued) == 3
+    assert not conn.finished
+    archiver.worker.kill()
+
+
+def test_archive_consumer(tmpdir):
+    path = str(tmpdir)
+    bodies = [b'%d' % i for i in range(500)]
+
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.multipublish('topic', bodies)
+        producer.close()
+
+        archiver = Archiver(path, flush_interval=0.05)
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_in_flight=100,
+            batch_handler=archiver)
+        consumer.start(block=False)
+
+        def finished():
+            topic, = nsqd.stats()['topics']
+            return any(
+                c['depth'] == 0 and c['in_flight_count'] == 0
+                for c in topic['channels'])
+
+        with gevent.Timeout(5):
+            while not finished():
+                gevent.sleep(0.01)
+
+        consumer.close()
+        consumer.join()
+        archiver.close()
+
+    records = [r for f in archive_files(path) for r in read_archive(f)]
+    assert sorted(r.body for r in records) == sorted(bodies)
@@ -0,0 +1,161 @@
+import json
+import sys
+import threading
+
+import pytest
+import six
+
+from gnsq import Consumer, NsqdTCPClient, Producer, states
+from gnsq import protocol as nsq
+from gnsq.backends import get_backend
+from gnsq.backends.gevent import GeventBackend
+
+from mock_server import (
+    mock_response, mock_response_message, threaded_mock_server)
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 3), reason='threading backend requires python 3')
+
+
+def recv_exactly(socket, size):
+    data = b''
+    while len(data) < size:
+        chunk = socket.recv(size - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def recv_line(socket):
+    line = b''
+    while not line.endswith(b'\n'):
+        chunk = socket.recv(1)
+        if not chunk:
+            return line
+        line += chunk
+    return line
+
+
+def handle_identify(socket):
+    assert recv_exactly(socket, 4) == b'  V2'
+    assert recv_line(socket) == b'IDENTIFY\n'
+    size = nsq.unpack_size(recv_exactly(socket, 4))
+    json.loads(recv_exactly(socket, size).decode('utf-8'))
+    resp = six.b(json.dumps({'max_rdy_count': 2500}))
+    socket.sendall(mock_response(nsq.FRAME_TYPE_RESPONSE, resp))
+
+
+def test_get_backend():
+    assert isinstance(get_backend(), GeventBackend)
+    assert get_backend('threading').name == 'threading'
+
+    backend = GeventBackend()
+    assert get_backend(backend) is backend
+
+    with pytest.raises(ValueError):
+        get_backend('twisted')
+
+
+def test_threaded_connection():
+    def handle(socket, address):
+        handle_identify(socket)
+        socket.sendall(mock_response_message(0, 1, 0, b'hi'))
+        assert recv_line(socket) == b'FIN 0000000000000000\n'
+
+    with threaded_mock_server(handle) as server:
+        conn = NsqdTCPClient(
+            '127.0.0.1', server.server_port, backend='threading')
+        conn.connect()
+        conn.identify()
+        assert conn.state == states.CONNECTED
+
+        frame, message = conn.read_response()
+        assert frame == nsq.FRAME_TYPE_MESSAGE
+        assert message.body == b'hi'
+        assert conn.in_flight == 1
+
+        message.finish()
+        assert conn.in_flight == 0
+
+
+def test_threaded_consumer():
+    commands = []
+    handled = []
+    finished = []
+    done = threading.Event()
+
+    def handle(socket, address):
+        handle_identify(socket)
+        assert recv_line(socket) == b'SUB topic channel\n'
+        socket.sendall(mock_response(nsq.FRAME_TYPE_RESPONSE, b'OK'))
+
+        while True:
+            line = recv_line(socket)
+            if not line:
+                break
+
+            commands.append(line)
+            if line == b'RDY 1\n':
+                for i in range(4):
+                    socket.sendall(mock_response_message(0, 1, i, b'hi'))
+
+    def message_handler(consumer, message):
+        handled.append((threading.current_thread(), message.id))
+
+    def on_finish(consumer, message_id):
+        finished.append(message_id)
+        if len(finished) == 4:
+            done.set()
+
+    with threaded_mock_server(handle) as server:
+        consumer = Consumer(
+            'topic', 'channel', '127.0.0.1:%d' % server.server_port,
+            message_handler=message_handler, max_in_flight=4,
+            backend='threading')
+        consumer.on_finish.connect(on_finish)
+
+        consumer.start(block=False)
+        assert done.wait(5)
+        consumer.close()
+        consumer.join(5)
+
+    assert len(handled) == 4
+    assert threading.current_thread() not in [t for t, _ in handled]
+    assert b'RDY 1\n' in commands
+    assert b'FIN 0000000000000003\n' in commands
+
+
+def test_threaded_producer():
+    received = []
+
+    def handle(socket, address):
+        handle_identify(socket)
+
+        while True:
+            line = recv_line(socket)
+            if not line:
+                break
+            size = nsq.unpack_size(recv_exactly(socket, 4))
+            received.append((line, recv_exactly(socket, size)))
+            socket.sendall(mock_response(nsq.FRAME_TYPE_RESPONSE, b'OK'))
+
+    with threaded_mock_server(handle) as server:
+        producer = Producer(
+            '127.0.0.1:%d' % server.server_port, backend='threading')
+        producer.start()
+
+        assert producer.publish('topic', b'hi') == b'OK'
+        assert producer.multipublish('topic', [b'a', b'b']) == b'OK'
+
+        results = [
+            producer.publish('topic', b'hi', raise_error=False)
+            for _ in range(5)
+        ]
+        assert [r.get(timeout=5) for r in results] == 5 * [b'OK']
+
+        producer.close()
+
+    assert len(received) == 7
+    assert received[0] == (b'PUB topic\n', b'hi')
+    assert received[1][0] == b'MPUB topic\n'
@@ -0,0 +1,232 @@
+import gzip
+import json
+import struct
+
+import gevent
+import pytest
+import six
+
+from blinker import Signal
+
+from gnsq import Consumer
+from gnsq.contrib import backfill as backfill_module
+from gnsq.contrib.archive import Archiver
+from gnsq.contrib.backfill import Backfill, read_records
+from gnsq.contrib.backfill.__main__ import main
+from gnsq.contrib.queue import QueueHandler
+from gnsq.message import Message
+
+ADDRESS = '127.0.0.1:4150'
+
+
+def write_archive(path, count):
+    class FakeConsumer(object):
+        max_in_flight = count
+
+        def __init__(self):
+            self.on_close = Signal()
+
+    archiver = Archiver(str(path), flush_interval=60)
+    messages = [
+        Message(i, 1, six.b('%016d' % i), six.b('%d' % i))
+        for i in range(count)]
+    for message in messages:
+        message.on_finish.connect(lambda m: None, weak=False)
+    archiver(FakeConsumer(), messages)
+    archiver.close()
+    return sorted(str(p) for p in path.listdir() if p.ext != '.idx')
+
+
+def test_read_formats(tmpdir):
+    newline = tmpdir.join('messages.log.gz')
+    with gzip.open(str(newline), 'wb') as fp:
+        fp.write(b'one\ntwo\nthree\n')
+
+    length = tmpdir.join('messages.bin')
+    length.write_binary(b''.join(
+        struct.pack('>I', len(body)) + body
+        for body in [b'one', b'', b'line\nbreak']))
+
+    assert [r[2] for r in read_records(str(newline), 'newline')] == \
+        [b'one', b'two', b'three']
+    assert [r[2] for r in read_records(str(length), 'length')] == \
+        [b'one', b'', b'line\nbreak']
+
+    path, = write_archive(tmpdir.join('archive'), 3)
+    assert list(read_records(path)) == [
+        (six.b('%016d' % i), i, six.b('%d' % i)) for i in range(3)]
+
+    with pytest.raises(ValueError):
+        read_records(path, 'xml')
+
+
+def test_handlers_and_requeues(tmpdir):
+    paths = write_archive(tmpdir.join('archive'), 50)
+    handled = []
+    given_up = []
+
+    def handler(consumer, message):
+        handled.append((message.body, message.attempts))
+        if message.body == b'7':
+            raise RuntimeError('poison')
+
+    consumer = Consumer(
+        'topic', 'channel', ADDRESS, max_in_flight=10, max_tries=3,
+        message_handler=handler)
+    consumer.on_giving_up.connect(
+        lambda consumer, message: given_up.append(message.body), weak=False)
+
+    backfill = Backfill(consumer, paths)
+    assert backfill.run() == 50
+
+    assert backfill.requeued == 3
+    assert given_up == [b'7']
+    assert [a for b, a in handled if b == b'7'] == [1, 2, 3]
+    assert len(handled) == 52
+    assert backfill.position == 50
+
+
+def test_leased_consumer(tmpdir):
+    paths = write_archive(tmpdir.join('archive'), 20)
+    handled = []
+
+    def handler(consumer, message):
+        handled.append(message.body)
+
+    consumer = Consumer(
+        'topic', 'channel', ADDRESS, max_in_flight=5, auto_touch=True,
+        kill_expired=True, message_handler=handler)
+
+    backfill = Backfill(consumer, paths)
+    assert backfill.run() == 20
+    assert sorted(handled) == sorted(six.b('%d' % i) for i in range(20))
+    assert len(consumer._timer_wheel) == 0
+
+
+def test_concurrency_and_batches(tmpdir):
+    paths = write_archive(tmpdir.join('archive'), 100)
+    batches = []
+    peak = [0]
+
+    def batch_handler(consumer, messages):
+        batches.append(len(messages))
+        for message in messages:
+            message.enable_async()
+            gevent.spawn_later(0.001, message.finish)
+        peak[0] = max(peak[0], backfill.in_flight)
+
+    consumer = Consumer(
+        'topic', 'channel', ADDRESS, max_in_flight=16,
+        batch_handler=batch_handler)
+    backfill = Backfill(consumer, paths, batch_size=8, connections=2)
+
+    assert backfill.run() == 100
+    assert sum(batches) == 100
+    assert max(batches) == 8
+    assert peak[0] == 16
+
+
+def test_checkpoint_resume(tmpdir):
+    paths = write_archive(tmpdir.join('archive'), 30)
+    checkpoint = str(tmpdir.join('checkpoint.json'))
+    queue = QueueHandler()
+
+    consumer = Consumer(
+        'topic', 'channel', ADDRESS, max_in_flight=5, message_handler=queue)
+    backfill = Backfill(consumer, paths, checkpoint=checkpoint)
+    runner = gevent.spawn(backfill.run)
+
+    # Finish the first 12 messages, hold the next ones and interrupt.
+    for _ in range(12):
+        queue.get(timeout=1).finish()
+    held = [queue.get(timeout=1) for _ in range(3)]
+    held[1].finish()
+    gevent.sleep(0.01)
+    runner.kill()
+
+    with open(checkpoint) as fp:
+        assert json.load(fp)['position'] == 12
+
+    handled = []
+    consumer = Consumer(
+        'topic', 'channel', ADDRESS, max_in_flight=5,
+        message_handler=lambda consumer, message: handled.append(message.body))
+    assert Backfill(consumer, paths, checkpoint=checkpoint).run() == 31
+
+    assert handled == [six.b('%d' % i) for i in range(12, 30)]
+
+
+def test_checkpoint_seeks(tmpdir, monkeypatch):
+    class FakeConsumer(object):
+        max_in_flight = 100
+
+        def __init__(self):
+            self.on_close = Signal()
+
+    # Three files of two blocks of five messages.
+    archiver = Archiver(str(tmpdir.join('archive')), flush_interval=60)
+    for i in range(0, 30, 5):
+        messages = [
+            Message(n, 1, six.b('%016d' % n), six.b('%d' % n))
+            for n in range(i, i + 5)]
+        for message in messages:
+            message.on_finish.connect(lambda m: None, weak=False)
+        archiver(FakeConsumer(), messages)
+        archiver.flush()
+        if i % 10:
+            archiver.rotate()
+    archiver.close()
+
+    paths = sorted(
+        str(p) for p in tmpdir.join('archive').listdir() if p.ext != '.idx')
+    assert len(paths) == 3
+
+    checkpoint = str(tmpdir.join('checkpoint.json'))
+    queue = QueueHandler()
+    consumer = Consumer(
+        'topic', 'channel', ADDRESS, max_in_flight=5, message_handler=queue)
+    runner = gevent.spawn(Backfill(consumer, paths, checkpoint=checkpoint).run)
+
+    for _ in range(17):
+        queue.get(timeout=1).finish()
+    queue.get(timeout=1)
+    runner.kill()
+
+    with open(checkpoint) as fp:
+        state = json.load(fp)
+    assert state['position'] == 17
+    assert state['file'] == 1
+    assert state['file_position'] == 10
+
+    reads = []
+    read_archive = backfill_module.read_archive
+
+    def recording_read_archive(path, start=0):
+        reads.append((path, start))
+        return read_archive(path, start=start)
+
+    monkeypatch.setattr(backfill_module, 'read_archive', recording_read_archive)
+
+    handled = []
+    consumer = Consumer(
+        'topic', 'channel', ADDRESS, max_in_flight=5,
+        message_handler=lambda consumer, message: handled.append(message.body))
+    Backfill(consumer, paths, checkpoint=checkpoint).run()
+
+    assert handled == [six.b('%d' % i) for i in range(17, 30)]
+    assert reads == [(paths[1], 7), (paths[2], 0)]
+
+
+def test_command(tmpdir, capsys):
+    path = tmpdir.join('messages.log')
+    path.write_binary(b'a\nb\nc\n')
+
+    main(['tests.test_backfill:make_consumer', str(path),
+          '--format', 'newline'])
+    assert 'finished 3 messages' in capsys.readouterr().out
+
+
+def make_consumer():
+    return Consumer(
+        'topic', 'channel', ADDRESS,
+        message_handler=lambda consumer, message: None)
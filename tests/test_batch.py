@@ -0,0 +1,215 @@
+import gevent
+import gevent.event
+
+from gnsq import Consumer, Producer
+from gnsq.contrib.batch import BatchHandler, KeyedBatchHandler
+from gnsq.metrics import MetricsRegistry
+from gnsq.testing import FakeNsqd
+
+
+class FakeConsumer(object):
+    max_in_flight = 100
+
+    def __init__(self):
+        self.limits = []
+
+    def add_ready_limit(self, limit):
+        self.limits.append(limit)
+
+
+class FakeMessage(object):
+    def __init__(self, body):
+        self.body = body
+        self.responded = None
+
+    def enable_async(self):
+        pass
+
+    def has_responded(self):
+        return self.responded is not None
+
+    def finish(self):
+        self.responded = 'finish'
+
+    def requeue(self):
+        self.responded = 'requeue'
+
+
+def test_size_and_age_triggers():
+    batches = []
+    handler = BatchHandler(
+        4, lambda messages: batches.append([m.body for m in messages]),
+        timeout=0.05)
+    consumer = FakeConsumer()
+
+    messages = [FakeMessage(b'%d' % i) for i in range(10)]
+    for message in messages:
+        handler(consumer, message)
+
+    assert consumer.limits == [handler.ready_limit]
+    assert handler.ready_limit() is None
+
+    gevent.sleep(0.01)
+    assert batches == [[b'0', b'1', b'2', b'3'], [b'4', b'5', b'6', b'7']]
+
+    gevent.sleep(0.1)
+    assert batches[2] == [b'8', b'9']
+    assert all(m.responded == 'finish' for m in messages)
+    assert handler.batch_sizes.count == 3
+    handler.kill()
+
+
+def test_bytes_trigger_and_max_in_flight():
+    batches = []
+    handler = BatchHandler(
+        100, lambda messages: batches.append(len(messages)),
+        max_batch_bytes=10)
+    consumer = FakeConsumer()
+
+    for _ in range(3):
+        handler(consumer, FakeMessage(b'x' * 5))
+    consumer.max_in_flight = 2
+    for _ in range(2):
+        handler(consumer, FakeMessage(b'x'))
+
+    gevent.sleep(0.01)
+    assert batches == [2, 2]
+    assert len(handler.buffers[None]) == 1
+    handler.kill()
+
+
+def test_non_blocking_flushers():
+    release = gevent.event.Event()
+    flushed = []
+
+    def handle_batch(messages):
+        release.wait()
+        flushed.append(len(messages))
+
+    registry = MetricsRegistry()
+    handler = BatchHandler(
+        2, handle_batch, flushers=2, registry=registry,
+        labels={'sink': 'test'})
+    consumer = FakeConsumer()
+
+    with gevent.Timeout(1):
+        for i in range(10):
+            handler(consumer, FakeMessage(b'%d' % i))
+
+    gevent.sleep(0.01)
+    assert handler.batches.qsize() == 3
+    release.set()
+    gevent.sleep(0.01)
+    assert flushed == [2] * 5
+
+    text = registry.to_prometheus()
+    assert 'gnsq_batch_size_messages_count{sink="test"} 5' in text
+    assert 'gnsq_batch_flush_seconds_count{sink="test"} 5' in text
+    handler.kill()
+
+
+def test_spawn_per_batch():
+    release = gevent.event.Event()
+    running = []
+
+    def handle_batch(messages):
+        running.append(len(messages))
+        release.wait()
+
+    spawned = []
+
+    def spawn(func, *args):
+        spawned.append(args)
+        return gevent.spawn(func, *args)
+
+    handler = BatchHandler(2, handle_batch, spawn=spawn)
+    consumer = FakeConsumer()
+    for i in range(10):
+        handler(consumer, FakeMessage(b'%d' % i))
+
+    gevent.sleep(0.01)
+    assert len(spawned) == 5
+    assert running == [2] * 5
+    release.set()
+    handler.kill()
+
+    pooled = BatchHandler(2, handle_batch, spawn=3)
+    assert pooled.ready_limit() == 2 + 2 * (3 + 3)
+    pooled.kill()
+
+
+def test_batch_errors():
+    def handle_message(message):
+        if message.body == b'bad':
+            raise ValueError()
+        return message
+
+    def handle_batch(messages):
+        if len(messages) > 1:
+            raise ValueError()
+
+    errors = []
+    handler = BatchHandler(
+        2, handle_batch, handle_message,
+        handle_message_error=lambda error, message: errors.append('message'),
+        handle_batch_error=lambda *args: errors.append('batch'))
+    consumer = FakeConsumer()
+
+    messages = [FakeMessage(b'bad'), FakeMessage(b'ok'),
+                FakeMessage(b'ok'), FakeMessage(b'ok')]
+    for message in messages:
+        handler(consumer, message)
+
+    gevent.sleep(0.01)
+    assert errors == ['message', 'batch']
+    assert [m.responded for m in messages] == [
+        'requeue', 'finish', 'requeue', 'requeue']
+    handler.kill()
+
+
+def test_keyed_batches():
+    batches = []
+    handler = KeyedBatchHandler(
+        lambda message: message.body[:1], 3,
+        lambda key, messages: batches.append((key, len(messages))),
+        max_buffered=4, timeout=0.05, flushers=1)
+    consumer = FakeConsumer()
+    assert handler.ready_limit() == 4 + 3 * 2
+
+    for body in [b'a1', b'b1', b'a2', b'a3', b'b2', b'c1', b'd1']:
+        handler(consumer, FakeMessage(body))
+
+    gevent.sleep(0.01)
+    # a fills its batch, then the cap of 4 flushes b (the oldest) early.
+    assert batches == [(b'a', 3), (b'b', 2)]
+    assert handler.buffered == 2
+
+    gevent.sleep(0.1)
+    assert batches[2:] == [(b'c', 1), (b'd', 1)]
+    assert handler.buffered == 0
+    handler.kill()
+
+
+def test_consumer_batches():
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.multipublish('topic', [b'%d' % i for i in range(20)])
+        producer.close()
+
+        batches = []
+        handler = BatchHandler(
+            8, lambda messages: batches.append(len(messages)), timeout=0.05)
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_in_flight=32,
+            message_handler=handler)
+        consumer.start(block=False)
+
+        with gevent.Timeout(2):
+            while sum(batches) < 20:
+                gevent.sleep(0.01)
+
+        consumer.close()
+        handler.kill()
+
+    assert max(batches) <= 8
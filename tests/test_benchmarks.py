@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from gnsq.benchmarks import Results, Target, compare, run
+from gnsq.benchmarks import protocol, suite
+from gnsq.benchmarks.__main__ import main
+from gnsq.benchmarks.results import percentile
+
+
+def test_percentile():
+    samples = list(range(1, 101))
+    assert percentile(samples, 50) == 51
+    assert percentile(samples, 99) == 99
+    assert percentile(samples, 100) == 100
+    assert percentile([], 50) is None
+
+
+def test_compare():
+    baseline = Results('fake')
+    baseline.add('consumer', {'size': 100}, msgs_per_sec=1000.0)
+    baseline.add('latency', {'size': 100}, p99_ms=1.0)
+    baseline.add('removed', {}, msgs_per_sec=1.0)
+
+    current = Results('fake')
+    current.add('consumer', {'size': 100}, msgs_per_sec=900.0)
+    current.add('latency', {'size': 100}, p99_ms=0.5)
+    current.add('added', {}, msgs_per_sec=1.0)
+
+    rows = compare(baseline, current, threshold=0.05)
+    assert [(r[0], r[1], r[-1]) for r in rows] == [
+        ('consumer size=100', 'msgs_per_sec', True),
+        ('latency size=100', 'p99_ms', False),
+    ]
+
+
+@pytest.mark.parametrize('name,func,args', protocol.FUNCTIONS)
+def test_protocol(name, func, args):
+    metrics = protocol.protocol_function(name, func, args, 10)
+    assert metrics['mean_ns'] > 0
+    assert metrics['ops_per_sec'] > 0
+
+
+@pytest.mark.parametrize('backend', ['gevent', 'threading'])
+def test_throughput(backend):
+    with Target(timeout=10) as target:
+        assert target.name == 'fake'
+
+        metrics = suite.consumer_throughput(target, 200, 100, 32, backend)
+        assert metrics['msgs_per_sec'] > 0
+
+        metrics = suite.producer_throughput(
+            target, 200, 100, batch_size=50, backend=backend)
+        assert metrics['msgs_per_sec'] > 0
+
+        metrics = suite.end_to_end_latency(target, 20, 100, backend)
+        assert 0 < metrics['p50_ms'] <= metrics['p99_ms']
+
+
+def test_run_and_compare(tmpdir):
+    with Target(timeout=10) as target:
+        results = run(target, 100, only=['producer'])
+
+    assert {r['name'] for r in results.results} == {'producer'}
+
+    baseline = str(tmpdir.join('baseline.json'))
+    results.save(baseline)
+    with open(baseline) as fp:
+        assert json.load(fp)['meta']['target'] == 'fake'
+
+    main([
+        '--messages', '100', '--only', 'latency', '--compare', baseline,
+        '--output', str(tmpdir.join('current.json')),
+    ])
+    assert tmpdir.join('current.json').check()
@@ -68,3 +68,34 @@ def test_command(cmd_method, kwargs, result):
 
 def test_unicode_body():
     pytest.raises(TypeError, nsq.publish, 'topic', u'unicode body')
+
+
+@pytest.mark.parametrize('count', [0, 1, 2500, 2501, 10000])
+def test_ready(count):
+    assert nsq.ready(count) == nsq._command(nsq.RDY, None, str(count))
+
+
+def test_ready_invalid():
+    pytest.raises(TypeError, nsq.ready, 1.5)
+    pytest.raises(ValueError, nsq.ready, -1)
+
+
+@pytest.mark.parametrize('message_id', [b'0123456789abcdef', u'\u2020est'])
+def test_message_commands(message_id):
+    assert nsq.finish(message_id) == nsq._command(nsq.FIN, None, message_id)
+    assert nsq.touch(message_id) == nsq._command(nsq.TOUCH, None, message_id)
+    assert nsq.requeue(message_id, 1000) == \
+        nsq._command(nsq.REQ, None, message_id, '1000')
+    pytest.raises(TypeError, nsq.requeue, message_id, 1.5)
+
+
+def test_close():
+    assert nsq.close() == b'CLS\n'
+
+
+def test_unpack():
+    frame = struct.pack('>qh', 1234, 3) + b'0123456789abcdef' + b'body'
+    assert nsq.unpack_message(frame) == (1234, 3, b'0123456789abcdef', b'body')
+    assert nsq.unpack_response(struct.pack('>l', 1) + b'E_INVALID') == \
+        (1, b'E_INVALID')
+    assert nsq.unpack_size(struct.pack('>l', 42)) == 42
@@ -0,0 +1,100 @@
+import gevent
+import pytest
+
+from gnsq import Consumer, Producer
+from gnsq.errors import NSQRequeueMessage
+from gnsq.message import Message, finish_all, requeue_all
+from gnsq.testing import FakeNsqd
+
+
+def test_finish_and_requeue_all():
+    responses = []
+
+    def message(id):
+        message = Message(0, 1, id, b'body')
+        message.on_finish.connect(
+            lambda message: responses.append(('fin', message.id)),
+            weak=False)
+        message.on_requeue.connect(
+            lambda message, timeout, backoff: responses.append(
+                ('req', message.id, backoff)),
+            weak=False)
+        return message
+
+    messages = [message(b'1'), message(b'2'), message(b'3')]
+    messages[0].finish()
+    requeue_all(messages)
+    assert responses == [
+        ('fin', b'1'), ('req', b'2', True), ('req', b'3', False)]
+
+    del responses[:]
+    messages = [message(b'4'), message(b'5')]
+    messages[1].requeue(backoff=False)
+    finish_all(messages)
+    assert responses == [('req', b'5', False), ('fin', b'4')]
+
+
+def test_receivers_checked():
+    consumer = Consumer('topic', 'channel', '127.0.0.1:4150')
+    with pytest.raises(RuntimeError):
+        consumer.start(block=False)
+
+    consumer = Consumer(
+        'topic', 'channel', '127.0.0.1:4150',
+        message_handler=lambda consumer, message: None,
+        batch_handler=lambda consumer, messages: None)
+    with pytest.raises(RuntimeError):
+        consumer.start(block=False)
+
+
+def test_batch_handler():
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.multipublish('topic', [b'%d' % i for i in range(20)])
+        producer.multipublish('topic', [b'fail', b'async'])
+        producer.close()
+
+        batches = []
+        held = []
+        requeued = []
+        finished = []
+
+        def handler(consumer, messages):
+            batches.append([m.body for m in messages])
+            for message in messages:
+                if message.body == b'async':
+                    message.enable_async()
+                    held.append(message)
+                if message.body == b'fail' and message.attempts == 1:
+                    raise NSQRequeueMessage(backoff=False)
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_in_flight=32,
+            batch_handler=handler, max_batch_size=8)
+        consumer.on_finish.connect(
+            lambda consumer, message_id: finished.append(message_id),
+            weak=False)
+        consumer.on_requeue.connect(
+            lambda consumer, message_id, timeout: requeued.append(message_id),
+            weak=False)
+
+        consumer.start(block=False)
+        with gevent.Timeout(2):
+            while len(set(finished)) < 21:
+                gevent.sleep(0.01)
+
+            assert len(held) >= 1
+            assert requeued
+            for message in held:
+                if not message.has_responded():
+                    message.finish()
+
+            while len(set(finished)) < 22:
+                gevent.sleep(0.01)
+
+        consumer.close()
+
+    assert all(len(batch) <= 8 for batch in batches)
+    bodies = set(body for batch in batches for body in batch)
+    assert bodies == set([b'%d' % i for i in range(20)] + [b'fail', b'async'])
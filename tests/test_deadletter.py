@@ -0,0 +1,164 @@
+import json
+import os
+
+import gevent
+
+from gnsq import Consumer, Producer
+from gnsq.contrib.deadletter import DeadLetterStore, Segment, replay
+from gnsq.contrib.deadletter.__main__ import main
+from gnsq.contrib.giveup import JSONLogGiveupHandler
+from gnsq.message import Message
+from gnsq.testing import FakeNsqd
+
+
+def make_message(i, body=None):
+    message_id = b'%016d' % i
+    return Message(1000 + i, 5, message_id, body or b'body %d' % i)
+
+
+def test_store_rotates_segments(tmpdir):
+    path = str(tmpdir.join('bury'))
+    store = DeadLetterStore(path, segment_size=256)
+
+    for i in range(20):
+        store.append(make_message(i))
+    store.append(make_message(20, b'x' * 1000))
+
+    assert len(store.segments()) > 2
+    assert len(store) == 21
+
+    records = list(store.records())
+    assert [r.id for r in records] == [b'%016d' % i for i in range(21)]
+    assert records[3].timestamp == 1003
+    assert records[3].attempts == 5
+    assert records[3].body == b'body 3'
+    assert records[20].body == b'x' * 1000
+
+    assert [r.id for r in store.records(start=12)] == \
+        [b'%016d' % i for i in range(12, 21)]
+    assert list(store.records(start=21)) == []
+
+    store.close()
+    segment = store.segments()[0]
+    assert os.path.getsize(segment + '.seg') <= 256
+
+    reopened = DeadLetterStore(path)
+    reopened.append(make_message(21))
+    reopened.close()
+    assert len(reopened) == 22
+    assert list(reopened.records(start=21))[0].id == b'%016d' % 21
+
+
+def test_store_reads_unclosed_segment(tmpdir):
+    path = str(tmpdir)
+    segment = Segment(os.path.join(path, '%020d' % 0), 4096)
+    segment.append(make_message(0))
+    segment.append(make_message(1))
+    segment.flush()
+
+    # A crashed writer leaves the segment at its full size.
+    store = DeadLetterStore(path)
+    assert [r.body for r in store.records()] == [b'body 0', b'body 1']
+
+
+def test_store_short_index(tmpdir):
+    path = str(tmpdir)
+    segment = Segment(os.path.join(path, '%020d' % 0), 4096)
+    for i in range(5):
+        segment.append(make_message(i))
+    segment.flush()
+
+    index = segment.path + '.idx'
+    with open(index, 'rb') as fp:
+        entries = fp.read()
+
+    # A crash before the index is written back loses its last entries.
+    for kept in (2, 0):
+        with open(index, 'wb') as fp:
+            fp.write(entries[:kept * 8])
+
+        store = DeadLetterStore(path)
+        assert len(store) == 5
+        assert [r.body for r in store.records(start=3)] == \
+            [b'body 3', b'body 4']
+        assert list(store.records(start=5)) == []
+
+    # Or keeps entries past the records that reached the disk.
+    with open(index, 'wb') as fp:
+        fp.write(entries + b'\x00\x00\x00\x00\x00\x00\x10\x00')
+
+    store = DeadLetterStore(path)
+    assert len(store) == 5
+    assert [r.body for r in store.records(start=4)] == [b'body 4']
+
+
+def test_replay(tmpdir):
+    store = DeadLetterStore(str(tmpdir))
+    for i in range(25):
+        store.append(make_message(i))
+
+    class Topic(object):
+        def __init__(self):
+            self.batches = []
+
+        def multipublish(self, messages):
+            self.batches.append(list(messages))
+
+    delays = []
+    topic = Topic()
+    sent = replay(
+        store.records(), topic, rate=100, batch_size=10, sleep=delays.append)
+
+    assert sent == 25
+    assert [len(b) for b in topic.batches] == [10, 10, 5]
+    assert len(delays) == 2
+    assert 0.05 < delays[1] <= 0.2
+
+
+def test_giving_up_and_replay_tool(tmpdir):
+    path = str(tmpdir.join('bury'))
+    store = DeadLetterStore(path)
+
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.multipublish('topic', [b'a', b'b', b'\xff'])
+        producer.close()
+
+        def handler(consumer, message):
+            raise RuntimeError('poison')
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_tries=1,
+            requeue_delay=0, max_backoff_duration=0.01, max_in_flight=3,
+            message_handler=handler)
+        consumer.on_giving_up.connect(store, weak=False)
+        consumer.start(block=False)
+
+        with gevent.Timeout(5):
+            while len(store) < 3:
+                gevent.sleep(0.01)
+
+        consumer.close()
+        consumer.join()
+        store.close()
+
+        main([path, 'replayed', '--nsqd-tcp-address', nsqd.tcp_address,
+              '--start', '1'])
+
+        topic = nsqd.get_topic('replayed')
+        assert topic.message_count == 2
+        assert sorted(m.body for m in topic.backlog) == \
+            sorted(r.body for r in store.records(start=1))
+
+
+def test_json_log_bytes_body():
+    lines = []
+    handler = JSONLogGiveupHandler(lines.append)
+    handler(None, Message(1, 2, b'0123456789abcdef', b'\xff\x00'))
+    handler(None, Message(1, 2, b'0123456789abcdef', b'text'))
+
+    binary, text = [json.loads(line) for line in lines]
+    assert binary['encoding'] == 'base64'
+    assert binary['id'] == '0123456789abcdef'
+    assert text['body'] == 'text'
@@ -0,0 +1,124 @@
+import gevent
+
+from gnsq import Consumer, Producer
+from gnsq.dedup import (
+    BloomFilter, Deduplicator, LRUCache, RotatingBloomFilter)
+from gnsq.message import Message
+from gnsq.metrics import MetricsRegistry
+from gnsq.testing import FakeNsqd
+
+
+class Clock(object):
+    now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache.add(b'a')
+    cache.add(b'b')
+    assert b'a' in cache
+    cache.add(b'c')
+    assert len(cache) == 2
+    assert b'a' in cache
+    assert b'b' not in cache
+    assert b'c' in cache
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, 0.01)
+    keys = [b'%d' % i for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+
+    assert all(key in bloom for key in keys)
+    false_positives = sum(b'x%d' % i in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_rotating_bloom_filter_capacity():
+    bloom = RotatingBloomFilter(capacity=10, error_rate=1e-4)
+    size = bloom.nbytes
+
+    for i in range(20):
+        bloom.add(b'%d' % i)
+    assert all(b'%d' % i in bloom for i in range(20))
+
+    bloom.add(b'new')
+    assert b'0' not in bloom
+    assert b'19' in bloom
+    assert bloom.nbytes == size
+
+
+def test_rotating_bloom_filter_ttl():
+    clock = Clock()
+    bloom = RotatingBloomFilter(
+        capacity=10, ttl=60, generations=3, clock=clock)
+    bloom.add(b'key')
+
+    clock.now += 59
+    assert b'key' in bloom
+    clock.now += 2
+    assert b'key' in bloom
+    clock.now += 30
+    assert b'key' in bloom
+    clock.now += 30
+    assert b'key' not in bloom
+
+    bloom.add(b'key')
+    clock.now += 3600
+    assert b'key' not in bloom
+
+
+def test_deduplicator():
+    registry = MetricsRegistry()
+    dedup = Deduplicator(registry=registry, labels={'topic': 'topic'})
+
+    message = Message(0, 1, b'1', b'body')
+    assert not dedup.is_duplicate(message)
+    assert not dedup.is_duplicate(Message(0, 2, b'1', b'body'))
+    message.finish()
+
+    assert dedup.is_duplicate(Message(0, 3, b'1', b'body'))
+    assert not dedup.is_duplicate(Message(0, 1, b'2', b'body'))
+
+    text = registry.to_prometheus()
+    assert 'gnsq_consumer_dedup_hits_total{topic="topic"} 1' in text
+    assert 'gnsq_consumer_dedup_misses_total{topic="topic"} 3' in text
+
+    dedup = Deduplicator(digest=True)
+    message = Message(0, 1, b'1', b'body')
+    dedup.is_duplicate(message)
+    message.finish()
+    assert dedup.is_duplicate(Message(0, 1, b'2', b'body'))
+    assert not dedup.is_duplicate(Message(0, 1, b'1', b'other'))
+
+
+def test_consumer_dedup():
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.multipublish('topic', [b'same', b'same', b'other'])
+        producer.close()
+
+        handled = []
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, dedup_digest=True,
+            message_handler=lambda consumer, message: handled.append(
+                message.body))
+        finished = []
+        consumer.on_finish.connect(
+            lambda consumer, message_id: finished.append(message_id),
+            weak=False)
+
+        consumer.start(block=False)
+        with gevent.Timeout(2):
+            while len(finished) < 3:
+                gevent.sleep(0.01)
+        consumer.close()
+
+    assert handled == [b'same', b'other']
+    assert consumer.dedup.hits.value == 1
+    assert consumer.dedup.misses.value == 2
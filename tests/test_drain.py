@@ -0,0 +1,79 @@
+import gevent
+
+from gnsq import Consumer, Producer
+from gnsq.testing import FakeNsqd
+
+
+def publish(nsqd, count):
+    producer = Producer(nsqd.tcp_address)
+    producer.start()
+    producer.multipublish('topic', [b'%d' % i for i in range(count)])
+    producer.close()
+
+
+def test_drain():
+    with FakeNsqd() as nsqd:
+        publish(nsqd, 10)
+
+        finished = []
+        stages = []
+
+        def handler(consumer, message):
+            message.enable_async()
+            gevent.spawn_later(0.1, finish, message)
+
+        def finish(message):
+            message.finish()
+            finished.append(message.id)
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_in_flight=4,
+            message_handler=handler)
+
+        @consumer.on_drain.connect
+        def on_drain(consumer, stage, in_flight):
+            stages.append((stage, in_flight))
+
+        consumer.start(block=False)
+        with gevent.Timeout(2):
+            while not consumer.total_in_flight:
+                gevent.sleep(0.01)
+
+        in_flight = consumer.total_in_flight
+        assert consumer.close(drain=True, timeout=2) is True
+        consumer.join(1)
+
+        assert len(finished) == in_flight
+        assert stages[0] == ('started', in_flight)
+        assert ('close_wait', in_flight) in stages
+        assert stages[-1] == ('drained', 0)
+
+        gevent.sleep(0.05)
+        channel = nsqd.stats()['topics'][0]['channels'][0]
+        assert channel['in_flight_count'] == 0
+        assert channel['depth'] == 10 - in_flight
+        assert channel['requeue_count'] == 0
+
+
+def test_drain_timeout():
+    with FakeNsqd() as nsqd:
+        publish(nsqd, 1)
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address,
+            message_handler=lambda consumer, message: message.enable_async())
+
+        consumer.start(block=False)
+        with gevent.Timeout(2):
+            while not consumer.total_in_flight:
+                gevent.sleep(0.01)
+
+        stages = []
+        consumer.on_drain.connect(
+            lambda consumer, stage, in_flight: stages.append(stage),
+            weak=False)
+
+        assert consumer.close(drain=True, timeout=0.1) is False
+        assert stages[-1] == 'timeout'
+        assert not consumer._connections or not any(
+            conn.is_connected for conn in consumer._connections)
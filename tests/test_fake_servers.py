@@ -0,0 +1,227 @@
+from __future__ import division
+
+import threading
+import time
+
+import gevent
+import pytest
+import six
+
+from gnsq import (
+    Consumer, LookupdClient, NsqdHTTPClient, NsqdTCPClient, Producer, errors)
+from gnsq import protocol as nsq
+from gnsq.stream.stream import SnappySocket
+from gnsq.testing import Faults, FakeLookupd, FakeNsqd
+
+
+def consume(address, count, timeout=5, **kwargs):
+    messages = []
+    consumer = Consumer('topic', 'channel', address, **kwargs)
+
+    @consumer.on_message.connect
+    def handler(consumer, message):
+        messages.append(message)
+        if len(messages) >= count:
+            consumer.close()
+
+    consumer.start(block=False)
+    with gevent.Timeout(timeout):
+        consumer.join()
+
+    return messages
+
+
+def test_publish_consume():
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.publish('topic', b'one')
+        producer.multipublish('topic', [b'two', b'three'])
+        producer.close()
+
+        messages = consume(nsqd.tcp_address, 3, max_in_flight=10)
+        assert [m.body for m in messages] == [b'one', b'two', b'three']
+
+        gevent.sleep(0.01)
+        stats = nsqd.stats()['topics'][0]
+        assert stats['message_count'] == 3
+        assert stats['channels'][0]['in_flight_count'] == 0
+
+
+@pytest.mark.parametrize('options', [
+    {'deflate': True},
+    pytest.param({'snappy': True}, marks=pytest.mark.skipif(
+        SnappySocket is None, reason='snappy not installed')),
+])
+def test_compression(options):
+    with FakeNsqd() as nsqd:
+        conn = NsqdTCPClient('127.0.0.1', nsqd.tcp_port, **options)
+        conn.connect()
+        response = conn.identify()
+        assert all(response[key] for key in options)
+
+        conn.publish('topic', b'compressed')
+        assert conn.read_response() == (nsq.FRAME_TYPE_RESPONSE, nsq.OK)
+        conn.close_stream()
+
+        assert [m.body for m in consume(nsqd.tcp_address, 1)] == [
+            b'compressed']
+
+
+def test_requeue_and_timeout():
+    with FakeNsqd(msg_timeout=0.1) as nsqd:
+        nsqd.publish('topic', b'requeue')
+        nsqd.publish('topic', b'timeout')
+
+        def handler(consumer, message):
+            if message.body == b'requeue' and message.attempts == 1:
+                message.requeue(backoff=False)
+            elif message.body == b'timeout' and message.attempts == 1:
+                message.enable_async()
+
+        messages = consume(
+            nsqd.tcp_address, 4, message_handler=handler, max_in_flight=2)
+
+        attempts = sorted((m.body, m.attempts) for m in messages)
+        assert attempts == [
+            (b'requeue', 1), (b'requeue', 2), (b'timeout', 1), (b'timeout', 2)]
+
+        channel = nsqd.topics['topic'].channels['channel']
+        assert channel.requeue_count == 1
+        assert channel.timeout_count == 1
+
+
+def test_defer():
+    with FakeNsqd() as nsqd:
+        nsqd.create_channel('topic', 'channel')
+
+        start = time.time()
+        NsqdHTTPClient('127.0.0.1', nsqd.http_port).publish(
+            'topic', b'later', defer=100)
+        assert [m.body for m in consume(nsqd.tcp_address, 1)] == [b'later']
+        assert time.time() - start >= 0.1
+
+
+def test_heartbeat():
+    with FakeNsqd() as nsqd:
+        conn = NsqdTCPClient(
+            '127.0.0.1', nsqd.tcp_port, heartbeat_interval=0.05)
+        conn.connect()
+        conn.identify()
+
+        assert conn.read_response() == (
+            nsq.FRAME_TYPE_RESPONSE, nsq.HEARTBEAT)
+        conn.close_stream()
+
+
+def test_throughput():
+    with FakeNsqd(throughput=100) as nsqd:
+        for _ in range(10):
+            nsqd.publish('topic', b'hi')
+
+        start = time.time()
+        consume(nsqd.tcp_address, 10, max_in_flight=10)
+        assert time.time() - start >= 0.09
+
+
+def test_faults():
+    faults = Faults(latency=0.01, error_rate=1, seed=1)
+
+    with FakeNsqd(faults=faults) as nsqd:
+        conn = NsqdTCPClient('127.0.0.1', nsqd.tcp_port)
+        conn.connect()
+
+        start = time.time()
+        conn.identify()
+        assert time.time() - start >= 0.01
+
+        conn.publish('topic', b'fail')
+        frame, error = conn.read_response()
+        assert frame == nsq.FRAME_TYPE_ERROR
+        assert isinstance(error, errors.NSQPubFailed)
+        assert not conn.is_connected
+
+        faults.error_rate = 0
+        conn = NsqdTCPClient('127.0.0.1', nsqd.tcp_port)
+        conn.connect()
+        conn.identify()
+        conn.publish('topic', b'ok')
+        assert conn.read_response() == (nsq.FRAME_TYPE_RESPONSE, nsq.OK)
+
+
+def test_http():
+    with FakeNsqd() as nsqd:
+        http = NsqdHTTPClient('127.0.0.1', nsqd.http_port)
+        assert http.ping() == b'OK'
+
+        http.create_channel('topic', 'channel')
+        http.multipublish('topic', [b'a', b'b'])
+        http.multipublish('topic', [b'c'], binary=True)
+
+        stats = http.stats(topic='topic')
+        channel = stats['topics'][0]['channels'][0]
+        assert channel['channel_name'] == 'channel'
+        assert channel['depth'] == 3
+
+        http.empty_channel('topic', 'channel')
+        assert http.stats()['topics'][0]['channels'][0]['depth'] == 0
+
+        with pytest.raises(errors.NSQHttpError):
+            http.empty_topic('missing')
+
+
+def test_lookupd():
+    with FakeLookupd() as lookupd, FakeNsqd(lookupd=lookupd) as nsqd:
+        nsqd.publish('topic', b'found')
+
+        client = LookupdClient('127.0.0.1', lookupd.http_port)
+        assert client.ping() == b'OK'
+        assert client.topics() == {'topics': ['topic']}
+
+        producers = client.lookup('topic')['producers']
+        assert [p['tcp_port'] for p in producers] == [nsqd.tcp_port]
+
+        with pytest.raises(errors.NSQHttpError):
+            client.lookup('missing')
+
+        consumer = Consumer(
+            'topic', 'channel',
+            lookupd_http_addresses=['http://' + lookupd.http_address])
+
+        messages = []
+
+        @consumer.on_message.connect
+        def handler(consumer, message):
+            messages.append(message.body)
+            consumer.close()
+
+        consumer.start(block=False)
+        with gevent.Timeout(5):
+            consumer.join()
+
+        assert messages == [b'found']
+        assert client.channels('topic') == {'channels': ['channel']}
+
+
+def test_threaded_backend():
+    with FakeNsqd() as nsqd:
+        for i in range(20):
+            nsqd.publish('topic', six.b('%d' % i))
+
+        done = threading.Event()
+        messages = []
+
+        def handler(consumer, message):
+            messages.append(message.body)
+            if len(messages) == 20:
+                done.set()
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, message_handler=handler,
+            max_in_flight=5, backend='threading')
+
+        consumer.start(block=False)
+        assert done.wait(5)
+        consumer.close()
+
+    assert sorted(messages) == sorted(six.b('%d' % i) for i in range(20))
@@ -0,0 +1,260 @@
+import base64
+import json
+
+import gevent
+import pytest
+
+from blinker import Signal
+
+from gnsq import Consumer, NsqdHTTPClient, Producer
+from gnsq.contrib.giveup import DeadLetterForwarder
+from gnsq.message import Message
+from gnsq.metrics import MetricsRegistry
+from gnsq.testing import FakeNsqd
+
+
+class FakeTopic(object):
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+
+    def multipublish(self, messages):
+        if self.fail:
+            raise RuntimeError('publish failed')
+        self.batches.append(list(messages))
+
+
+class FakePublisher(object):
+    def __init__(self):
+        self.handle = FakeTopic()
+
+    def topic(self, name):
+        return self.handle
+
+
+class FakeConsumer(object):
+    topic = 'topic'
+    channel = 'channel'
+
+    def __init__(self):
+        self.on_close = Signal()
+
+
+def make_message(body, attempts=5):
+    return Message(1234, attempts, b'0123456789abcdef', body)
+
+
+def test_envelope():
+    forwarder = DeadLetterForwarder('bury', FakePublisher(), flush_interval=60)
+    consumer = FakeConsumer()
+
+    data = json.loads(forwarder.format_message(
+        consumer, make_message(b'body')).decode('utf-8'))
+    assert data['topic'] == 'topic'
+    assert data['channel'] == 'channel'
+    assert data['id'] == '0123456789abcdef'
+    assert data['attempts'] == 5
+    assert data['timestamp'] == 1234
+    assert data['body'] == 'body'
+    assert 'encoding' not in data
+
+    data = json.loads(forwarder.format_message(
+        consumer, make_message(b'\xff\x00')).decode('utf-8'))
+    assert data['encoding'] == 'base64'
+    assert base64.b64decode(data['body']) == b'\xff\x00'
+
+    forwarder.use_envelope = False
+    assert forwarder.format_message(consumer, make_message(b'raw')) == b'raw'
+    forwarder.kill()
+
+
+def test_batches_and_close():
+    publisher = FakePublisher()
+    forwarder = DeadLetterForwarder(
+        'bury', publisher, batch_size=3, flush_interval=60, envelope=False)
+    consumer = FakeConsumer()
+
+    for i in range(7):
+        forwarder(consumer, make_message(b'%d' % i))
+    gevent.sleep(0.01)
+    assert publisher.handle.batches == [[b'0', b'1', b'2'], [b'3', b'4', b'5']]
+
+    consumer.on_close.send(consumer)
+    assert publisher.handle.batches[-1] == [b'6']
+    assert forwarder.forwarded.value == 7
+    forwarder.close()
+
+
+def test_overflow():
+    publisher = FakePublisher()
+    publisher.handle.fail = True
+    registry = MetricsRegistry()
+    forwarder = DeadLetterForwarder(
+        'bury', publisher, batch_size=10, max_buffered=3, flush_interval=60,
+        envelope=False, registry=registry, labels={'topic': 'bury'})
+
+    for i in range(5):
+        forwarder.put(b'%d' % i)
+    assert list(forwarder.buffer) == [b'2', b'3', b'4']
+
+    with pytest.raises(RuntimeError):
+        forwarder.flush()
+    assert list(forwarder.buffer) == [b'2', b'3', b'4']
+
+    forwarder.overflow = 'drop_newest'
+    forwarder.put(b'5')
+    assert list(forwarder.buffer) == [b'2', b'3', b'4']
+    assert forwarder.dropped.value == 3
+
+    text = registry.to_prometheus()
+    assert 'gnsq_giveup_dropped_total{topic="bury"} 3' in text
+    assert 'gnsq_giveup_buffered{topic="bury"} 3' in text
+
+    publisher.handle.fail = False
+    forwarder.close()
+    assert publisher.handle.batches == [[b'2', b'3', b'4']]
+
+
+def test_overflow_block():
+    publisher = FakePublisher()
+    forwarder = DeadLetterForwarder(
+        'bury', publisher, batch_size=2, max_buffered=2, flush_interval=60,
+        overflow='block', envelope=False)
+
+    forwarder.put(b'0')
+    forwarder.put(b'1')
+    blocked = gevent.spawn(forwarder.put, b'2')
+    gevent.sleep(0.01)
+    assert blocked.ready()
+    assert publisher.handle.batches == [[b'0', b'1']]
+    assert list(forwarder.buffer) == [b'2']
+    forwarder.kill()
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        DeadLetterForwarder('bury', FakePublisher(), overflow='explode')
+    with pytest.raises(ValueError):
+        DeadLetterForwarder('bury', [])
+
+
+@pytest.mark.parametrize('transport', ['tcp', 'http'])
+def test_forward_giving_up(transport):
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.multipublish('topic', [b'a', b'b', b'c'])
+
+        if transport == 'tcp':
+            publisher = producer
+        else:
+            publisher = [NsqdHTTPClient('127.0.0.1', nsqd.http_port)] * 2
+
+        forwarder = DeadLetterForwarder(
+            'topic.bury', publisher, batch_size=10, flush_interval=60)
+
+        def handler(consumer, message):
+            raise RuntimeError('poison')
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_tries=2,
+            requeue_delay=0, max_backoff_duration=0.01, max_in_flight=3,
+            message_handler=handler)
+        consumer.on_giving_up.connect(forwarder, weak=False)
+        consumer.start(block=False)
+
+        with gevent.Timeout(5):
+            while len(forwarder.buffer) < 3:
+                gevent.sleep(0.01)
+
+        topics = [t['topic_name'] for t in nsqd.stats()['topics']]
+        assert 'topic.bury' not in topics
+        consumer.close()
+        consumer.join()
+
+        topic = nsqd.call(nsqd.get_topic, 'topic.bury')
+        assert topic.message_count == 3
+
+        envelopes = [json.loads(m.body.decode('utf-8')) for m in topic.backlog]
+        assert sorted(e['body'] for e in envelopes) == ['a', 'b', 'c']
+        assert all(e['attempts'] == 3 for e in envelopes)
+        assert all(e['channel'] == 'channel' for e in envelopes)
+
+        forwarder.close()
+        producer.close()
+
+
+def test_close_during_publish():
+    class SlowTopic(FakeTopic):
+        def multipublish(self, messages):
+            gevent.sleep(0.05)
+            super(SlowTopic, self).multipublish(messages)
+
+    publisher = FakePublisher()
+    publisher.handle = SlowTopic()
+    forwarder = DeadLetterForwarder(
+        'bury', publisher, batch_size=2, flush_interval=60, envelope=False)
+
+    for i in range(3):
+        forwarder.put(b'%d' % i)
+    gevent.sleep(0.01)
+    assert list(forwarder.buffer) == [b'2']
+
+    forwarder.close()
+    assert publisher.handle.batches == [[b'0', b'1'], [b'2']]
+    assert forwarder.forwarded.value == 3
+
+
+def test_kill_during_publish_keeps_batch():
+    publisher = FakePublisher()
+    publisher.handle.multipublish = lambda messages: gevent.sleep(1)
+    forwarder = DeadLetterForwarder(
+        'bury', publisher, batch_size=2, flush_interval=60, envelope=False)
+
+    forwarder.put(b'0')
+    forwarder.put(b'1')
+    gevent.sleep(0.01)
+    assert not forwarder.buffer
+
+    forwarder.kill()
+    assert list(forwarder.buffer) == [b'0', b'1']
+
+
+def test_failed_batch_dropped():
+    publisher = FakePublisher()
+    publisher.handle.fail = True
+    forwarder = DeadLetterForwarder(
+        'bury', publisher, batch_size=2, flush_interval=60, envelope=False,
+        max_retries=2)
+
+    forwarder.put(b'0')
+    forwarder.put(b'1')
+    forwarder.put(b'2')
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            forwarder.flush()
+        assert list(forwarder.buffer) == [b'0', b'1', b'2']
+
+    with pytest.raises(RuntimeError):
+        forwarder.flush()
+    assert list(forwarder.buffer) == [b'2']
+    assert forwarder.dropped.value == 2
+
+    publisher.handle.fail = False
+    forwarder.close()
+    assert publisher.handle.batches == [[b'2']]
+
+
+def test_forward_newlines_over_http():
+    with FakeNsqd() as nsqd:
+        forwarder = DeadLetterForwarder(
+            'topic.bury', NsqdHTTPClient('127.0.0.1', nsqd.http_port),
+            flush_interval=60, envelope=False)
+
+        forwarder.put(b'line\nbreak')
+        forwarder.put(b'plain')
+        forwarder.close()
+
+        topic = nsqd.call(nsqd.get_topic, 'topic.bury')
+        assert sorted(m.body for m in topic.backlog) == [
+            b'line\nbreak', b'plain']
@@ -0,0 +1,160 @@
+import gevent
+
+from gnsq import Consumer, Producer
+from gnsq import consumer as consumer_module
+from gnsq.testing import FakeNsqd
+
+
+class Conn(object):
+    def __init__(self, in_flight, in_flight_bytes):
+        self.in_flight = in_flight
+        self.in_flight_bytes = in_flight_bytes
+
+
+def test_bytes_ready_limit():
+    consumer = Consumer(
+        'topic', 'channel', '127.0.0.1:4150', max_in_flight=100,
+        max_in_flight_bytes=10000)
+    assert consumer._bytes_ready_limit() == 1
+
+    # RDY 1 per connection until a message size is known.
+    consumer._connections[Conn(0, 0)] = None
+    consumer._connections[Conn(0, 0)] = None
+    assert consumer._bytes_ready_limit() == 2
+    consumer._connections.clear()
+
+    consumer._mean_message_size = 1000
+    assert consumer._bytes_ready_limit() == 10
+
+    consumer._connections[Conn(2, 3000)] = None
+    consumer._connections[Conn(1, 1000)] = None
+    assert consumer.total_in_flight_bytes == 4000
+    assert consumer._bytes_ready_limit() == 3 + 6
+
+    consumer._connections[Conn(1, 9000)] = None
+    assert consumer._bytes_ready_limit() == 1
+
+
+def test_in_flight_bytes_budget():
+    body = b'x' * 1000
+
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.multipublish('topic', [body] * 10)
+        producer.close()
+
+        held = []
+        finished = []
+
+        def handler(consumer, message):
+            if finished:
+                message.enable_async()
+                held.append(message)
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_in_flight=10,
+            max_in_flight_bytes=2500, message_handler=handler, metrics=True)
+        consumer.on_finish.connect(
+            lambda consumer, message_id: finished.append(message_id),
+            weak=False)
+
+        consumer.start(block=False)
+        gevent.sleep(0.2)
+
+        assert len(finished) == 1
+        assert 1 <= len(held) <= 3
+        assert consumer.total_in_flight_bytes == 1000 * len(held)
+
+        text = consumer.metrics.to_prometheus()
+        assert 'gnsq_consumer_in_flight_bytes{' in text
+        assert 'gnsq_consumer_max_in_flight_bytes{' in text
+
+        with gevent.Timeout(2):
+            while len(finished) < 10:
+                for message in held[:]:
+                    held.remove(message)
+                    message.finish()
+                gevent.sleep(0.01)
+
+        assert consumer.total_in_flight_bytes == 0
+        consumer.close()
+
+
+
+def test_in_flight_bytes_ready_updates():
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+
+        held = []
+
+        def handler(consumer, message):
+            if len(message.body) > 1000:
+                message.enable_async()
+                held.append(message)
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_in_flight=100,
+            max_in_flight_bytes=2500, message_handler=handler)
+        consumer.start(block=False)
+
+        def wait_for_ready(count):
+            with gevent.Timeout(2):
+                while consumer.total_ready_count != count:
+                    gevent.sleep(0.01)
+
+        producer.publish('topic', b'x' * 1000)
+        wait_for_ready(2)
+
+        # Still under budget, but there is no room for another message.
+        producer.publish('topic', b'x' * 2000)
+        wait_for_ready(1)
+
+        held[0].finish()
+        wait_for_ready(2)
+
+        producer.close()
+        consumer.close()
+
+
+def test_in_flight_bytes_abandoned(monkeypatch):
+    monkeypatch.setattr(consumer_module, 'AUTO_TOUCH_TICK', 0.01)
+
+    with FakeNsqd(msg_timeout=0.05) as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.publish('topic', b'x' * 1000)
+        producer.close()
+
+        abandoned = []
+        released = []
+
+        def handler(consumer, message):
+            if message.attempts == 1:
+                gevent.sleep(1)
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, message_handler=handler,
+            kill_expired=True, max_in_flight_bytes=2500, metrics=True)
+        monkeypatch.setattr(
+            consumer, '_release_bytes',
+            lambda: released.append(consumer.total_in_flight_bytes))
+
+        consumer.start(block=False)
+        with gevent.Timeout(2):
+            while not consumer._connections:
+                gevent.sleep(0.01)
+
+            conn, = consumer._connections
+            conn.on_abandon.connect(
+                lambda conn, message: abandoned.append(message), weak=False)
+
+            while not abandoned:
+                gevent.sleep(0.01)
+
+        assert released[0] == 0
+        text = consumer.metrics.to_prometheus()
+        assert 'gnsq_consumer_messages_abandoned_total{%s} 1.0' % (
+            'channel="channel",nsqd="%s",topic="topic"' % conn) in text
+        consumer.close()
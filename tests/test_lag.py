@@ -0,0 +1,77 @@
+import time
+
+import gevent
+
+from gnsq import Consumer, Message, Producer
+from gnsq.lag import LagTracker
+from gnsq.metrics import MetricsRegistry
+from gnsq.testing import FakeNsqd
+
+
+def message(age):
+    return Message(int((time.time() - age) * 1e9), 1, b'1234', b'body')
+
+
+def test_lag_tracker():
+    lag = LagTracker(buckets=(1, 10, 100))
+    assert lag.percentile(50) is None
+
+    first = message(0.5)
+    lag.received(first)
+    lag.received(message(5))
+    first.finish()
+
+    assert lag.percentiles() == {
+        'receive': {50: 1, 90: 10, 99: 10},
+        'finish': {50: 1, 90: 1, 99: 1},
+    }
+
+    lag.roll()
+    assert lag.percentile(99) == 10
+
+    lag.received(message(50))
+    lag.roll()
+    assert lag.percentile(50) == 100
+    assert lag.percentile(50, 'finish') is None
+
+
+def test_registry():
+    registry = MetricsRegistry()
+    lag = LagTracker(registry, {'topic': 'topic'})
+    lag.received(message(0))
+
+    text = registry.to_prometheus()
+    assert 'gnsq_consumer_receive_lag_seconds_count{topic="topic"} 1.0' in text
+    assert 'gnsq_consumer_finish_lag_seconds_count{topic="topic"} 0.0' in text
+
+
+def test_consumer_on_lag():
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.publish('topic', b'hello')
+        producer.close()
+
+        gevent.sleep(0.02)
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, lag_slo=0.005,
+            lag_interval=0.05, message_handler=lambda consumer, message: None)
+        assert consumer.lag is not None
+
+        breaches = []
+
+        @consumer.on_lag.connect
+        def on_lag(consumer, kind, percentile, lag):
+            breaches.append((kind, percentile, lag))
+            consumer.close()
+
+        consumer.start(block=False)
+        with gevent.Timeout(5):
+            consumer.join()
+
+        kind, percentile, lag = breaches[0]
+        assert (kind, percentile) == ('receive', 99)
+        assert lag >= 0.025
+        assert consumer.lag.percentile(99, 'finish') >= 0.025
+        assert Consumer('topic', 'channel', nsqd.tcp_address).lag is None
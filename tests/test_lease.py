@@ -0,0 +1,159 @@
+import time
+
+import gevent
+import pytest
+
+from gnsq import Consumer, NsqdTCPClient, Producer
+from gnsq import protocol as nsq
+from gnsq import consumer as consumer_module
+from gnsq.message import Lease, Message
+from gnsq.testing import FakeNsqd
+
+
+class Conn(object):
+    is_connected = True
+
+
+def test_lease():
+    conn = Conn()
+    lease = Lease(conn, 0.05)
+    assert not lease.is_expired()
+    assert 0 < lease.remaining() <= 0.05
+
+    time.sleep(0.06)
+    assert lease.is_expired()
+    lease.renew()
+    assert not lease.is_expired()
+
+    conn.is_connected = False
+    assert lease.is_expired()
+
+    message = Message(0, 1, b'1234', b'body')
+    assert not message.is_expired()
+    message.lease = lease
+    assert message.is_expired()
+
+
+def test_lease_fractional_timeout():
+    conn = NsqdTCPClient(msg_timeout=1.5)
+    data = nsq.MESSAGE_HEADER.pack(0, 1) + b'0123456789abcdef' + b'body'
+    message = conn.handle_message(data)
+    assert message.lease.timeout == 1.5
+    assert 1.4 < message.lease.remaining() <= 1.5
+
+
+def test_expired_responses_suppressed():
+    with FakeNsqd(msg_timeout=0.05) as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.publish('topic', b'slow')
+        producer.close()
+
+        handled = []
+        errors = []
+
+        def handler(consumer, message):
+            handled.append(message.attempts)
+            if message.attempts == 1:
+                gevent.sleep(0.1)
+                assert message.is_expired()
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, message_handler=handler)
+        consumer.on_error.connect(
+            lambda consumer, error: errors.append(error), weak=False)
+        consumer.on_exception.connect(
+            lambda consumer, **kwargs: errors.append(kwargs), weak=False)
+
+        consumer.start(block=False)
+        with gevent.Timeout(2):
+            while 2 not in handled:
+                gevent.sleep(0.01)
+
+            conn, = consumer._connections
+            while conn.in_flight:
+                gevent.sleep(0.01)
+
+        consumer.close()
+        assert handled == [1, 2]
+        assert errors == []
+
+
+def test_kill_expired(monkeypatch):
+    monkeypatch.setattr(consumer_module, 'AUTO_TOUCH_TICK', 0.01)
+
+    with pytest.raises(ValueError):
+        Consumer('topic', 'channel', '127.0.0.1:4150', kill_expired=True,
+                 backend='threading')
+
+    with FakeNsqd(msg_timeout=0.05) as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.publish('topic', b'stuck')
+        producer.close()
+
+        started = []
+        completed = []
+
+        def handler(consumer, message):
+            started.append(message.attempts)
+            if message.attempts == 1:
+                gevent.sleep(1)
+            completed.append(message.attempts)
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, message_handler=handler,
+            kill_expired=True, max_in_flight=2)
+
+        consumer.start(block=False)
+        with gevent.Timeout(2):
+            while 2 not in completed:
+                gevent.sleep(0.01)
+
+            conn, = consumer._connections
+            while conn.in_flight:
+                gevent.sleep(0.01)
+
+        consumer.close()
+
+        assert started == [1, 2]
+        assert completed == [2]
+
+
+def test_kill_expired_without_auto_touch(monkeypatch):
+    monkeypatch.setattr(consumer_module, 'AUTO_TOUCH_TICK', 0.01)
+
+    with FakeNsqd(msg_timeout=0.05) as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.publish('topic', b'stuck')
+        producer.close()
+
+        touched = []
+        killed = []
+        completed = []
+
+        def handler(consumer, message):
+            message.on_touch.connect(touched.append, weak=False)
+            try:
+                if message.attempts == 1:
+                    gevent.sleep(0.2)
+            except gevent.GreenletExit:
+                killed.append(message.attempts)
+                raise
+            completed.append(message.attempts)
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, message_handler=handler,
+            kill_expired=True)
+
+        consumer.start(block=False)
+        with gevent.Timeout(2):
+            while 2 not in completed:
+                gevent.sleep(0.01)
+
+        consumer.close()
+
+        assert killed == [1]
+        assert completed == [2]
+        assert touched == []
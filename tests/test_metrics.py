@@ -0,0 +1,153 @@
+import socket
+
+import gevent
+import pytest
+
+from gnsq import Consumer, Producer
+from gnsq.errors import NSQRequeueMessage
+from gnsq.metrics import ConsumerMetrics, MetricsRegistry, StatsdExporter
+from gnsq.testing import FakeNsqd
+
+
+def test_histogram():
+    registry = MetricsRegistry()
+    histogram = registry.histogram(
+        'latency_seconds', 'Latency.', buckets=[1, 0.1]).labels()
+
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 2, 1]
+    assert histogram.count == 4
+    assert histogram.sum == 6.05
+    assert histogram.percentile(25) == 0.1
+    assert histogram.percentile(50) == 1
+    assert histogram.percentile(100) == 1
+
+
+def test_prometheus():
+    registry = MetricsRegistry()
+    registry.counter('requests_total', 'Requests.').labels(path='/').inc(3)
+    registry.gauge('depth', 'Depth.').labels().set(2)
+    registry.histogram('seconds', 'Time.', buckets=[0.5]).labels(
+        path='/').observe(0.25)
+
+    with pytest.raises(ValueError):
+        registry.gauge('requests_total', 'Requests.')
+
+    assert registry.to_prometheus().splitlines() == [
+        '# HELP gnsq_requests_total Requests.',
+        '# TYPE gnsq_requests_total counter',
+        'gnsq_requests_total{path="/"} 3.0',
+        '# HELP gnsq_depth Depth.',
+        '# TYPE gnsq_depth gauge',
+        'gnsq_depth 2.0',
+        '# HELP gnsq_seconds Time.',
+        '# TYPE gnsq_seconds histogram',
+        'gnsq_seconds_bucket{path="/",le="0.5"} 1.0',
+        'gnsq_seconds_bucket{path="/",le="+Inf"} 1.0',
+        'gnsq_seconds_sum{path="/"} 0.25',
+        'gnsq_seconds_count{path="/"} 1.0',
+    ]
+
+
+def test_statsd():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+
+    registry = MetricsRegistry()
+    counter = registry.counter('requests_total', 'Requests.').labels(
+        path='/a.b')
+    histogram = registry.histogram('seconds', 'Time.', buckets=[0.5, 1])
+    histogram = histogram.labels()
+
+    exporter = StatsdExporter(registry, port=server.getsockname()[1])
+
+    counter.inc(3)
+    histogram.observe(0.25)
+    exporter.flush()
+    assert server.recv(4096).split(b'\n') == [
+        b'gnsq_requests_total._a_b:3|c',
+        b'gnsq_seconds.count:1|c',
+        b'gnsq_seconds.sum:0.25|c',
+        b'gnsq_seconds.p50:0.5|g',
+        b'gnsq_seconds.p90:0.5|g',
+        b'gnsq_seconds.p99:0.5|g',
+    ]
+
+    counter.inc()
+    histogram.observe(0.75)
+    exporter.flush()
+    assert server.recv(4096).split(b'\n') == [
+        b'gnsq_requests_total._a_b:1|c',
+        b'gnsq_seconds.count:1|c',
+        b'gnsq_seconds.sum:0.75|c',
+        b'gnsq_seconds.p50:1|g',
+        b'gnsq_seconds.p90:1|g',
+        b'gnsq_seconds.p99:1|g',
+    ]
+
+    server.close()
+
+
+def test_consumer_metrics():
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.multipublish('topic', [b'ok', b'requeue', b'ok'])
+        producer.close()
+
+        handled = []
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_in_flight=10,
+            max_tries=1, metrics=True)
+        assert isinstance(consumer.metrics, MetricsRegistry)
+
+        @consumer.on_message.connect
+        def handler(consumer, message):
+            handled.append(message.body)
+            if message.body == b'requeue':
+                raise NSQRequeueMessage(backoff=False)
+
+        @consumer.on_finish.connect
+        def on_finish(consumer, message_id):
+            if len(handled) == 3:
+                consumer.close()
+
+        consumer.start(block=False)
+        with gevent.Timeout(5):
+            consumer.join()
+
+        labels = {
+            'topic': 'topic', 'channel': 'channel',
+            'nsqd': nsqd.tcp_address}
+
+        def value(name):
+            family = consumer.metrics._families['gnsq_consumer_' + name]
+            return family.labels(**labels).value
+
+        assert value('messages_received_total') >= 3
+        assert value('messages_given_up_total') == \
+            value('messages_received_total') - 3
+        assert value('messages_finished_total') >= 2
+        assert value('messages_requeued_total') == 1
+        assert value('connections_total') == 1
+
+        metrics = consumer._metrics
+        assert metrics.handler_seconds.count == \
+            value('messages_received_total')
+
+        text = consumer.metrics.to_prometheus()
+        assert 'gnsq_consumer_handler_seconds_count{' in text
+        assert 'gnsq_consumer_max_in_flight{' in text
+
+
+def test_shared_registry():
+    registry = MetricsRegistry()
+    first = Consumer('a', 'channel', '127.0.0.1:4150', metrics=registry)
+    second = Consumer('b', 'channel', '127.0.0.1:4150', metrics=registry)
+
+    assert isinstance(first._metrics, ConsumerMetrics)
+    assert first.metrics is second.metrics is registry
+    assert Consumer('topic', 'channel', '127.0.0.1:4150').metrics is None
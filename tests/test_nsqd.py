@@ -14,7 +14,7 @@ from gnsq import NsqdTCPClient, Message, states, errors
 from gnsq import protocol as nsq
 from gnsq.stream.stream import SSLSocket, DefalteSocket, SnappySocket
 
-from mock_server import mock_server
+from mock_server import mock_server, mock_response, mock_response_message
 from integration_server import NsqdIntegrationServer
 
 
@@ -25,21 +25,6 @@ BAD_GEVENT = all([
 ])
 
 
-def mock_response(frame_type, data):
-    body_size = 4 + len(data)
-    body_size_packed = struct.pack('>l', body_size)
-    frame_type_packed = struct.pack('>l', frame_type)
-    return body_size_packed + frame_type_packed + data
-
-
-def mock_response_message(timestamp, attempts, id, body):
-    timestamp_packed = struct.pack('>q', timestamp)
-    attempts_packed = struct.pack('>h', attempts)
-    id = six.b('%016d' % id)
-    data = timestamp_packed + attempts_packed + id + body
-    return mock_response(nsq.FRAME_TYPE_MESSAGE, data)
-
-
 def test_connection():
     @mock_server
     def handle(socket, address):
@@ -331,6 +316,38 @@ def test_sync_heartbeat():
         assert data == b'_heartbeat_'
 
 
+@pytest.mark.parametrize('max_batch_size,sizes', [
+    (None, [5]),
+    (2, [2, 2, 1]),
+])
+def test_batch_messages(max_batch_size, sizes):
+    @mock_server
+    def handle(socket, address):
+        assert socket.recv(4) == b'  V2'
+        socket.sendall(b''.join(
+            mock_response_message(0, 1, i, b'body') for i in range(5)))
+        socket.sendall(mock_response(nsq.FRAME_TYPE_RESPONSE, b'OK'))
+
+    with handle as server:
+        conn = NsqdTCPClient(
+            '127.0.0.1', server.server_port, max_batch_size=max_batch_size)
+
+        batches = []
+        conn.on_message.connect(
+            lambda conn, message: batches.append(message), weak=False)
+        conn.on_messages.connect(
+            lambda conn, messages: batches.append(messages), weak=False)
+
+        conn.connect()
+        with pytest.raises(errors.NSQSocketError):
+            conn.listen()
+
+        assert [len(batch) for batch in batches] == sizes
+        assert [m.id for batch in batches for m in batch] == [
+            six.b('%016d' % i) for i in range(5)]
+        assert conn.in_flight == 5
+
+
 def test_auth():
     @mock_server
     def handle(socket, address):
@@ -0,0 +1,149 @@
+import gevent
+import gevent.event
+
+from gnsq import Consumer, Producer, states
+from gnsq.contrib.partition import PartitionedHandler, partition_hash
+from gnsq.testing import FakeNsqd
+
+
+class FakeConsumer(object):
+    requeue_delay = 0
+    backoff_on_requeue = True
+
+    def __init__(self):
+        self.limits = []
+        self.redistributed = 0
+
+    def add_ready_limit(self, limit):
+        self.limits.append(limit)
+
+    def redistribute_ready_state(self):
+        self.redistributed += 1
+
+
+class FakeMessage(object):
+    def __init__(self, body):
+        self.body = body
+        self.responded = None
+
+    def enable_async(self):
+        pass
+
+    def has_responded(self):
+        return self.responded is not None
+
+    def finish(self):
+        self.responded = 'finish'
+
+    def requeue(self, delay, backoff):
+        self.responded = 'requeue'
+
+
+def test_partition_hash():
+    assert partition_hash(b'key') == partition_hash(u'key')
+    assert partition_hash(b'key') != partition_hash(b'other')
+    assert partition_hash(7) == hash(7)
+
+
+class Conn(object):
+    last_message = float('inf')
+
+
+def test_consumer_ready_limits():
+    consumer = Consumer('topic', 'channel', 'localhost:4150', max_in_flight=10)
+    conns = [Conn(), Conn()]
+    for conn in conns:
+        consumer._connections[conn] = states.RUNNING
+
+    assert sum(consumer._get_ready_state().values()) == 10
+
+    limit = [4]
+    consumer.add_ready_limit(lambda: limit[0])
+    assert sum(consumer._get_ready_state().values()) == 4
+
+    limit[0] = None
+    assert sum(consumer._get_ready_state().values()) == 10
+
+    limit[0] = -1
+    assert consumer._get_ready_state() == {conn: 0 for conn in conns}
+
+
+def test_ready_limit():
+    release = gevent.event.Event()
+    handler = PartitionedHandler(
+        lambda message: b'hot', lambda consumer, message: release.wait(),
+        lanes=4, lane_budget=2, max_lane_depth=5)
+    consumer = FakeConsumer()
+
+    assert handler.ready_limit() == 8
+
+    messages = [FakeMessage(b'%d' % i) for i in range(8)]
+    for message in messages:
+        handler(consumer, message)
+
+    assert consumer.limits == [handler.ready_limit]
+    assert consumer.redistributed == 6
+    assert handler.lane(b'hot').depth == 8
+    assert handler.ready_limit() == 3 * 2 + 5
+
+    release.set()
+    gevent.sleep(0.01)
+    assert handler.ready_limit() == 8
+    assert all(m.responded == 'finish' for m in messages)
+    handler.kill()
+
+
+def test_handler_error_requeues():
+    def handle(consumer, message):
+        raise ValueError(message.body)
+
+    handler = PartitionedHandler(lambda message: message.body, handle)
+    message = FakeMessage(b'boom')
+    handler(FakeConsumer(), message)
+    gevent.sleep(0.01)
+    assert message.responded == 'requeue'
+    handler.kill()
+
+
+def test_ordering_per_key():
+    bodies = [('%s-%d' % (key, i)).encode() for i in range(20) for key in 'da']
+    hot = gevent.event.Event()
+    seen = {'a': [], 'd': []}
+
+    # The first message is from the cold key, so the connection leaves its
+    # RDY 1 throttled state before the hot key stalls.
+    def handle(consumer, message):
+        key, _ = message.body.decode().split('-')
+        if key == 'a' and not hot.is_set():
+            # The hot key stalls without holding up the other lane.
+            hot.wait()
+        seen[key].append(message.body)
+        if len(seen['d']) == 20:
+            hot.set()
+
+    def key(message):
+        return message.body.split(b'-')[0]
+
+    handler = PartitionedHandler(key, handle, lanes=2, lane_budget=4)
+    assert handler.lane(b'a') is not handler.lane(b'd')
+
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.multipublish('topic', bodies)
+        producer.close()
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_in_flight=32,
+            message_handler=handler)
+        consumer.start(block=False)
+
+        with gevent.Timeout(5):
+            while len(seen['a']) + len(seen['d']) < len(bodies):
+                gevent.sleep(0.01)
+
+        consumer.close()
+        handler.kill()
+
+    assert seen['a'] == [b for b in bodies if b.startswith(b'a')]
+    assert seen['d'] == [b for b in bodies if b.startswith(b'd')]
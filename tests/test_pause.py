@@ -0,0 +1,89 @@
+import gevent
+import gevent.event
+
+from gnsq import Consumer, Producer
+from gnsq.testing import FakeNsqd
+
+
+def publish(nsqd, count):
+    producer = Producer(nsqd.tcp_address)
+    producer.start()
+    producer.multipublish('topic', [b'%d' % i for i in range(count)])
+    producer.close()
+
+
+def wait_for(condition):
+    with gevent.Timeout(2):
+        while not condition():
+            gevent.sleep(0.01)
+
+
+def test_pause_resume():
+    with FakeNsqd() as nsqd:
+        publish(nsqd, 10)
+        received = []
+
+        def handler(consumer, message):
+            received.append(message.body)
+            if len(received) == 3:
+                consumer.pause()
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, message_handler=handler)
+        consumer.start(block=False)
+
+        wait_for(lambda: consumer.is_paused)
+        gevent.sleep(0.1)
+
+        conn, = consumer._connections
+        assert conn.is_connected
+        assert conn.ready_count == 0
+        assert len(received) == 3
+
+        consumer.resume()
+        assert not consumer.is_paused
+        wait_for(lambda: len(received) == 10)
+        consumer.close()
+
+
+def test_pressure_sources():
+    with FakeNsqd() as nsqd:
+        publish(nsqd, 10)
+        received = []
+        pressure = [0]
+        saturated = gevent.event.Event()
+
+        def handler(consumer, message):
+            gevent.sleep(0.03)
+            received.append(message.body)
+            if len(received) == 2:
+                pressure[0] = 100
+            elif len(received) == 6:
+                saturated.set()
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, message_handler=handler)
+        consumer.add_pressure_source(
+            lambda: pressure[0], threshold=50, resume_threshold=10,
+            interval=0.01)
+        consumer.start(block=False)
+        consumer.add_pressure_source(saturated, interval=0.01)
+
+        wait_for(lambda: consumer.is_paused)
+        gevent.sleep(0.05)
+        count = len(received)
+        assert count <= 4
+
+        pressure[0] = 20
+        gevent.sleep(0.05)
+        assert consumer.is_paused
+
+        pressure[0] = 0
+        wait_for(lambda: len(received) >= 6 and consumer.is_paused)
+        gevent.sleep(0.05)
+        assert len(received) <= 8
+
+        saturated.clear()
+        wait_for(lambda: len(received) == 10)
+        assert not consumer.is_paused
+        consumer.close()
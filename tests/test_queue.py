@@ -0,0 +1,71 @@
+import gevent
+
+from gnsq import Consumer, Producer
+from gnsq.contrib.queue import QueueHandler
+from gnsq.metrics import MetricsRegistry
+from gnsq.testing import FakeNsqd
+
+
+def test_watermarks():
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.multipublish('topic', [b'%d' % i for i in range(30)])
+        producer.close()
+
+        registry = MetricsRegistry()
+        queue = QueueHandler(
+            high_watermark=6, low_watermark=2, registry=registry,
+            labels={'queue': 'test'})
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_in_flight=20,
+            message_handler=queue)
+        consumer.start(block=False)
+
+        received = []
+        with gevent.Timeout(2):
+            # Finishing leaves the RDY 1 state a new connection starts in.
+            message = queue.get()
+            received.append(message.body)
+            message.finish()
+
+            while not queue.paused:
+                gevent.sleep(0.01)
+        gevent.sleep(0.1)
+
+        conn, = consumer._connections
+        assert conn.is_connected
+        assert conn.ready_count == 0
+        assert queue.qsize() >= 6
+
+        # Finishing messages while paused does not let more in.
+        while queue.qsize() > 3:
+            message = queue.get()
+            received.append(message.body)
+            message.finish()
+        gevent.sleep(0.05)
+        assert queue.qsize() == 3
+        assert queue.paused
+
+        message = queue.get()
+        received.append(message.body)
+        message.finish()
+        assert not queue.paused
+        gevent.sleep(0.05)
+        assert queue.qsize() > 2
+
+        with gevent.Timeout(2):
+            for message in queue:
+                received.append(message.body)
+                message.finish()
+                if len(received) == 30:
+                    break
+
+        assert not queue.paused
+        assert queue.queue_seconds.count == 30
+
+        text = registry.to_prometheus()
+        assert 'gnsq_queue_wait_seconds_count{queue="test"} 30' in text
+        assert 'gnsq_queue_depth{queue="test"} 0' in text
+
+        consumer.close()
@@ -0,0 +1,143 @@
+import gevent
+
+from gnsq import Consumer, Producer
+from gnsq.contrib.sentry import AggregatingSentryExceptionHandler
+from gnsq.message import Message
+from gnsq.metrics import MetricsRegistry
+from gnsq.testing import FakeNsqd
+
+
+class Clock(object):
+    now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.exceptions = []
+        self.messages = []
+
+    def captureException(self, exc_info, extra):
+        self.exceptions.append((exc_info, extra))
+
+    def captureMessage(self, message, extra):
+        self.messages.append((message, extra))
+
+
+def fail(handler, error, message=None):
+    try:
+        raise error
+    except Exception as error:
+        handler(None, message, error)
+
+
+def test_aggregates_within_window():
+    clock = Clock()
+    client = FakeClient()
+    registry = MetricsRegistry()
+    handler = AggregatingSentryExceptionHandler(
+        client, window=60, reports_per_window=2, clock=clock,
+        registry=registry, labels={'consumer': 'test'})
+
+    message = Message(1, 2, b'0123456789abcdef', b'body')
+    for _ in range(10):
+        fail(handler, ValueError('bad'), message)
+    fail(handler, KeyError('other'))
+    gevent.sleep(0.01)
+
+    assert len(client.exceptions) == 3
+    exc_info, extra = client.exceptions[0]
+    assert exc_info[0] is ValueError
+    assert extra['message']['body'] == b'body'
+    assert handler.suppressed.value == 8
+
+    clock.now += 60
+    handler.sweep()
+    (text, extra), = client.messages
+    assert text == 'suppressed 8 of 10 exceptions'
+    assert extra['suppressed'] == 8
+    assert 'ValueError' in extra['fingerprint']
+    assert not handler.windows
+
+    fail(handler, ValueError('bad'))
+    gevent.sleep(0.01)
+    assert len(client.exceptions) == 4
+
+    text = registry.to_prometheus()
+    assert 'gnsq_sentry_reported_total{consumer="test"} 4' in text
+    assert 'gnsq_sentry_suppressed_total{consumer="test"} 8' in text
+    handler.kill()
+
+
+def test_window_rolls_over_on_next_exception():
+    clock = Clock()
+    client = FakeClient()
+    handler = AggregatingSentryExceptionHandler(
+        client, window=60, clock=clock)
+
+    for _ in range(3):
+        fail(handler, ValueError('bad'))
+
+    clock.now += 61
+    fail(handler, ValueError('bad'))
+    handler.sweep()
+    gevent.sleep(0.01)
+
+    assert len(client.exceptions) == 2
+    (text, extra), = client.messages
+    assert extra['suppressed'] == 2
+    handler.kill()
+
+
+def test_sampling_and_bounded_queue():
+    client = FakeClient()
+    handler = AggregatingSentryExceptionHandler(
+        client, reports_per_window=0, sample_rate=1, max_queued=5)
+
+    # The worker does not run until we yield, so the queue fills up.
+    for _ in range(8):
+        fail(handler, ValueError('bad'))
+    assert handler.suppressed.value == 3
+
+    gevent.sleep(0.01)
+    assert len(client.exceptions) == 5
+    handler.kill()
+
+
+def test_reports_do_not_block_consumer():
+    class SlowClient(FakeClient):
+        def captureException(self, exc_info, extra):
+            gevent.sleep(0.5)
+            super(SlowClient, self).captureException(exc_info, extra)
+
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.multipublish('topic', [b'%d' % i for i in range(20)])
+        producer.close()
+
+        handler = AggregatingSentryExceptionHandler(SlowClient())
+        handled = []
+
+        def message_handler(consumer, message):
+            handled.append(message)
+            raise RuntimeError('dependency down')
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_tries=1,
+            max_backoff_duration=0.01, requeue_delay=0, max_in_flight=20,
+            message_handler=message_handler)
+        consumer.on_exception.connect(handler, weak=False)
+        consumer.start(block=False)
+
+        with gevent.Timeout(0.4):
+            while len(handled) < 20:
+                gevent.sleep(0.01)
+
+        consumer.close()
+        consumer.join()
+        assert handler.reported.value == 0
+        assert handler.suppressed.value == 19
+        handler.kill()
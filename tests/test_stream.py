@@ -0,0 +1,111 @@
+import struct
+import zlib
+
+import pytest
+
+from gnsq.stream.stream import Stream, DefalteSocket, SnappySocket
+
+
+class ChunkedSocket(object):
+    """Fake socket returning ``data`` ``chunk_size`` bytes at a time."""
+
+    def __init__(self, data, chunk_size=1):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.reads = 0
+        self.sent = b''
+
+    def recv(self, size):
+        self.reads += 1
+        size = min(size, self.chunk_size)
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+    def sendall(self, data):
+        self.sent += data
+
+    def close(self):
+        pass
+
+
+def deflate(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def snappy(data):
+    import snappy
+    return snappy.StreamCompressor().add_chunk(data, compress=True)
+
+
+def make_stream(socket):
+    stream = Stream('127.0.0.1', 4150, 1)
+    stream.socket = socket
+    return stream
+
+
+FRAME = struct.pack('>l', 11) + b'hello world'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 4096])
+def test_read_plain(chunk_size):
+    stream = make_stream(ChunkedSocket(FRAME, chunk_size))
+    assert stream.read(4) == FRAME[:4]
+    assert stream.read(11) == b'hello world'
+    assert isinstance(stream.buffer, bytearray)
+    assert not stream.buffer
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 4096])
+def test_read_deflate(chunk_size):
+    socket = ChunkedSocket(deflate(FRAME), chunk_size)
+    stream = make_stream(socket)
+    stream.upgrade_to_defalte(6)
+
+    assert isinstance(stream.socket, DefalteSocket)
+    assert stream.read(4) == FRAME[:4]
+    assert stream.read(11) == b'hello world'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 4096])
+def test_read_snappy(chunk_size):
+    if SnappySocket is None:
+        pytest.skip('python-snappy is not installed')
+
+    socket = ChunkedSocket(snappy(FRAME), chunk_size)
+    stream = make_stream(socket)
+    stream.upgrade_to_snappy()
+
+    assert stream.read(len(FRAME)) == FRAME
+
+
+def test_deflate_bootstrap():
+    data = deflate(FRAME)
+    socket = ChunkedSocket(data[3:])
+    stream = make_stream(socket)
+    stream.buffer.extend(data[:3])
+    stream.upgrade_to_defalte(6)
+
+    assert stream.read(len(FRAME)) == FRAME
+
+
+def test_compressed_eof():
+    socket = ChunkedSocket(deflate(FRAME)[:5])
+    stream = make_stream(socket)
+    stream.upgrade_to_defalte(6)
+
+    with pytest.raises(Exception):
+        stream.read(len(FRAME))
+
+    assert not stream.is_connected
+
+
+def test_compression_socket_recv():
+    socket = DefalteSocket(ChunkedSocket(deflate(FRAME)), 6)
+    data = b''
+    while True:
+        chunk = socket.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    assert data == FRAME
@@ -0,0 +1,97 @@
+import gevent
+
+from gnsq import Consumer, Producer
+from gnsq import consumer as consumer_module
+from gnsq.timerwheel import TimerWheel
+from gnsq.testing import FakeNsqd
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timer_wheel():
+    clock = Clock()
+    wheel = TimerWheel(tick=1, slots=4, clock=clock)
+    fired = []
+
+    wheel.schedule(0, fired.append, 'now')
+    wheel.schedule(2, fired.append, 'two')
+    wheel.schedule(9, fired.append, 'nine')
+    wheel.schedule(3, fired.append, 'cancelled').cancel()
+    assert len(wheel) == 4
+
+    assert wheel.advance() == 0
+    clock.now += 1
+    assert wheel.advance() == 1
+    assert fired == ['now']
+
+    clock.now += 2
+    assert wheel.advance() == 1
+    assert fired == ['now', 'two']
+    assert len(wheel) == 1
+
+    # more than a full turn later
+    clock.now += 20
+    assert wheel.advance() == 1
+    assert fired == ['now', 'two', 'nine']
+    assert len(wheel) == 0
+
+
+def test_timer_wheel_error():
+    clock = Clock()
+    wheel = TimerWheel(tick=1, slots=4, clock=clock)
+    fired = []
+
+    def fail():
+        raise RuntimeError('boom')
+
+    wheel.schedule(1, fired.append, 'before')
+    wheel.schedule(1, fail)
+    wheel.schedule(1, fired.append, 'after')
+
+    clock.now += 1
+    assert wheel.advance() == 3
+    assert fired == ['before', 'after']
+    assert len(wheel) == 0
+
+
+def test_auto_touch(monkeypatch):
+    monkeypatch.setattr(consumer_module, 'AUTO_TOUCH_TICK', 0.01)
+
+    with FakeNsqd(msg_timeout=0.1) as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+        producer.publish('topic', b'slow')
+        producer.publish('topic', b'stuck')
+        producer.close()
+
+        handled = []
+
+        def handler(consumer, message):
+            handled.append((message.body, message.attempts))
+            if message.body == b'slow':
+                gevent.sleep(0.2)
+            else:
+                message.enable_async()
+
+        consumer = Consumer(
+            'topic', 'channel', nsqd.tcp_address, max_in_flight=2,
+            message_handler=handler, auto_touch=True, max_auto_touches=3)
+
+        consumer.start(block=False)
+        with gevent.Timeout(2):
+            # touched three times, then redelivered
+            while (b'stuck', 2) not in handled:
+                gevent.sleep(0.01)
+
+        conn, = consumer._connections
+        assert conn.msg_timeout == 100
+        consumer.close()
+
+        assert (b'slow', 1) in handled
+        assert (b'slow', 2) not in handled
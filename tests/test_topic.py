@@ -0,0 +1,68 @@
+import pytest
+
+from gnsq import NsqdHTTPClient, NsqdTCPClient, Producer, errors
+from gnsq import protocol as nsq
+from gnsq.testing import FakeNsqd
+
+RESPONSE_OK = (nsq.FRAME_TYPE_RESPONSE, nsq.OK)
+
+
+def test_encoder():
+    encoder = nsq.TopicEncoder('topic')
+    assert encoder.publish(b'data') == nsq.publish('topic', b'data')
+    assert encoder.multipublish([b'a', b'b']) == \
+        nsq.multipublish('topic', [b'a', b'b'])
+    assert encoder.deferpublish(b'data', 42) == \
+        nsq.deferpublish('topic', b'data', 42)
+
+    pytest.raises(ValueError, nsq.TopicEncoder, 'invalid topic')
+    pytest.raises(TypeError, encoder.publish, u'unicode body')
+
+
+def test_producer_topic():
+    with FakeNsqd() as nsqd:
+        producer = Producer(nsqd.tcp_address)
+        producer.start()
+
+        topic = producer.topic('topic')
+        assert producer.topic('topic') is topic
+        assert topic.name == 'topic'
+
+        assert topic.publish(b'one') == nsq.OK
+        assert topic.multipublish(iter([b'two', b'three'])) == nsq.OK
+        assert topic.defer(b'four', 10) == nsq.OK
+        topic.publish(b'five', raise_error=False).get(timeout=5)
+
+        with pytest.raises(TypeError):
+            topic.publish(u'unicode body')
+
+        producer.close()
+
+        assert topic.stats.to_dict() == {
+            'requests': 4, 'messages': 5, 'bytes': 19, 'errors': 1}
+        assert nsqd.stats()['topics'][0]['message_count'] == 5
+
+
+def test_client_topics():
+    with FakeNsqd() as nsqd:
+        conn = NsqdTCPClient('127.0.0.1', nsqd.tcp_port)
+        conn.connect()
+
+        topic = conn.topic('topic')
+        topic.publish(b'one')
+        assert conn.read_response() == RESPONSE_OK
+        topic.multipublish([b'two', b'three'])
+        assert conn.read_response() == RESPONSE_OK
+        conn.close_stream()
+
+        http = NsqdHTTPClient('127.0.0.1', nsqd.http_port)
+        topic = http.topic('topic')
+        assert topic.publish(b'four') == b'OK'
+        assert topic.multipublish([b'five', b'six'], binary=True) == b'OK'
+
+        with pytest.raises(errors.NSQException):
+            topic.multipublish([b'new\nline'])
+
+        assert topic.stats.to_dict() == {
+            'requests': 2, 'messages': 3, 'bytes': 11, 'errors': 1}
+        assert nsqd.stats()['topics'][0]['message_count'] == 6